@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+#
+# instrumentation.py -- timing of the database calls made by tournament.py
+#
+# Nothing is recorded until enable() is called with one or more sinks, and
+# disable() turns recording off again at any time. While disabled, each
+# instrumented call costs one check of a module global.
+
+import bisect
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from functools import wraps
+
+import psycopg2
+import psycopg2.extensions
+
+# What a sink is handed for every measurement:
+#   kind: "function", "query", "connect", "acquire", "commit" or "slow_query"
+#   name: the function name, or the query text with literal VALUES lists cut
+#   function: the tournament.py function it happened in (for a function, its
+#     caller), or None outside of one
+#   seconds: wall time
+#   rows: rows returned or changed by a query, else None
+#   plan: the EXPLAIN ANALYZE output of a slow query, else None
+Event = namedtuple('Event', 'kind name function seconds rows plan')
+
+_sinks = ()
+_slow_query_seconds = None
+_local = threading.local()
+_logger = logging.getLogger('tournament.instrumentation')
+_clock = getattr(time, 'perf_counter', time.time)
+
+# execute_values expands every row into the statement; group them as one query
+_VALUES_LIST = re.compile(r'\bVALUES\s*\(.*', re.IGNORECASE | re.DOTALL)
+_WHITESPACE = re.compile(r'\s+')
+# Statements that EXPLAIN ANALYZE can run
+_EXPLAINABLE = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|WITH|VALUES)\b', re.IGNORECASE)
+_EXECUTE = re.compile(r'^\s*EXECUTE\s+(\w+)', re.IGNORECASE)
+# The names of the queries behind prepared statements, so that running one is
+# grouped under its query rather than its EXECUTE
+_prepared_names = {}
+
+
+def enable(*sinks, **options):
+    """
+    Start sending measurements to the given sinks, replacing any before.
+    :param sinks:objects with a handle(event) method, e.g. Histogram()
+    :param slow_query_ms:optional; queries slower than this also produce a
+    "slow_query" event carrying their EXPLAIN ANALYZE plan
+    """
+    global _sinks, _slow_query_seconds
+    if not sinks:
+        raise ValueError("No Sinks Given")
+    slow_query_ms = options.pop('slow_query_ms', None)
+    if options:
+        raise TypeError("Unexpected options: {0}".format(sorted(options)))
+    _slow_query_seconds = None if slow_query_ms is None else slow_query_ms / 1000.0
+    _sinks = tuple(sinks)
+
+def disable():
+    """Stop recording. Sinks keep what they have already collected."""
+    global _sinks, _slow_query_seconds
+    _sinks = ()
+    _slow_query_seconds = None
+
+def isEnabled():
+    return bool(_sinks)
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+def _current():
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+def _emit(event):
+    # A failing sink is logged rather than raised into the call it measured,
+    # which has done its work already
+    for sink in _sinks:
+        try:
+            sink.handle(event)
+        except Exception:
+            _logger.exception("Instrumentation sink %r failed", sink)
+
+def record(kind, name, seconds, rows=None, plan=None):
+    """Send a measurement taken elsewhere to the sinks, if recording is on."""
+    if _sinks:
+        _emit(Event(kind, name, _current(), seconds, rows, plan))
+
+
+def timed(function):
+    """Decorator recording every call of a function as a "function" event."""
+    name = function.__name__
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _sinks:
+            return function(*args, **kwargs)
+        stack = _stack()
+        caller = stack[-1] if stack else None
+        stack.append(name)
+        start = _clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            seconds = _clock() - start
+            stack.pop()
+            _emit(Event('function', name, caller, seconds, None, None))
+    return wrapper
+
+
+class _Timing(object):
+    """Times a with block as one event of the given kind."""
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+
+    def __enter__(self):
+        self.start = _clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self.kind, self.name, _clock() - self.start)
+
+
+class _NotTiming(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_NOT_TIMING = _NotTiming()
+
+def timing(kind, name=None):
+    """Returns a context manager timing its block, or doing nothing while disabled."""
+    if not _sinks:
+        return _NOT_TIMING
+    return _Timing(kind, name or kind)
+
+def connect(dsn):
+    """psycopg2.connect, recorded as a "connect" event."""
+    with timing('connect'):
+        return psycopg2.connect(dsn)
+
+
+def namePreparedStatement(statement, query):
+    """Groups every EXECUTE of a prepared statement under the name of the query it runs."""
+    _prepared_names[statement] = queryName(query)
+
+def queryName(query):
+    """
+    Returns the text a query is grouped under: one line, without literal
+    VALUES lists, or for the EXECUTE of a named prepared statement, the
+    name of its query.
+    """
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    execute = _EXECUTE.match(query)
+    if execute is not None and execute.group(1) in _prepared_names:
+        return _prepared_names[execute.group(1)]
+    query = _VALUES_LIST.sub('VALUES ...', query)
+    return _WHITESPACE.sub(' ', query).strip()
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """A cursor recording each execute() as a "query" event.
+
+    With a slow-query threshold set, a statement that takes longer is run
+    again under EXPLAIN ANALYZE, inside a savepoint that is then rolled back
+    so that nothing it writes is kept. Only statements in a transaction are
+    explained. The second run costs as much as the first, and its inserts
+    still use up sequence values.
+    """
+
+    def execute(self, query, vars=None):
+        if not _sinks:
+            return super(TimedCursor, self).execute(query, vars)
+        start = _clock()
+        try:
+            result = super(TimedCursor, self).execute(query, vars)
+        except Exception:
+            record('query', queryName(query), _clock() - start)
+            raise
+        seconds = _clock() - start
+        record('query', queryName(query), seconds, self.rowcount)
+        if _slow_query_seconds is not None and seconds > _slow_query_seconds:
+            self._explain(query, seconds)
+        return result
+
+    def executemany(self, query, vars_list):
+        if not _sinks:
+            return super(TimedCursor, self).executemany(query, vars_list)
+        with timing('query', queryName(query)):
+            return super(TimedCursor, self).executemany(query, vars_list)
+
+    def _explain(self, query, seconds):
+        connection = self.connection
+        if (connection.autocommit or not _EXPLAINABLE.match(queryName(query)) or
+                connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_INTRANS):
+            return
+        cursor = connection.cursor()
+        cursor.execute("SAVEPOINT instrumentation_explain")
+        try:
+            # The statement as sent, with its parameters already filled in
+            cursor.execute(b"EXPLAIN ANALYZE " + self.query)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        except psycopg2.Error:
+            plan = None
+        finally:
+            cursor.execute("ROLLBACK TO SAVEPOINT instrumentation_explain")
+            cursor.execute("RELEASE SAVEPOINT instrumentation_explain")
+            cursor.close()
+        if plan is not None:
+            record('slow_query', queryName(query), seconds, self.rowcount, plan)
+
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+class Histogram(object):
+    """An in-memory sink keeping a latency histogram per (kind, name)."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def handle(self, event):
+        key = (event.kind, event.name)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'count': 0,
+                                              'seconds': 0.0, 'rows': 0}
+            series['counts'][bisect.bisect_left(self.buckets, event.seconds)] += 1
+            series['count'] += 1
+            series['seconds'] += event.seconds
+            if event.rows is not None and event.rows > 0:
+                series['rows'] += event.rows
+
+    def snapshot(self):
+        """
+        Returns {(kind, name): series} for everything recorded so far, each
+        series holding per-bucket counts, the count, total seconds and rows.
+        """
+        with self._lock:
+            return dict((key, dict(series, counts=list(series['counts'])))
+                        for key, series in self._series.items())
+
+    def percentile(self, kind, name, fraction):
+        """Returns the upper bound of the bucket holding the given percentile, in seconds."""
+        series = self.snapshot().get((kind, name))
+        if not series:
+            return None
+        rank = fraction * series['count']
+        seen = 0
+        for bound, count in zip(self.buckets, series['counts']):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def top(self, kind, limit=10):
+        """Returns the (name, total seconds, count) of the names with the most time in a kind."""
+        totals = [(name, series['seconds'], series['count'])
+                  for (series_kind, name), series in self.snapshot().items() if series_kind == kind]
+        totals.sort(key=lambda total: -total[1])
+        return totals[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+
+class LogSink(object):
+    """A sink writing each event as one JSON object to a logging.Logger.
+
+    Slow queries are logged at WARNING, everything else at DEBUG.
+    """
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger('tournament.instrumentation')
+
+    def handle(self, event):
+        level = logging.WARNING if event.kind == 'slow_query' else logging.DEBUG
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, json.dumps(event._asdict(), sort_keys=True))
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Prometheus metric name and label for each kind of event
+_METRICS = {
+    'function': ('tournament_function_seconds', 'function'),
+    'query': ('tournament_query_seconds', 'query'),
+    'connect': ('tournament_connect_seconds', 'step'),
+    'acquire': ('tournament_connection_acquire_seconds', 'step'),
+    'commit': ('tournament_commit_seconds', 'step'),
+    'slow_query': ('tournament_slow_query_seconds', 'query'),
+}
+
+def prometheusText(histogram):
+    """Renders a Histogram in the Prometheus text exposition format."""
+    lines = []
+    snapshot = histogram.snapshot()
+    for kind in sorted(_METRICS):
+        metric, label = _METRICS[kind]
+        series = sorted((name, values) for (series_kind, name), values in snapshot.items()
+                        if series_kind == kind)
+        if not series:
+            continue
+        lines.append("# TYPE {0} histogram".format(metric))
+        for name, values in series:
+            labels = '{0}="{1}"'.format(label, _label(name))
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, values['counts']):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(metric, labels, le, cumulative))
+            lines.append('{0}_sum{{{1}}} {2!r}'.format(metric, labels, values['seconds']))
+            lines.append('{0}_count{{{1}}} {2}'.format(metric, labels, values['count']))
+        if kind == 'query':
+            lines.append("# TYPE tournament_query_rows_total counter")
+            for name, values in series:
+                lines.append('tournament_query_rows_total{{query="{0}"}} {1}'.format(_label(name), values['rows']))
+    return "\n".join(lines) + "\n"
+
+
+# Python 2 has no os.replace; os.rename replaces the target too, except on Windows
+_replace = getattr(os, 'replace', os.rename)
+
+class PrometheusFileSink(object):
+    """A sink keeping its own Histogram and dumping it to a file for Prometheus.
+
+    The file is rewritten at most once every interval seconds, when an event
+    arrives, and on flush(). It is written to a temporary file of its own in
+    the same directory first and renamed into place, so a scraper never
+    reads half a dump. Threads sharing a sink take turns to write it, and
+    those arriving together at the end of an interval write it once.
+    """
+
+    def __init__(self, path, interval=15.0):
+        self.path = path
+        self.interval = interval
+        self.histogram = Histogram()
+        self._written = 0.0
+        self._lock = threading.Lock()
+
+    def handle(self, event):
+        self.histogram.handle(event)
+        if time.time() - self._written >= self.interval:
+            with self._lock:
+                # Another thread may have written it while this one waited
+                if time.time() - self._written >= self.interval:
+                    self._write()
+
+    def flush(self):
+        with self._lock:
+            self._write()
+
+    def _write(self):
+        self._written = time.time()
+        directory, name = os.path.split(os.path.abspath(self.path))
+        descriptor, temporary = tempfile.mkstemp(prefix=name + '.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(descriptor, 'w') as dump:
+                dump.write(prometheusText(self.histogram))
+            # mkstemp makes the file readable by its owner only
+            os.chmod(temporary, 0o644)
+            _replace(temporary, self.path)
+        except Exception:
+            os.remove(temporary)
+            raise
@@ -0,0 +1,80 @@
+-- Adds the standings table of tournament.sql and the triggers that keep it, and fills it in from the memberships and
+-- matches already recorded. Every later migration changes this table, so run this one first.
+--
+-- Run it with "psql -d tournament -f migrations/0000_standings.sql". Nothing is done on a database that already has
+-- the standings table, so running it twice, or on a database made with tournament.sql, is harmless.
+
+BEGIN;
+
+DO $migration$
+BEGIN
+    IF to_regclass('standings') IS NOT NULL THEN
+        RETURN;
+    END IF;
+
+    CREATE TABLE standings(
+        tournament_id int,
+        player_id int,
+        wins int not null default 0,
+        matches int not null default 0,
+        primary key(tournament_id, player_id),
+        foreign key(player_id, tournament_id) references players_in_tournaments(player_id, tournament_id)
+            on delete cascade
+    );
+
+    -- Start an empty record for every player added to a tournament
+    CREATE FUNCTION standings_add_players() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO standings(tournament_id, player_id)
+        SELECT tournament_id, player_id FROM new_players;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER players_in_tournaments_standings AFTER INSERT ON players_in_tournaments
+    REFERENCING NEW TABLE AS new_players
+    FOR EACH STATEMENT EXECUTE PROCEDURE standings_add_players();
+
+    -- Add inserted matches to, and take deleted matches off, the records of both players
+    CREATE FUNCTION standings_count_matches() RETURNS trigger AS $$
+    DECLARE
+        changed text := CASE TG_OP WHEN 'INSERT' THEN 'new_matches' ELSE 'old_matches' END;
+        sign int := CASE TG_OP WHEN 'INSERT' THEN 1 ELSE -1 END;
+    BEGIN
+        EXECUTE format($query$
+            UPDATE standings SET wins = standings.wins + %2$s * results.wins,
+                                 matches = standings.matches + %2$s * results.matches
+            FROM (SELECT tournament_id, player_id, SUM(won) AS wins, COUNT(*) AS matches
+                  FROM (SELECT tournament_id, winner_id AS player_id, 1 AS won FROM %1$I
+                        UNION ALL
+                        SELECT tournament_id, loser_id AS player_id, 0 AS won FROM %1$I) AS played
+                  GROUP BY tournament_id, player_id) AS results
+            WHERE standings.tournament_id = results.tournament_id AND standings.player_id = results.player_id
+        $query$, changed, sign);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER matches_inserted_standings AFTER INSERT ON matches
+    REFERENCING NEW TABLE AS new_matches
+    FOR EACH STATEMENT EXECUTE PROCEDURE standings_count_matches();
+
+    CREATE TRIGGER matches_deleted_standings AFTER DELETE ON matches
+    REFERENCING OLD TABLE AS old_matches
+    FOR EACH STATEMENT EXECUTE PROCEDURE standings_count_matches();
+
+    -- Fill in the records of the players already entered, as the triggers would have kept them
+    INSERT INTO standings(tournament_id, player_id)
+    SELECT tournament_id, player_id FROM players_in_tournaments;
+
+    UPDATE standings SET wins = results.wins, matches = results.matches
+    FROM (SELECT tournament_id, player_id, SUM(won) AS wins, COUNT(*) AS matches
+          FROM (SELECT tournament_id, winner_id AS player_id, 1 AS won FROM matches
+                UNION ALL
+                SELECT tournament_id, loser_id AS player_id, 0 AS won FROM matches) AS played
+          GROUP BY tournament_id, player_id) AS results
+    WHERE standings.tournament_id = results.tournament_id AND standings.player_id = results.player_id;
+END;
+$migration$;
+
+COMMIT;
@@ -0,0 +1,15 @@
+-- Adds the indexes and the check constraint of tournament.sql to an existing tournament database.
+--
+-- Run it with "psql -d tournament -f migrations/0001_match_indexes.sql". Every statement runs on its own, so the
+-- indexes are built concurrently without blocking match reporting, and running it twice is harmless.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS matches_tournament_winner_idx ON matches(tournament_id, winner_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS matches_tournament_loser_idx ON matches(tournament_id, loser_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS matches_winner_idx ON matches(winner_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS matches_loser_idx ON matches(loser_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS players_in_tournaments_tournament_idx ON players_in_tournaments(tournament_id);
+
+-- Add the check without scanning matches under a lock, then validate the existing rows separately.
+ALTER TABLE matches DROP CONSTRAINT IF EXISTS matches_different_players;
+ALTER TABLE matches ADD CONSTRAINT matches_different_players CHECK (winner_id <> loser_id) NOT VALID;
+ALTER TABLE matches VALIDATE CONSTRAINT matches_different_players;
@@ -0,0 +1,29 @@
+-- Adds the standings_changed notifications of tournament.sql to an existing tournament database.
+--
+-- Run it with "psql -d tournament -f migrations/0002_standings_notify.sql". Running it twice is harmless.
+
+CREATE OR REPLACE FUNCTION standings_notify() RETURNS trigger AS $$
+DECLARE
+    changed text := CASE TG_OP WHEN 'DELETE' THEN 'old_standings' ELSE 'new_standings' END;
+BEGIN
+    EXECUTE format($query$
+        SELECT pg_notify('standings_changed', tournament_id::text) FROM (SELECT DISTINCT tournament_id FROM %I) AS tournaments
+    $query$, changed);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS standings_inserted_notify ON standings;
+CREATE TRIGGER standings_inserted_notify AFTER INSERT ON standings
+REFERENCING NEW TABLE AS new_standings
+FOR EACH STATEMENT EXECUTE PROCEDURE standings_notify();
+
+DROP TRIGGER IF EXISTS standings_updated_notify ON standings;
+CREATE TRIGGER standings_updated_notify AFTER UPDATE ON standings
+REFERENCING NEW TABLE AS new_standings
+FOR EACH STATEMENT EXECUTE PROCEDURE standings_notify();
+
+DROP TRIGGER IF EXISTS standings_deleted_notify ON standings;
+CREATE TRIGGER standings_deleted_notify AFTER DELETE ON standings
+REFERENCING OLD TABLE AS old_standings
+FOR EACH STATEMENT EXECUTE PROCEDURE standings_notify();
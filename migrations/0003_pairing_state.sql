@@ -0,0 +1,77 @@
+-- Adds the pairing state columns of tournament.sql to the standings of an existing tournament database.
+--
+-- Run it with "psql -d tournament -f migrations/0003_pairing_state.sql". Opponents are filled in from the matches
+-- already played; floats cannot be worked out after the fact, so they start counting from the next match reported.
+
+BEGIN;
+
+ALTER TABLE standings ADD COLUMN IF NOT EXISTS opponents int[] not null default '{}';
+ALTER TABLE standings ADD COLUMN IF NOT EXISTS up_floats int not null default 0;
+ALTER TABLE standings ADD COLUMN IF NOT EXISTS down_floats int not null default 0;
+ALTER TABLE standings ADD COLUMN IF NOT EXISTS last_float smallint not null default 0;
+
+UPDATE standings SET opponents = played.opponents
+FROM (SELECT tournament_id, player_id, array_agg(opponent_id ORDER BY match_id) AS opponents
+      FROM (SELECT match_id, tournament_id, winner_id AS player_id, loser_id AS opponent_id FROM matches
+            UNION ALL
+            SELECT match_id, tournament_id, loser_id, winner_id FROM matches) AS sides
+      GROUP BY tournament_id, player_id) AS played
+WHERE standings.tournament_id = played.tournament_id AND standings.player_id = played.player_id;
+
+-- Add inserted matches to, and take deleted matches off, the records of both players.
+-- The triggers run once per statement, so a whole round reported at once is a single update.
+CREATE OR REPLACE FUNCTION standings_count_matches() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        -- Floats compare the wins of both players before this statement's results are counted.
+        UPDATE standings SET wins = standings.wins + results.wins,
+                             matches = standings.matches + results.matches,
+                             opponents = standings.opponents || results.opponents,
+                             up_floats = standings.up_floats + results.up_floats,
+                             down_floats = standings.down_floats + results.down_floats,
+                             last_float = results.last_float
+        FROM (SELECT played.tournament_id, played.player_id, SUM(played.won) AS wins, COUNT(*) AS matches,
+                     array_agg(played.opponent_id ORDER BY played.match_id) AS opponents,
+                     COUNT(*) FILTER (WHERE opponent.wins > player.wins) AS up_floats,
+                     COUNT(*) FILTER (WHERE opponent.wins < player.wins) AS down_floats,
+                     (array_agg(sign(opponent.wins - player.wins) ORDER BY played.match_id DESC))[1] AS last_float
+              FROM (SELECT match_id, tournament_id, winner_id AS player_id, loser_id AS opponent_id, 1 AS won
+                    FROM new_matches
+                    UNION ALL
+                    SELECT match_id, tournament_id, loser_id, winner_id, 0 FROM new_matches) AS played
+              JOIN standings AS player
+                ON player.tournament_id = played.tournament_id AND player.player_id = played.player_id
+              JOIN standings AS opponent
+                ON opponent.tournament_id = played.tournament_id AND opponent.player_id = played.opponent_id
+              GROUP BY played.tournament_id, played.player_id) AS results
+        WHERE standings.tournament_id = results.tournament_id AND standings.player_id = results.player_id;
+    ELSE
+        -- Opponents are listed again from the matches left. Floats cannot be worked out again after the fact,
+        -- so they are only cleared once a player has no matches left.
+        UPDATE standings SET wins = standings.wins - results.wins,
+                             matches = standings.matches - results.matches,
+                             opponents = ARRAY(SELECT CASE WHEN matches.winner_id = standings.player_id
+                                                           THEN matches.loser_id ELSE matches.winner_id END
+                                               FROM matches
+                                               WHERE matches.tournament_id = standings.tournament_id
+                                                 AND (matches.winner_id = standings.player_id
+                                                      OR matches.loser_id = standings.player_id)
+                                               ORDER BY matches.match_id),
+                             up_floats = CASE WHEN standings.matches = results.matches THEN 0
+                                              ELSE standings.up_floats END,
+                             down_floats = CASE WHEN standings.matches = results.matches THEN 0
+                                                ELSE standings.down_floats END,
+                             last_float = CASE WHEN standings.matches = results.matches THEN 0
+                                               ELSE standings.last_float END
+        FROM (SELECT tournament_id, player_id, SUM(won) AS wins, COUNT(*) AS matches
+              FROM (SELECT tournament_id, winner_id AS player_id, 1 AS won FROM old_matches
+                    UNION ALL
+                    SELECT tournament_id, loser_id AS player_id, 0 AS won FROM old_matches) AS played
+              GROUP BY tournament_id, player_id) AS results
+        WHERE standings.tournament_id = results.tournament_id AND standings.player_id = results.player_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
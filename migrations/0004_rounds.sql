@@ -0,0 +1,43 @@
+-- Adds the rounds of tournament.sql to an existing tournament database.
+--
+-- Run it with "psql -d tournament -f migrations/0004_rounds.sql". Matches already played keep a null round_no, as if
+-- they had been reported before any round was started. Running it twice is harmless.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS rounds(
+    tournament_id int references tournaments(tournament_id) on delete cascade,
+    round_no int,
+    started_at timestamptz not null default now(),
+    primary key(tournament_id, round_no),
+    constraint rounds_positive check (round_no > 0)
+);
+
+ALTER TABLE matches ADD COLUMN IF NOT EXISTS round_no int;
+ALTER TABLE matches DROP CONSTRAINT IF EXISTS matches_tournament_id_round_no_fkey;
+-- Every existing round_no is null, so there is nothing for the constraint to check.
+ALTER TABLE matches ADD CONSTRAINT matches_tournament_id_round_no_fkey
+    FOREIGN KEY (tournament_id, round_no) REFERENCES rounds(tournament_id, round_no) ON DELETE CASCADE;
+CREATE INDEX IF NOT EXISTS matches_tournament_round_idx ON matches(tournament_id, round_no);
+
+CREATE TABLE IF NOT EXISTS round_pairings(
+    tournament_id int,
+    round_no int,
+    board int,
+    player1_id int references players(player_id) on delete cascade,
+    player2_id int references players(player_id) on delete cascade,
+    primary key(tournament_id, round_no, board),
+    foreign key(tournament_id, round_no) references rounds(tournament_id, round_no) on delete cascade
+);
+
+CREATE TABLE IF NOT EXISTS standings_snapshots(
+    tournament_id int,
+    round_no int,
+    player_id int references players(player_id) on delete cascade,
+    wins int not null,
+    matches int not null,
+    primary key(tournament_id, round_no, player_id),
+    foreign key(tournament_id, round_no) references rounds(tournament_id, round_no) on delete cascade
+);
+
+COMMIT;
@@ -0,0 +1,100 @@
+-- Adds the byes and draws of tournament.sql to an existing tournament database.
+--
+-- Run it with "psql -d tournament -f migrations/0005_byes_and_draws.sql". Every match already played is a win, so
+-- points start at twice the wins and nobody has had a bye. Running it twice is harmless.
+
+BEGIN;
+
+DO $$
+BEGIN
+    CREATE TYPE match_result AS ENUM ('win', 'draw', 'bye');
+EXCEPTION WHEN duplicate_object THEN
+    NULL;
+END;
+$$;
+
+ALTER TABLE matches ADD COLUMN IF NOT EXISTS result match_result not null default 'win';
+ALTER TABLE matches DROP CONSTRAINT IF EXISTS matches_bye_has_no_loser;
+ALTER TABLE matches ADD CONSTRAINT matches_bye_has_no_loser CHECK ((result = 'bye') = (loser_id IS NULL));
+CREATE UNIQUE INDEX IF NOT EXISTS matches_one_bye_idx ON matches(tournament_id, winner_id) WHERE result = 'bye';
+
+ALTER TABLE standings ADD COLUMN IF NOT EXISTS points smallint not null default 0;
+ALTER TABLE standings ADD COLUMN IF NOT EXISTS byes int not null default 0;
+UPDATE standings SET points = 2 * wins WHERE points <> 2 * wins AND byes = 0
+    AND NOT EXISTS (SELECT 1 FROM matches WHERE matches.tournament_id = standings.tournament_id
+                                           AND matches.result <> 'win');
+
+ALTER TABLE standings_snapshots ADD COLUMN IF NOT EXISTS points smallint;
+UPDATE standings_snapshots SET points = 2 * wins WHERE points IS NULL;
+ALTER TABLE standings_snapshots ALTER COLUMN points SET NOT NULL;
+
+CREATE OR REPLACE FUNCTION standings_count_matches() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        -- Floats compare the points of both players before this statement's results are counted.
+        UPDATE standings SET wins = standings.wins + results.wins,
+                             matches = standings.matches + results.matches,
+                             points = standings.points + results.points,
+                             byes = standings.byes + results.byes,
+                             opponents = standings.opponents || results.opponents,
+                             up_floats = standings.up_floats + results.up_floats,
+                             down_floats = standings.down_floats + results.down_floats,
+                             last_float = results.last_float
+        FROM (SELECT played.tournament_id, played.player_id, SUM(played.won) AS wins, COUNT(*) AS matches,
+                     SUM(played.points) AS points, COUNT(*) FILTER (WHERE played.opponent_id IS NULL) AS byes,
+                     COALESCE(array_agg(played.opponent_id ORDER BY played.match_id)
+                              FILTER (WHERE played.opponent_id IS NOT NULL), '{}') AS opponents,
+                     COUNT(*) FILTER (WHERE opponent.points > player.points) AS up_floats,
+                     COUNT(*) FILTER (WHERE opponent.points < player.points) AS down_floats,
+                     COALESCE((array_agg(sign(opponent.points - player.points) ORDER BY played.match_id DESC))[1],
+                              0) AS last_float
+              FROM (SELECT match_id, tournament_id, winner_id AS player_id, loser_id AS opponent_id,
+                           CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                           CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points
+                    FROM new_matches
+                    UNION ALL
+                    SELECT match_id, tournament_id, loser_id, winner_id, 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END
+                    FROM new_matches WHERE result <> 'bye') AS played
+              JOIN standings AS player
+                ON player.tournament_id = played.tournament_id AND player.player_id = played.player_id
+              LEFT JOIN standings AS opponent
+                ON opponent.tournament_id = played.tournament_id AND opponent.player_id = played.opponent_id
+              GROUP BY played.tournament_id, played.player_id) AS results
+        WHERE standings.tournament_id = results.tournament_id AND standings.player_id = results.player_id;
+    ELSE
+        -- Opponents are listed again from the matches left. Floats cannot be worked out again after the fact,
+        -- so they are only cleared once a player has no matches left.
+        UPDATE standings SET wins = standings.wins - results.wins,
+                             matches = standings.matches - results.matches,
+                             points = standings.points - results.points,
+                             byes = standings.byes - results.byes,
+                             opponents = ARRAY(SELECT CASE WHEN matches.winner_id = standings.player_id
+                                                           THEN matches.loser_id ELSE matches.winner_id END
+                                               FROM matches
+                                               WHERE matches.tournament_id = standings.tournament_id
+                                                 AND (matches.winner_id = standings.player_id
+                                                      OR matches.loser_id = standings.player_id)
+                                                 AND matches.result <> 'bye'
+                                               ORDER BY matches.match_id),
+                             up_floats = CASE WHEN standings.matches = results.matches THEN 0
+                                              ELSE standings.up_floats END,
+                             down_floats = CASE WHEN standings.matches = results.matches THEN 0
+                                                ELSE standings.down_floats END,
+                             last_float = CASE WHEN standings.matches = results.matches THEN 0
+                                               ELSE standings.last_float END
+        FROM (SELECT tournament_id, player_id, SUM(won) AS wins, COUNT(*) AS matches, SUM(points) AS points,
+                     COUNT(*) FILTER (WHERE bye) AS byes
+              FROM (SELECT tournament_id, winner_id AS player_id, CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                           CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points, result = 'bye' AS bye
+                    FROM old_matches
+                    UNION ALL
+                    SELECT tournament_id, loser_id, 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END, false
+                    FROM old_matches WHERE result <> 'bye') AS played
+              GROUP BY tournament_id, player_id) AS results
+        WHERE standings.tournament_id = results.tournament_id AND standings.player_id = results.player_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
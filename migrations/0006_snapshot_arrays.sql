@@ -0,0 +1,37 @@
+-- Stores each round's standings snapshot of tournament.sql as one row of arrays instead of one row per player.
+--
+-- Run it with "psql -d tournament -f migrations/0006_snapshot_arrays.sql" after 0005_byes_and_draws.sql. Existing
+-- snapshots are carried over in standings order. Running it twice is harmless.
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_name = 'standings_snapshots' AND column_name = 'player_id') THEN
+        ALTER TABLE standings_snapshots RENAME TO standings_snapshots_by_player;
+        ALTER TABLE standings_snapshots_by_player RENAME CONSTRAINT standings_snapshots_pkey
+            TO standings_snapshots_by_player_pkey;
+        ALTER TABLE standings_snapshots_by_player RENAME CONSTRAINT standings_snapshots_tournament_id_round_no_fkey
+            TO standings_snapshots_by_player_round_fkey;
+        CREATE TABLE standings_snapshots(
+            tournament_id int,
+            round_no int,
+            player_ids int[] not null,
+            wins int[] not null,
+            matches int[] not null,
+            points smallint[] not null,
+            primary key(tournament_id, round_no),
+            foreign key(tournament_id, round_no) references rounds(tournament_id, round_no) on delete cascade
+        );
+        INSERT INTO standings_snapshots(tournament_id, round_no, player_ids, wins, matches, points)
+        SELECT tournament_id, round_no, array_agg(player_id ORDER BY points DESC, player_id),
+               array_agg(wins ORDER BY points DESC, player_id), array_agg(matches ORDER BY points DESC, player_id),
+               array_agg(points ORDER BY points DESC, player_id)
+        FROM standings_snapshots_by_player GROUP BY tournament_id, round_no;
+        DROP TABLE standings_snapshots_by_player;
+    END IF;
+END;
+$$;
+
+COMMIT;
@@ -0,0 +1,23 @@
+-- Adds the pairing_candidates() function of tournament.sql, for swissPairings(server_side=True).
+--
+-- Run it with "psql -d tournament -f migrations/0007_pairing_candidates.sql" after 0005_byes_and_draws.sql. It only
+-- reads the standings, so nothing needs filling in. Running it twice is harmless.
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION pairing_candidates(p_tournament int, p_window int)
+RETURNS TABLE(seat bigint, player_id int, player_name text, points smallint, byes int, candidates int[]) AS $$
+    SELECT seat, player_id, player_name, points, byes,
+           ARRAY(SELECT candidate FROM unnest(following) AS candidate WHERE candidate <> ALL(opponents))
+    FROM (SELECT standings.player_id, players.player_name, standings.points, standings.byes, standings.opponents,
+                 row_number() OVER seats AS seat,
+                 array_agg(standings.player_id) OVER (seats ROWS BETWEEN 1 FOLLOWING AND p_window FOLLOWING)
+                     AS following
+          FROM standings JOIN players ON players.player_id = standings.player_id
+          WHERE standings.tournament_id = p_tournament
+          WINDOW seats AS (ORDER BY standings.points DESC,
+                                    CASE standings.last_float WHEN -1 THEN 0 WHEN 0 THEN 1 ELSE 2 END,
+                                    standings.player_id)) AS ranked
+$$ LANGUAGE sql STABLE;
+
+COMMIT;
@@ -0,0 +1,144 @@
+-- Partitions the matches of tournament.sql by tournament, and adds archive_tournament() and the TRUNCATE
+-- notification of standings.
+--
+-- Run it with "psql -d tournament -f migrations/0008_match_partitions.sql" after 0007_pairing_candidates.sql. Every
+-- tournament gets its matches_[tournament_id] partition and its matches are copied into it, keeping their match_id;
+-- matches without a tournament, from before tournaments existed, are not kept, as they are in no standings. The
+-- standings are left as they are rather than counted again. The whole table is rewritten, so run it while nothing
+-- else uses the database. Running it twice is harmless.
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION matches_add_partition() RETURNS trigger AS $$
+DECLARE
+    partition text := 'matches_' || NEW.tournament_id;
+BEGIN
+    IF to_regclass(quote_ident(partition)) IS NULL THEN
+        EXECUTE format('CREATE TABLE %I (LIKE matches INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition);
+        EXECUTE format('ALTER TABLE matches ATTACH PARTITION %I FOR VALUES IN (%s)', partition, NEW.tournament_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION matches_drop_partitions() RETURNS trigger AS $$
+DECLARE
+    partition text;
+BEGIN
+    FOR partition IN SELECT 'matches_' || tournament_id FROM old_tournaments LOOP
+        IF to_regclass(quote_ident(partition)) IS NOT NULL THEN
+            EXECUTE format('DROP TABLE %I', partition);
+        END IF;
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION drop_match_partitions() RETURNS void AS $$
+DECLARE
+    partition regclass;
+BEGIN
+    FOR partition IN SELECT inhrelid::regclass FROM pg_inherits WHERE inhparent = 'matches'::regclass LOOP
+        EXECUTE format('DROP TABLE %s', partition);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION archive_tournament(p_tournament int) RETURNS text AS $$
+DECLARE
+    partition text := 'matches_' || p_tournament;
+    archive text := 'archived_matches_' || p_tournament;
+    constraint_name name;
+BEGIN
+    EXECUTE format('ALTER TABLE matches DETACH PARTITION %I', partition);
+    FOR constraint_name IN SELECT conname FROM pg_constraint
+                           WHERE conrelid = partition::regclass AND contype = 'f' LOOP
+        EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', partition, constraint_name);
+    END LOOP;
+    EXECUTE format('ALTER TABLE %I ALTER COLUMN match_id DROP DEFAULT', partition);
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', partition, archive);
+    DELETE FROM tournaments WHERE tournament_id = p_tournament;
+    RETURN archive;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    index_name name;
+    tournament int;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'matches'::regclass) = 'r' THEN
+        -- The standings already count every match, so the copy must not count them again
+        DROP TRIGGER IF EXISTS matches_inserted_standings ON matches;
+        DROP TRIGGER IF EXISTS matches_deleted_standings ON matches;
+        ALTER TABLE matches RENAME TO matches_unpartitioned;
+        FOR index_name IN SELECT indexname FROM pg_indexes WHERE tablename = 'matches_unpartitioned' LOOP
+            EXECUTE format('ALTER INDEX %I RENAME TO %I', index_name, 'unpartitioned_' || index_name);
+        END LOOP;
+
+        CREATE TABLE matches(
+            match_id int not null default nextval('matches_match_id_seq'),
+            winner_id int,
+            loser_id int,
+            tournament_id int not null,
+            round_no int,
+            result match_result not null default 'win',
+            primary key(tournament_id, match_id),
+            foreign key(winner_id) references players(player_id) on delete cascade,
+            foreign key(loser_id) references players(player_id) on delete cascade,
+            foreign key(tournament_id) references tournaments(tournament_id) on delete cascade,
+            foreign key(tournament_id, round_no) references rounds(tournament_id, round_no) on delete cascade,
+            constraint matches_different_players check (winner_id <> loser_id),
+            constraint matches_bye_has_no_loser check ((result = 'bye') = (loser_id IS NULL))
+        ) PARTITION BY LIST (tournament_id);
+        ALTER SEQUENCE matches_match_id_seq OWNED BY matches.match_id;
+        CREATE INDEX matches_tournament_winner_idx ON matches(tournament_id, winner_id);
+        CREATE INDEX matches_tournament_loser_idx ON matches(tournament_id, loser_id);
+        CREATE INDEX matches_winner_idx ON matches(winner_id);
+        CREATE INDEX matches_loser_idx ON matches(loser_id);
+        CREATE INDEX matches_tournament_round_idx ON matches(tournament_id, round_no);
+        CREATE UNIQUE INDEX matches_one_bye_idx ON matches(tournament_id, winner_id) WHERE result = 'bye';
+
+        FOR tournament IN SELECT tournament_id FROM tournaments LOOP
+            EXECUTE format('CREATE TABLE %I PARTITION OF matches FOR VALUES IN (%s)',
+                           'matches_' || tournament, tournament);
+        END LOOP;
+        INSERT INTO matches(match_id, winner_id, loser_id, tournament_id, round_no, result)
+        SELECT match_id, winner_id, loser_id, tournament_id, round_no, result
+        FROM matches_unpartitioned WHERE tournament_id IS NOT NULL;
+        DROP TABLE matches_unpartitioned;
+    END IF;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS matches_inserted_standings ON matches;
+CREATE TRIGGER matches_inserted_standings AFTER INSERT ON matches
+REFERENCING NEW TABLE AS new_matches
+FOR EACH STATEMENT EXECUTE PROCEDURE standings_count_matches();
+
+DROP TRIGGER IF EXISTS matches_deleted_standings ON matches;
+CREATE TRIGGER matches_deleted_standings AFTER DELETE ON matches
+REFERENCING OLD TABLE AS old_matches
+FOR EACH STATEMENT EXECUTE PROCEDURE standings_count_matches();
+
+DROP TRIGGER IF EXISTS tournaments_inserted_partition ON tournaments;
+CREATE TRIGGER tournaments_inserted_partition AFTER INSERT ON tournaments
+FOR EACH ROW EXECUTE PROCEDURE matches_add_partition();
+
+DROP TRIGGER IF EXISTS tournaments_deleted_partitions ON tournaments;
+CREATE TRIGGER tournaments_deleted_partitions AFTER DELETE ON tournaments
+REFERENCING OLD TABLE AS old_tournaments
+FOR EACH STATEMENT EXECUTE PROCEDURE matches_drop_partitions();
+
+CREATE OR REPLACE FUNCTION standings_notify_truncate() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('standings_changed', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS standings_truncated_notify ON standings;
+CREATE TRIGGER standings_truncated_notify AFTER TRUNCATE ON standings
+FOR EACH STATEMENT EXECUTE PROCEDURE standings_notify_truncate();
+
+COMMIT;
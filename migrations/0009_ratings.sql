@@ -0,0 +1,50 @@
+-- Adds the players' ratings and the rated flag of rounds of tournament.sql, for rateRound and recomputeRatings, and
+-- orders the seats of pairing_candidates() by rating within score groups, as swissPairings now pairs.
+--
+-- Run it with "psql -d tournament -f migrations/0009_ratings.sql" after 0008_match_partitions.sql. Every player
+-- starts at 1500 and no round is rated; run tournament.recomputeRatings() afterwards to rate the matches already
+-- played. Running it twice is harmless.
+
+BEGIN;
+
+ALTER TABLE players ADD COLUMN IF NOT EXISTS rating double precision not null default 1500;
+ALTER TABLE rounds ADD COLUMN IF NOT EXISTS rated boolean not null default false;
+
+CREATE OR REPLACE FUNCTION players_rating_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('standings_changed', tournament_id::text)
+    FROM (SELECT DISTINCT entered.tournament_id
+          FROM new_players
+          JOIN old_players ON old_players.player_id = new_players.player_id
+          JOIN players_in_tournaments AS entered ON entered.player_id = new_players.player_id
+          WHERE new_players.rating <> old_players.rating) AS tournaments;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS players_rating_notify ON players;
+CREATE TRIGGER players_rating_notify AFTER UPDATE ON players
+REFERENCING OLD TABLE AS old_players NEW TABLE AS new_players
+FOR EACH STATEMENT EXECUTE PROCEDURE players_rating_notify();
+
+CREATE OR REPLACE FUNCTION pairing_candidates(p_tournament int, p_window int)
+RETURNS TABLE(seat bigint, player_id int, player_name text, points smallint, byes int, candidates int[]) AS $$
+    SELECT seat, player_id, player_name, points, byes,
+           ARRAY(SELECT candidate FROM unnest(following) AS candidate WHERE candidate <> ALL(opponents))
+    FROM (SELECT player_id, player_name, points, byes, opponents,
+                 row_number() OVER seats AS seat,
+                 array_agg(player_id) OVER (seats ROWS BETWEEN 1 FOLLOWING AND p_window FOLLOWING) AS following
+          FROM (SELECT standings.player_id, players.player_name, standings.points, standings.byes,
+                       standings.opponents, row_number() OVER score_group - 1 AS place,
+                       count(*) OVER (PARTITION BY standings.points) / 2 AS half
+                FROM standings JOIN players ON players.player_id = standings.player_id
+                WHERE standings.tournament_id = p_tournament
+                WINDOW score_group AS (PARTITION BY standings.points
+                                       ORDER BY CASE standings.last_float WHEN -1 THEN 0 WHEN 0 THEN 1 ELSE 2 END,
+                                                players.rating DESC, standings.player_id)) AS grouped
+          WINDOW seats AS (ORDER BY points DESC,
+                                    CASE WHEN place < half THEN 2 * place ELSE 2 * (place - half) + 1 END))
+         AS ranked
+$$ LANGUAGE sql STABLE;
+
+COMMIT;
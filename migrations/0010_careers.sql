@@ -0,0 +1,168 @@
+-- Adds the careers and head_to_head tables of tournament.sql and the triggers that keep them, for playerCareer and
+-- headToHead, and fills them in from the memberships and matches of the live tournaments.
+--
+-- Run it with "psql -d tournament -f migrations/0010_careers.sql" after 0009_ratings.sql. Tournaments archived before
+-- it are not counted. Running it twice is harmless: the tables are filled in again from scratch.
+
+BEGIN;
+
+-- Create careers table
+-- Every player's record over all the tournaments they entered, kept up to date by the triggers below so that a
+-- player's career is one row read by its key, however many matches they have played.
+-- player_id : the int id of the player
+-- events : the number of tournaments the player has entered
+-- wins, matches, points, byes : as in standings, summed over every tournament
+-- draws : the number of matches the player has drawn
+-- Archiving a tournament keeps it in its players' careers; resetting the tournaments or players clears them.
+-- if a player is deleted, their career will be deleted too.
+CREATE TABLE IF NOT EXISTS careers(
+    player_id int primary key references players(player_id) on delete cascade,
+    events int not null default 0,
+    wins int not null default 0,
+    matches int not null default 0,
+    draws int not null default 0,
+    points int not null default 0,
+    byes int not null default 0
+);
+
+-- Create head_to_head table
+-- The record between every two players who have met, in any tournament, kept once per pair under the lower id.
+-- player_id, opponent_id : the int ids of the two players, player_id the lower
+-- wins, losses : the matches player_id has won against and lost to opponent_id
+-- draws : the matches they have drawn
+-- if either player is deleted, the record will be deleted too.
+CREATE TABLE IF NOT EXISTS head_to_head(
+    player_id int references players(player_id) on delete cascade,
+    opponent_id int references players(player_id) on delete cascade,
+    wins int not null default 0,
+    losses int not null default 0,
+    draws int not null default 0,
+    primary key(player_id, opponent_id),
+    constraint head_to_head_ordered check (player_id < opponent_id)
+);
+
+-- Serve the cascade when a player is deleted
+CREATE INDEX IF NOT EXISTS head_to_head_opponent_idx ON head_to_head(opponent_id);
+
+-- Count every tournament a player enters as an event of their career
+CREATE OR REPLACE FUNCTION careers_add_events() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO careers AS career(player_id, events)
+    SELECT player_id, COUNT(*) FROM new_players GROUP BY player_id ORDER BY player_id
+    ON CONFLICT (player_id) DO UPDATE SET events = career.events + EXCLUDED.events;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS players_in_tournaments_careers ON players_in_tournaments;
+CREATE TRIGGER players_in_tournaments_careers AFTER INSERT ON players_in_tournaments
+REFERENCING NEW TABLE AS new_players
+FOR EACH STATEMENT EXECUTE PROCEDURE careers_add_events();
+
+-- Add inserted matches to, and take deleted matches off, the careers and head-to-head records of both players, as
+-- standings_count_matches does for the standings. New results are written in key order, so that concurrent reports
+-- lock the rows they share in the same order.
+CREATE OR REPLACE FUNCTION careers_count_matches() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO careers AS career(player_id, wins, matches, draws, points, byes)
+        SELECT player_id, SUM(won), COUNT(*), SUM(drawn), SUM(points), SUM(bye)
+        FROM (SELECT winner_id AS player_id, CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                     CASE result WHEN 'draw' THEN 1 ELSE 0 END AS drawn,
+                     CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points,
+                     CASE result WHEN 'bye' THEN 1 ELSE 0 END AS bye
+              FROM new_matches
+              UNION ALL
+              SELECT loser_id, 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END,
+                     CASE result WHEN 'draw' THEN 1 ELSE 0 END, 0
+              FROM new_matches WHERE result <> 'bye') AS played
+        GROUP BY player_id ORDER BY player_id
+        ON CONFLICT (player_id) DO UPDATE SET wins = career.wins + EXCLUDED.wins,
+                                              matches = career.matches + EXCLUDED.matches,
+                                              draws = career.draws + EXCLUDED.draws,
+                                              points = career.points + EXCLUDED.points,
+                                              byes = career.byes + EXCLUDED.byes;
+        INSERT INTO head_to_head AS record(player_id, opponent_id, wins, losses, draws)
+        SELECT LEAST(winner_id, loser_id), GREATEST(winner_id, loser_id),
+               COUNT(*) FILTER (WHERE result = 'win' AND winner_id < loser_id),
+               COUNT(*) FILTER (WHERE result = 'win' AND winner_id > loser_id),
+               COUNT(*) FILTER (WHERE result = 'draw')
+        FROM new_matches WHERE result <> 'bye'
+        GROUP BY 1, 2 ORDER BY 1, 2
+        ON CONFLICT (player_id, opponent_id) DO UPDATE SET wins = record.wins + EXCLUDED.wins,
+                                                           losses = record.losses + EXCLUDED.losses,
+                                                           draws = record.draws + EXCLUDED.draws;
+    ELSE
+        UPDATE careers SET wins = careers.wins - results.wins,
+                           matches = careers.matches - results.matches,
+                           draws = careers.draws - results.draws,
+                           points = careers.points - results.points,
+                           byes = careers.byes - results.byes
+        FROM (SELECT player_id, SUM(won) AS wins, COUNT(*) AS matches, SUM(drawn) AS draws, SUM(points) AS points,
+                     SUM(bye) AS byes
+              FROM (SELECT winner_id AS player_id, CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                           CASE result WHEN 'draw' THEN 1 ELSE 0 END AS drawn,
+                           CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points,
+                           CASE result WHEN 'bye' THEN 1 ELSE 0 END AS bye
+                    FROM old_matches
+                    UNION ALL
+                    SELECT loser_id, 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END,
+                           CASE result WHEN 'draw' THEN 1 ELSE 0 END, 0
+                    FROM old_matches WHERE result <> 'bye') AS played
+              GROUP BY player_id) AS results
+        WHERE careers.player_id = results.player_id;
+        UPDATE head_to_head SET wins = head_to_head.wins - results.wins,
+                                losses = head_to_head.losses - results.losses,
+                                draws = head_to_head.draws - results.draws
+        FROM (SELECT LEAST(winner_id, loser_id) AS player_id, GREATEST(winner_id, loser_id) AS opponent_id,
+                     COUNT(*) FILTER (WHERE result = 'win' AND winner_id < loser_id) AS wins,
+                     COUNT(*) FILTER (WHERE result = 'win' AND winner_id > loser_id) AS losses,
+                     COUNT(*) FILTER (WHERE result = 'draw') AS draws
+              FROM old_matches WHERE result <> 'bye'
+              GROUP BY 1, 2) AS results
+        WHERE head_to_head.player_id = results.player_id AND head_to_head.opponent_id = results.opponent_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS matches_inserted_careers ON matches;
+CREATE TRIGGER matches_inserted_careers AFTER INSERT ON matches
+REFERENCING NEW TABLE AS new_matches
+FOR EACH STATEMENT EXECUTE PROCEDURE careers_count_matches();
+
+DROP TRIGGER IF EXISTS matches_deleted_careers ON matches;
+CREATE TRIGGER matches_deleted_careers AFTER DELETE ON matches
+REFERENCING OLD TABLE AS old_matches
+FOR EACH STATEMENT EXECUTE PROCEDURE careers_count_matches();
+
+-- Fill both tables in from scratch, as the triggers would have kept them
+TRUNCATE careers, head_to_head;
+
+INSERT INTO careers(player_id, events)
+SELECT player_id, COUNT(*) FROM players_in_tournaments GROUP BY player_id;
+
+UPDATE careers SET wins = results.wins, matches = results.matches, draws = results.draws, points = results.points,
+                   byes = results.byes
+FROM (SELECT player_id, SUM(won) AS wins, COUNT(*) AS matches, SUM(drawn) AS draws, SUM(points) AS points,
+             SUM(bye) AS byes
+      FROM (SELECT winner_id AS player_id, CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                   CASE result WHEN 'draw' THEN 1 ELSE 0 END AS drawn,
+                   CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points,
+                   CASE result WHEN 'bye' THEN 1 ELSE 0 END AS bye
+            FROM matches
+            UNION ALL
+            SELECT loser_id, 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END, CASE result WHEN 'draw' THEN 1 ELSE 0 END, 0
+            FROM matches WHERE result <> 'bye') AS played
+      GROUP BY player_id) AS results
+WHERE careers.player_id = results.player_id;
+
+INSERT INTO head_to_head(player_id, opponent_id, wins, losses, draws)
+SELECT LEAST(winner_id, loser_id), GREATEST(winner_id, loser_id),
+       COUNT(*) FILTER (WHERE result = 'win' AND winner_id < loser_id),
+       COUNT(*) FILTER (WHERE result = 'win' AND winner_id > loser_id),
+       COUNT(*) FILTER (WHERE result = 'draw')
+FROM matches WHERE result <> 'bye'
+GROUP BY 1, 2;
+
+COMMIT;
@@ -0,0 +1,233 @@
+-- Lets importTournament turn off the triggers counting standings, careers and head-to-head records while it copies
+-- in an event, and count the event at once afterwards with count_imported_tournament().
+--
+-- Run it with "psql -d tournament -f migrations/0011_import_counting.sql" after 0010_careers.sql. Only functions are
+-- replaced, so running it twice is harmless.
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION standings_add_players() RETURNS trigger AS $$
+BEGIN
+    -- importTournament sets tournament.importing for its transaction, and counts the whole event at once with
+    -- count_imported_tournament() once its matches are in
+    IF current_setting('tournament.importing', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO standings(tournament_id, player_id)
+    SELECT tournament_id, player_id FROM new_players;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION standings_count_matches() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('tournament.importing', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        -- Floats compare the points of both players before this statement's results are counted.
+        UPDATE standings SET wins = standings.wins + results.wins,
+                             matches = standings.matches + results.matches,
+                             points = standings.points + results.points,
+                             byes = standings.byes + results.byes,
+                             opponents = standings.opponents || results.opponents,
+                             up_floats = standings.up_floats + results.up_floats,
+                             down_floats = standings.down_floats + results.down_floats,
+                             last_float = results.last_float
+        FROM (SELECT played.tournament_id, played.player_id, SUM(played.won) AS wins, COUNT(*) AS matches,
+                     SUM(played.points) AS points, COUNT(*) FILTER (WHERE played.opponent_id IS NULL) AS byes,
+                     COALESCE(array_agg(played.opponent_id ORDER BY played.match_id)
+                              FILTER (WHERE played.opponent_id IS NOT NULL), '{}') AS opponents,
+                     COUNT(*) FILTER (WHERE opponent.points > player.points) AS up_floats,
+                     COUNT(*) FILTER (WHERE opponent.points < player.points) AS down_floats,
+                     COALESCE((array_agg(sign(opponent.points - player.points) ORDER BY played.match_id DESC))[1],
+                              0) AS last_float
+              FROM (SELECT match_id, tournament_id, winner_id AS player_id, loser_id AS opponent_id,
+                           CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                           CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points
+                    FROM new_matches
+                    UNION ALL
+                    SELECT match_id, tournament_id, loser_id, winner_id, 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END
+                    FROM new_matches WHERE result <> 'bye') AS played
+              JOIN standings AS player
+                ON player.tournament_id = played.tournament_id AND player.player_id = played.player_id
+              LEFT JOIN standings AS opponent
+                ON opponent.tournament_id = played.tournament_id AND opponent.player_id = played.opponent_id
+              GROUP BY played.tournament_id, played.player_id) AS results
+        WHERE standings.tournament_id = results.tournament_id AND standings.player_id = results.player_id;
+    ELSE
+        -- Opponents are listed again from the matches left. Floats cannot be worked out again after the fact,
+        -- so they are only cleared once a player has no matches left.
+        UPDATE standings SET wins = standings.wins - results.wins,
+                             matches = standings.matches - results.matches,
+                             points = standings.points - results.points,
+                             byes = standings.byes - results.byes,
+                             opponents = ARRAY(SELECT CASE WHEN matches.winner_id = standings.player_id
+                                                           THEN matches.loser_id ELSE matches.winner_id END
+                                               FROM matches
+                                               WHERE matches.tournament_id = standings.tournament_id
+                                                 AND (matches.winner_id = standings.player_id
+                                                      OR matches.loser_id = standings.player_id)
+                                                 AND matches.result <> 'bye'
+                                               ORDER BY matches.match_id),
+                             up_floats = CASE WHEN standings.matches = results.matches THEN 0
+                                              ELSE standings.up_floats END,
+                             down_floats = CASE WHEN standings.matches = results.matches THEN 0
+                                                ELSE standings.down_floats END,
+                             last_float = CASE WHEN standings.matches = results.matches THEN 0
+                                               ELSE standings.last_float END
+        FROM (SELECT tournament_id, player_id, SUM(won) AS wins, COUNT(*) AS matches, SUM(points) AS points,
+                     COUNT(*) FILTER (WHERE bye) AS byes
+              FROM (SELECT tournament_id, winner_id AS player_id, CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                           CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points, result = 'bye' AS bye
+                    FROM old_matches
+                    UNION ALL
+                    SELECT tournament_id, loser_id, 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END, false
+                    FROM old_matches WHERE result <> 'bye') AS played
+              GROUP BY tournament_id, player_id) AS results
+        WHERE standings.tournament_id = results.tournament_id AND standings.player_id = results.player_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION careers_add_events() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('tournament.importing', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO careers AS career(player_id, events)
+    SELECT player_id, COUNT(*) FROM new_players GROUP BY player_id ORDER BY player_id
+    ON CONFLICT (player_id) DO UPDATE SET events = career.events + EXCLUDED.events;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION careers_count_matches() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('tournament.importing', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO careers AS career(player_id, wins, matches, draws, points, byes)
+        SELECT player_id, SUM(won), COUNT(*), SUM(drawn), SUM(points), SUM(bye)
+        FROM (SELECT winner_id AS player_id, CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                     CASE result WHEN 'draw' THEN 1 ELSE 0 END AS drawn,
+                     CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points,
+                     CASE result WHEN 'bye' THEN 1 ELSE 0 END AS bye
+              FROM new_matches
+              UNION ALL
+              SELECT loser_id, 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END,
+                     CASE result WHEN 'draw' THEN 1 ELSE 0 END, 0
+              FROM new_matches WHERE result <> 'bye') AS played
+        GROUP BY player_id ORDER BY player_id
+        ON CONFLICT (player_id) DO UPDATE SET wins = career.wins + EXCLUDED.wins,
+                                              matches = career.matches + EXCLUDED.matches,
+                                              draws = career.draws + EXCLUDED.draws,
+                                              points = career.points + EXCLUDED.points,
+                                              byes = career.byes + EXCLUDED.byes;
+        INSERT INTO head_to_head AS record(player_id, opponent_id, wins, losses, draws)
+        SELECT LEAST(winner_id, loser_id), GREATEST(winner_id, loser_id),
+               COUNT(*) FILTER (WHERE result = 'win' AND winner_id < loser_id),
+               COUNT(*) FILTER (WHERE result = 'win' AND winner_id > loser_id),
+               COUNT(*) FILTER (WHERE result = 'draw')
+        FROM new_matches WHERE result <> 'bye'
+        GROUP BY 1, 2 ORDER BY 1, 2
+        ON CONFLICT (player_id, opponent_id) DO UPDATE SET wins = record.wins + EXCLUDED.wins,
+                                                           losses = record.losses + EXCLUDED.losses,
+                                                           draws = record.draws + EXCLUDED.draws;
+    ELSE
+        UPDATE careers SET wins = careers.wins - results.wins,
+                           matches = careers.matches - results.matches,
+                           draws = careers.draws - results.draws,
+                           points = careers.points - results.points,
+                           byes = careers.byes - results.byes
+        FROM (SELECT player_id, SUM(won) AS wins, COUNT(*) AS matches, SUM(drawn) AS draws, SUM(points) AS points,
+                     SUM(bye) AS byes
+              FROM (SELECT winner_id AS player_id, CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                           CASE result WHEN 'draw' THEN 1 ELSE 0 END AS drawn,
+                           CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points,
+                           CASE result WHEN 'bye' THEN 1 ELSE 0 END AS bye
+                    FROM old_matches
+                    UNION ALL
+                    SELECT loser_id, 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END,
+                           CASE result WHEN 'draw' THEN 1 ELSE 0 END, 0
+                    FROM old_matches WHERE result <> 'bye') AS played
+              GROUP BY player_id) AS results
+        WHERE careers.player_id = results.player_id;
+        UPDATE head_to_head SET wins = head_to_head.wins - results.wins,
+                                losses = head_to_head.losses - results.losses,
+                                draws = head_to_head.draws - results.draws
+        FROM (SELECT LEAST(winner_id, loser_id) AS player_id, GREATEST(winner_id, loser_id) AS opponent_id,
+                     COUNT(*) FILTER (WHERE result = 'win' AND winner_id < loser_id) AS wins,
+                     COUNT(*) FILTER (WHERE result = 'win' AND winner_id > loser_id) AS losses,
+                     COUNT(*) FILTER (WHERE result = 'draw') AS draws
+              FROM old_matches WHERE result <> 'bye'
+              GROUP BY 1, 2) AS results
+        WHERE head_to_head.player_id = results.player_id AND head_to_head.opponent_id = results.opponent_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Counts a tournament imported with tournament.importing on, whose players and matches the triggers above skipped:
+-- its standings rows are written once, already counted, rather than started empty and updated, and its players'
+-- careers and head-to-head records are added to in one statement each. Every result of an import is counted in the
+-- same statement, so nobody has floated yet, as with the triggers. The players of an import are new, so the
+-- standings are only ever inserted.
+CREATE OR REPLACE FUNCTION count_imported_tournament(p_tournament int) RETURNS void AS $$
+BEGIN
+    INSERT INTO standings(tournament_id, player_id, wins, matches, points, byes, opponents)
+    SELECT p_tournament, members.player_id, COALESCE(SUM(played.won), 0), COUNT(played.match_id),
+           COALESCE(SUM(played.points), 0), COUNT(played.match_id) FILTER (WHERE played.opponent_id IS NULL),
+           COALESCE(array_agg(played.opponent_id ORDER BY played.match_id)
+                    FILTER (WHERE played.opponent_id IS NOT NULL), '{}')
+    FROM players_in_tournaments AS members
+    LEFT JOIN (SELECT match_id, winner_id AS player_id, loser_id AS opponent_id,
+                      CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                      CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points
+               FROM matches WHERE tournament_id = p_tournament
+               UNION ALL
+               SELECT match_id, loser_id, winner_id, 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END
+               FROM matches WHERE tournament_id = p_tournament AND result <> 'bye') AS played
+      ON played.player_id = members.player_id
+    WHERE members.tournament_id = p_tournament
+    GROUP BY members.player_id;
+
+    INSERT INTO careers AS career(player_id, events, wins, matches, draws, points, byes)
+    SELECT members.player_id, 1, COALESCE(SUM(played.won), 0), COUNT(played.player_id),
+           COALESCE(SUM(played.drawn), 0), COALESCE(SUM(played.points), 0), COALESCE(SUM(played.bye), 0)
+    FROM players_in_tournaments AS members
+    LEFT JOIN (SELECT winner_id AS player_id, CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                      CASE result WHEN 'draw' THEN 1 ELSE 0 END AS drawn,
+                      CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points,
+                      CASE result WHEN 'bye' THEN 1 ELSE 0 END AS bye
+               FROM matches WHERE tournament_id = p_tournament
+               UNION ALL
+               SELECT loser_id, 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END,
+                      CASE result WHEN 'draw' THEN 1 ELSE 0 END, 0
+               FROM matches WHERE tournament_id = p_tournament AND result <> 'bye') AS played
+      ON played.player_id = members.player_id
+    WHERE members.tournament_id = p_tournament
+    GROUP BY members.player_id ORDER BY members.player_id
+    ON CONFLICT (player_id) DO UPDATE SET events = career.events + EXCLUDED.events,
+                                          wins = career.wins + EXCLUDED.wins,
+                                          matches = career.matches + EXCLUDED.matches,
+                                          draws = career.draws + EXCLUDED.draws,
+                                          points = career.points + EXCLUDED.points,
+                                          byes = career.byes + EXCLUDED.byes;
+
+    INSERT INTO head_to_head AS record(player_id, opponent_id, wins, losses, draws)
+    SELECT LEAST(winner_id, loser_id), GREATEST(winner_id, loser_id),
+           COUNT(*) FILTER (WHERE result = 'win' AND winner_id < loser_id),
+           COUNT(*) FILTER (WHERE result = 'win' AND winner_id > loser_id),
+           COUNT(*) FILTER (WHERE result = 'draw')
+    FROM matches WHERE tournament_id = p_tournament AND result <> 'bye'
+    GROUP BY 1, 2 ORDER BY 1, 2
+    ON CONFLICT (player_id, opponent_id) DO UPDATE SET wins = record.wins + EXCLUDED.wins,
+                                                       losses = record.losses + EXCLUDED.losses,
+                                                       draws = record.draws + EXCLUDED.draws;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
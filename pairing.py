@@ -0,0 +1,723 @@
+#!/usr/bin/env python
+#
+# pairing.py -- Swiss-system pairing algorithms, independent of the database
+#
+
+import time
+from itertools import groupby
+
+# Weight optimalPairing takes off a pair for each score group squared
+# between the two players.
+SCORE_GAP_PENALTY = 16
+
+def playedPairs(matches):
+    """
+    Returns the set of pairs of players who have already met.
+    :param matches:(winner_id, loser_id) rows, as returned by getPlayedMatches
+    :return:a set of frozensets of two player ids, for constant time lookups
+    """
+    return set(frozenset(match) for match in matches)
+
+class PlayedPairs(object):
+    """A compact set of the pairs of players who have already met.
+
+    Each pair is stored as a single integer instead of a frozenset, which
+    takes a fraction of the memory for the millions of pairs of a large
+    event. It answers the same frozenset((id1, id2)) in played lookups as
+    the sets built by playedPairs, so it can be passed to any pairing.
+    """
+
+    def __init__(self, matches=()):
+        self._keys = set()
+        for (player1, player2) in matches:
+            self.add(player1, player2)
+
+    @staticmethod
+    def _key(player1, player2):
+        if player1 > player2:
+            player1, player2 = player2, player1
+        return (player1 << 32) | player2
+
+    def add(self, player1, player2):
+        """Records that two players have met."""
+        self._keys.add(self._key(player1, player2))
+
+    def __contains__(self, pair):
+        player1, player2 = pair
+        return self._key(player1, player2) in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+class CandidatePairs(object):
+    """The pairs a round may use, standing in for the played pairs.
+
+    Built from (seat, player, candidates) rows as the pairing_candidates()
+    database function returns them, each player's candidates being the
+    players up to window seats below them whom they have not met. A pair
+    inside the window is "in" it, like a played pair, unless one of its
+    players is a candidate of the other. Whether a pair further apart has
+    met is not known: it is treated as played, and outside is set, so that
+    the caller knows to ask again with a wider window.
+    """
+
+    def __init__(self, candidates=(), window=0):
+        self.window = window
+        self.outside = False
+        self._seats = {}
+        self._keys = set()
+        for (seat, player, others) in candidates:
+            self._seats[player] = seat
+            for other in others:
+                self._keys.add(PlayedPairs._key(player, other))
+
+    def __contains__(self, pair):
+        player1, player2 = pair
+        if PlayedPairs._key(player1, player2) in self._keys:
+            return False
+        if abs(self._seats[player1] - self._seats[player2]) > self.window:
+            self.outside = True
+        return True
+
+# Where players go within their score group by the direction of their last
+# float: those who floated down are kept at the top, so that they are not
+# left over to float down again, and those who floated up at the bottom.
+FLOAT_ORDER = {-1: 0, 0: 1, 1: 2}
+
+def floatOrder(scores, last_floats):
+    """
+    Returns the order to hand players to a pairing in, so that nobody floats
+    the same way two rounds running where it can be avoided.
+    :param scores:each player's score, in standings order
+    :param last_floats:each player's last float: 1 up, -1 down, 0 none
+    :return:a list of indexes into the standings, with score groups kept in order
+    """
+    return sorted(range(len(scores)), key=lambda i: (-scores[i], FLOAT_ORDER[last_floats[i]]))
+
+def ratingOrder(scores, last_floats, ratings):
+    """
+    Returns the order to hand players to a pairing in: floatOrder, then by
+    rating within each score group, folded so that the top half of the group
+    plays the bottom half. The first player comes next to the first of the
+    bottom half, the second next to the second, and so on, which is where
+    pairPlayers looks first; a player left over from an odd group goes last.
+    :param scores:each player's score, in standings order
+    :param last_floats:each player's last float: 1 up, -1 down, 0 none
+    :param ratings:each player's rating
+    :return:a list of indexes into the standings, with score groups kept in order
+    """
+    order = sorted(range(len(scores)), key=lambda i: (-scores[i], FLOAT_ORDER[last_floats[i]], -ratings[i]))
+    folded = []
+    for score, group in groupby(order, key=lambda i: scores[i]):
+        group = list(group)
+        half = len(group) // 2
+        for top, bottom in zip(group[:half], group[half:]):
+            folded += [top, bottom]
+        if len(group) % 2:
+            folded.append(group[-1])
+    return folded
+
+def pairRound(players, scores, played, byes, mode="greedy", stats=None):
+    """Pairs a round with pairPlayers or optimalPairing, giving a bye first
+    if the number of players is odd.
+
+    The bye goes to the lowest player in the order given who has not had
+    one yet, and for whom the rest of the round can be paired; the next
+    player up is tried if it cannot.
+
+    Args:
+      players: a list of (id, name) tuples in pairing order
+      scores: each player's score, in the same order
+      played: a set of frozensets of player ids who have already met
+      byes: how many byes each player has had, in the same order
+      mode: "greedy" for pairPlayers or "optimal" for optimalPairing
+      stats: an optional dict, filled by optimalPairing
+
+    Returns:
+      A list of tuples, each of which contains (id1, name1, id2, name2),
+      with the bye last as (id, name, None, None).
+
+    Raises:
+      ValueError: if nobody can have the bye, or the round cannot be paired.
+    """
+    def solve(players, scores):
+        if mode == "optimal":
+            return optimalPairing(players, scores, played, stats=stats)
+        return pairPlayers(players, played)
+
+    if len(players) % 2 == 0:
+        return solve(players, scores)
+    error = ValueError("No Player Can Have The Bye")
+    for i in reversed(range(len(players))):
+        if byes[i]:
+            continue
+        try:
+            pairings = solve(players[:i] + players[i + 1:], scores[:i] + scores[i + 1:])
+        except ValueError as e:
+            error = e
+            continue
+        return pairings + [players[i] + (None, None)]
+    raise error
+
+def pairPlayers(players, played, max_backtracks=100000):
+    """Pairs a round so that nobody meets an opponent they have already played.
+
+    Players are taken in standings order, so each score group sits next to
+    the next one down. The highest ranked unpaired player is paired with the
+    next unpaired player they have not met yet: a player in the same score
+    group if possible, otherwise one floated up from the groups below. When
+    the players left at the bottom cannot all be paired, the most recent
+    pairings are undone and their next candidates tried, so backtracking only
+    happens where it is needed.
+
+    Args:
+      players: a list of (id, name) tuples in standings order
+      played: a set of frozensets of player ids who have already met,
+        as returned by playedPairs
+      max_backtracks: how many pairings may be undone before giving up
+
+    Returns:
+      A list of tuples, each of which contains (id1, name1, id2, name2)
+
+    Raises:
+      ValueError: if there is an odd number of players, or every pairing
+        tried contains a rematch.
+    """
+    if len(players) % 2:
+        raise ValueError("Odd Number Of Players")
+    ids = [player[0] for player in players]
+    count = len(ids)
+    paired = [False] * count
+    pairs = []
+    backtracks = 0
+    first, start = 0, 0
+    while True:
+        while first < count and paired[first]:
+            first += 1
+        if first == count:
+            break
+        paired[first] = True
+        partner = -1
+        for candidate in range(max(start, first + 1), count):
+            if (not paired[candidate]
+                    and frozenset((ids[first], ids[candidate])) not in played):
+                partner = candidate
+                break
+        if partner >= 0:
+            paired[partner] = True
+            pairs.append((first, partner))
+            first, start = first + 1, 0
+            continue
+        # Nobody is left for this player: undo the last pairing and give
+        # its first player the next candidate down instead.
+        paired[first] = False
+        backtracks += 1
+        if not pairs or backtracks > max_backtracks:
+            raise ValueError("No Pairing Without Rematches")
+        first, partner = pairs.pop()
+        paired[first] = paired[partner] = False
+        start = partner + 1
+    return [players[i] + players[j] for i, j in pairs]
+
+def optimalPairing(players, scores, played, span=1, window=16, stats=None):
+    """Pairs a round by maximum-weight perfect matching.
+
+    Every candidate pair is weighted by how far apart the two players'
+    scores are, and pairs who have already met are weighted below any
+    combination of floats, so the round found has the fewest rematches and,
+    among those, the smallest score differences overall. To keep large
+    rounds fast, each player is only offered the next window players in the
+    standings that are at most span score groups below them; the window is
+    widened until everybody can be paired.
+
+    Args:
+      players: a list of (id, name) tuples in standings order
+      scores: each player's score, in the same order
+      played: a set of frozensets of player ids who have already met
+      span: how many score groups apart two players may be paired
+      window: how many players below each player are candidates at first
+      stats: an optional dict, filled with the number of candidate 'edges'
+        and the 'solve_time' in seconds
+
+    Returns:
+      A list of tuples, each of which contains (id1, name1, id2, name2)
+
+    Raises:
+      ValueError: if there is an odd number of players, or they cannot all
+        be paired within span score groups.
+    """
+    if len(players) % 2:
+        raise ValueError("Odd Number Of Players")
+    start = time.time()
+    count = len(players)
+    groups = sorted(set(scores), reverse=True)
+    group_of = dict((score, index) for index, score in enumerate(groups))
+    rank = [group_of[score] for score in scores]
+    ids = [player[0] for player in players]
+    # A rematch costs more than any combination of floats. Pairs inside a
+    # score group cost nothing, so most of the round is matched before the
+    # first blossom stage and only the floats are left to solve.
+    rematch_penalty = (count // 2) * span * span * SCORE_GAP_PENALTY + 1
+    top_weight = rematch_penalty + span * span * SCORE_GAP_PENALTY
+
+    while True:
+        edges = []
+        for i in range(count):
+            for j in range(i + 1, min(i + 1 + window, count)):
+                gap = rank[j] - rank[i]
+                if gap > span:
+                    break
+                penalty = gap * gap * SCORE_GAP_PENALTY
+                if frozenset((ids[i], ids[j])) in played:
+                    penalty += rematch_penalty
+                edges.append((i, j, top_weight - penalty))
+        mate = maxWeightMatching(edges, maxcardinality=True)
+        if len(mate) == count and -1 not in mate:
+            break
+        if window >= count:
+            raise ValueError("No Pairing Within Score Span")
+        window *= 2
+
+    if stats is not None:
+        stats['edges'] = len(edges)
+        stats['solve_time'] = time.time() - start
+    return [players[i] + players[mate[i]] for i in range(count) if i < mate[i]]
+
+def maxWeightMatching(edges, maxcardinality=False):
+    """Computes a maximum-weight matching with Edmonds' blossom algorithm.
+
+    This is the primal-dual method of Galil, "Efficient algorithms for
+    finding maximum matching in graphs" (1986), in O(n**3) time. Weights
+    must be integers so that the dual updates stay exact. Edges that already
+    have the largest weight are matched greedily before the first stage,
+    which keeps the dual solution valid and leaves only the vertices that
+    need a different partner to the blossom stages.
+
+    Args:
+      edges: a list of (i, j, weight) tuples, i and j being vertex numbers
+        from 0 to n - 1
+      maxcardinality: if True, only maximum-cardinality matchings are
+        considered, so a perfect matching is found whenever one exists
+
+    Returns:
+      A list mate, mate[i] being the vertex matched to i, or -1.
+    """
+    if not edges:
+        return []
+
+    nedge = len(edges)
+    nvertex = 0
+    for (i, j, w) in edges:
+        if i < 0 or j < 0 or i == j:
+            raise ValueError("Invalid Edge")
+        nvertex = max(nvertex, i + 1, j + 1)
+    maxweight = max(0, max(w for (i, j, w) in edges))
+
+    # Edge k joins endpoint[2k] and endpoint[2k + 1]; p ^ 1 is the other end
+    # of endpoint p, and neighbend[v] lists the remote endpoints of v's edges.
+    endpoint = [edges[p // 2][p % 2] for p in range(2 * nedge)]
+    neighbend = [[] for _ in range(nvertex)]
+    for k, (i, j, w) in enumerate(edges):
+        neighbend[i].append(2 * k + 1)
+        neighbend[j].append(2 * k)
+
+    # mate[v] is the remote endpoint of v's matched edge, or -1.
+    mate = nvertex * [-1]
+    # Labels of top-level blossoms and vertices: 0 free, 1 S, 2 T; bit 4 is
+    # a breadcrumb left by scanBlossom. labelend is the endpoint the label
+    # was assigned through.
+    label = (2 * nvertex) * [0]
+    labelend = (2 * nvertex) * [-1]
+    # Vertices are blossoms 0..n-1; non-trivial blossoms use n..2n-1.
+    inblossom = list(range(nvertex))
+    blossomparent = (2 * nvertex) * [-1]
+    blossomchilds = (2 * nvertex) * [None]
+    blossombase = list(range(nvertex)) + nvertex * [-1]
+    blossomendps = (2 * nvertex) * [None]
+    bestedge = (2 * nvertex) * [-1]
+    blossombestedges = (2 * nvertex) * [None]
+    unusedblossoms = list(range(nvertex, 2 * nvertex))
+    # Vertex duals start at maxweight, blossom duals at 0, so the slack of an
+    # edge is never negative and is zero for the heaviest edges.
+    dualvar = nvertex * [maxweight] + nvertex * [0]
+    allowedge = nedge * [False]
+    queue = []
+    # Vertices and blossoms labelled or given a best edge during the current
+    # stage. Dual updates only visit these, so a stage costs time in
+    # proportion to the trees it grows rather than to the whole graph.
+    touched = []
+    istouched = (2 * nvertex) * [False]
+
+    for k, (i, j, w) in enumerate(edges):
+        if w == maxweight and mate[i] == -1 and mate[j] == -1:
+            mate[i] = 2 * k + 1
+            mate[j] = 2 * k
+
+    def touch(x):
+        if not istouched[x]:
+            istouched[x] = True
+            touched.append(x)
+
+    def slack(k):
+        (i, j, wt) = edges[k]
+        return dualvar[i] + dualvar[j] - 2 * wt
+
+    def blossomLeaves(b):
+        # Blossoms can nest deeply, so walk them without recursion.
+        if b < nvertex:
+            return [b]
+        leaves = []
+        stack = [b]
+        while stack:
+            t = stack.pop()
+            if t < nvertex:
+                leaves.append(t)
+            else:
+                stack.extend(reversed(blossomchilds[t]))
+        return leaves
+
+    def assignLabel(w, t, p):
+        # Label the top-level blossom containing w with t, reached through
+        # endpoint p; a T blossom's mate becomes S in turn.
+        b = inblossom[w]
+        label[w] = label[b] = t
+        labelend[w] = labelend[b] = p
+        bestedge[w] = bestedge[b] = -1
+        touch(b)
+        leaves = blossomLeaves(b)
+        for v in leaves:
+            touch(v)
+        if t == 1:
+            queue.extend(leaves)
+        elif t == 2:
+            base = blossombase[b]
+            assignLabel(endpoint[mate[base]], 1, mate[base] ^ 1)
+
+    def scanBlossom(v, w):
+        # Trace back from S vertices v and w towards the roots of their
+        # trees. Returns the base of a new blossom if the paths meet, or -1
+        # if they reach two different roots (an augmenting path).
+        path = []
+        base = -1
+        while v != -1 or w != -1:
+            b = inblossom[v]
+            if label[b] & 4:
+                base = blossombase[b]
+                break
+            path.append(b)
+            label[b] = 5
+            if labelend[b] == -1:
+                v = -1
+            else:
+                v = endpoint[labelend[b]]
+                b = inblossom[v]
+                v = endpoint[labelend[b]]
+            if w != -1:
+                v, w = w, v
+        for b in path:
+            label[b] = 1
+        return base
+
+    def addBlossom(base, k):
+        # Shrink the odd cycle closed by edge k into a new S blossom.
+        (v, w, wt) = edges[k]
+        bb = inblossom[base]
+        bv = inblossom[v]
+        bw = inblossom[w]
+        b = unusedblossoms.pop()
+        blossombase[b] = base
+        blossomparent[b] = -1
+        blossomparent[bb] = b
+        blossomchilds[b] = path = []
+        blossomendps[b] = endps = []
+        while bv != bb:
+            blossomparent[bv] = b
+            path.append(bv)
+            endps.append(labelend[bv])
+            v = endpoint[labelend[bv]]
+            bv = inblossom[v]
+        path.append(bb)
+        path.reverse()
+        endps.reverse()
+        endps.append(2 * k)
+        while bw != bb:
+            blossomparent[bw] = b
+            path.append(bw)
+            endps.append(labelend[bw] ^ 1)
+            w = endpoint[labelend[bw]]
+            bw = inblossom[w]
+        label[b] = 1
+        labelend[b] = labelend[bb]
+        dualvar[b] = 0
+        touch(b)
+        for v in blossomLeaves(b):
+            if label[inblossom[v]] == 2:
+                # T vertices inside the blossom become S vertices.
+                queue.append(v)
+            inblossom[v] = b
+        # Keep the least-slack edge from the new blossom to each S blossom.
+        bestedgeto = {}
+        for bv in path:
+            if blossombestedges[bv] is None:
+                nblists = [[p // 2 for p in neighbend[v]] for v in blossomLeaves(bv)]
+            else:
+                nblists = [blossombestedges[bv]]
+            for nblist in nblists:
+                for k in nblist:
+                    (i, j, wt) = edges[k]
+                    if inblossom[j] == b:
+                        i, j = j, i
+                    bj = inblossom[j]
+                    if (bj != b and label[bj] == 1 and
+                            (bj not in bestedgeto or slack(k) < slack(bestedgeto[bj]))):
+                        bestedgeto[bj] = k
+            blossombestedges[bv] = None
+            bestedge[bv] = -1
+        blossombestedges[b] = list(bestedgeto.values())
+        bestedge[b] = -1
+        for k in blossombestedges[b]:
+            if bestedge[b] == -1 or slack(k) < slack(bestedge[b]):
+                bestedge[b] = k
+
+    def expandBlossom(b, endstage):
+        # Undo a blossom whose dual has dropped to zero, relabelling its
+        # sub-blossoms if it was a T blossom in the middle of a stage. At
+        # the end of a stage, sub-blossoms with a zero dual are undone too;
+        # they are kept on a stack since blossoms can nest deeply.
+        stack = [b]
+        while stack:
+            b = stack.pop()
+            expandOne(b, endstage, stack)
+
+    def expandOne(b, endstage, stack):
+        for s in blossomchilds[b]:
+            blossomparent[s] = -1
+            if s < nvertex:
+                inblossom[s] = s
+            elif endstage and dualvar[s] == 0:
+                stack.append(s)
+            else:
+                for v in blossomLeaves(s):
+                    inblossom[v] = s
+        if (not endstage) and label[b] == 2:
+            entrychild = inblossom[endpoint[labelend[b] ^ 1]]
+            j = blossomchilds[b].index(entrychild)
+            if j & 1:
+                j -= len(blossomchilds[b])
+                jstep = 1
+                endptrick = 0
+            else:
+                jstep = -1
+                endptrick = 1
+            p = labelend[b]
+            while j != 0:
+                label[endpoint[p ^ 1]] = 0
+                label[endpoint[blossomendps[b][j - endptrick] ^ endptrick ^ 1]] = 0
+                assignLabel(endpoint[p ^ 1], 2, p)
+                allowedge[blossomendps[b][j - endptrick] // 2] = True
+                j += jstep
+                p = blossomendps[b][j - endptrick] ^ endptrick
+                allowedge[p // 2] = True
+                j += jstep
+            bv = blossomchilds[b][j]
+            label[endpoint[p ^ 1]] = label[bv] = 2
+            labelend[endpoint[p ^ 1]] = labelend[bv] = p
+            bestedge[bv] = -1
+            touch(bv)
+            j += jstep
+            while blossomchilds[b][j] != entrychild:
+                bv = blossomchilds[b][j]
+                if label[bv] == 1:
+                    j += jstep
+                    continue
+                for v in blossomLeaves(bv):
+                    if label[v] != 0:
+                        break
+                if label[v] != 0:
+                    label[v] = 0
+                    label[endpoint[mate[blossombase[bv]]]] = 0
+                    assignLabel(v, 2, labelend[v])
+                j += jstep
+        label[b] = labelend[b] = -1
+        blossomchilds[b] = blossomendps[b] = None
+        blossombase[b] = -1
+        blossombestedges[b] = None
+        bestedge[b] = -1
+        unusedblossoms.append(b)
+
+    def augmentBlossom(b, v):
+        # Swap matched and unmatched edges along the even path from v to
+        # the base of blossom b, making v the new base. Each sub-blossom on
+        # the path gets the same treatment, from a stack rather than by
+        # recursion since blossoms can nest deeply.
+        stack = [(b, v)]
+        while stack:
+            b, v = stack.pop()
+            t = v
+            while blossomparent[t] != b:
+                t = blossomparent[t]
+            if t >= nvertex:
+                stack.append((t, v))
+            i = j = blossomchilds[b].index(t)
+            if i & 1:
+                j -= len(blossomchilds[b])
+                jstep = 1
+                endptrick = 0
+            else:
+                jstep = -1
+                endptrick = 1
+            while j != 0:
+                j += jstep
+                t = blossomchilds[b][j]
+                p = blossomendps[b][j - endptrick] ^ endptrick
+                if t >= nvertex:
+                    stack.append((t, endpoint[p]))
+                j += jstep
+                t = blossomchilds[b][j]
+                if t >= nvertex:
+                    stack.append((t, endpoint[p ^ 1]))
+                mate[endpoint[p]] = p ^ 1
+                mate[endpoint[p ^ 1]] = p
+            blossomchilds[b] = blossomchilds[b][i:] + blossomchilds[b][:i]
+            blossomendps[b] = blossomendps[b][i:] + blossomendps[b][:i]
+            blossombase[b] = v
+
+    def augmentMatching(k):
+        # Augment along the path through edge k between two S vertices.
+        (v, w, wt) = edges[k]
+        for (s, p) in ((v, 2 * k + 1), (w, 2 * k)):
+            while True:
+                bs = inblossom[s]
+                if bs >= nvertex:
+                    augmentBlossom(bs, s)
+                mate[s] = p
+                if labelend[bs] == -1:
+                    break
+                t = endpoint[labelend[bs]]
+                bt = inblossom[t]
+                s = endpoint[labelend[bt]]
+                j = endpoint[labelend[bt] ^ 1]
+                if bt >= nvertex:
+                    augmentBlossom(bt, j)
+                mate[j] = labelend[bt]
+                p = labelend[bt] ^ 1
+
+    # Each stage grows alternating trees from the free vertices until it
+    # finds an augmenting path, adjusting the duals whenever it gets stuck.
+    for _ in range(nvertex):
+        label[:] = (2 * nvertex) * [0]
+        bestedge[:] = (2 * nvertex) * [-1]
+        blossombestedges[nvertex:] = nvertex * [None]
+        allowedge[:] = nedge * [False]
+        queue[:] = []
+        touched[:] = []
+        istouched[:] = (2 * nvertex) * [False]
+        for v in range(nvertex):
+            if mate[v] == -1 and label[inblossom[v]] == 0:
+                assignLabel(v, 1, -1)
+        augmented = False
+        while True:
+            while queue and not augmented:
+                v = queue.pop()
+                for p in neighbend[v]:
+                    k = p // 2
+                    w = endpoint[p]
+                    if inblossom[v] == inblossom[w]:
+                        continue
+                    if not allowedge[k]:
+                        kslack = slack(k)
+                        if kslack <= 0:
+                            allowedge[k] = True
+                    if allowedge[k]:
+                        if label[inblossom[w]] == 0:
+                            assignLabel(w, 2, p ^ 1)
+                        elif label[inblossom[w]] == 1:
+                            base = scanBlossom(v, w)
+                            if base >= 0:
+                                addBlossom(base, k)
+                            else:
+                                augmentMatching(k)
+                                augmented = True
+                                break
+                        elif label[w] == 0:
+                            label[w] = 2
+                            labelend[w] = p ^ 1
+                    elif label[inblossom[w]] == 1:
+                        b = inblossom[v]
+                        if bestedge[b] == -1 or kslack < slack(bestedge[b]):
+                            bestedge[b] = k
+                    elif label[w] == 0:
+                        if bestedge[w] == -1 or kslack < slack(bestedge[w]):
+                            bestedge[w] = k
+                            touch(w)
+            if augmented:
+                break
+
+            # No augmenting path yet: find the largest dual change that
+            # keeps every slack non-negative.
+            deltatype = -1
+            delta = deltaedge = deltablossom = None
+            if not maxcardinality:
+                deltatype = 1
+                delta = min(dualvar[:nvertex])
+            for x in touched:
+                if (x < nvertex and label[inblossom[x]] == 0 and bestedge[x] != -1):
+                    d = slack(bestedge[x])
+                    if deltatype == -1 or d < delta:
+                        delta = d
+                        deltatype = 2
+                        deltaedge = bestedge[x]
+                if blossomparent[x] != -1:
+                    continue
+                if label[x] == 1 and bestedge[x] != -1:
+                    d = slack(bestedge[x]) // 2
+                    if deltatype == -1 or d < delta:
+                        delta = d
+                        deltatype = 3
+                        deltaedge = bestedge[x]
+                elif (x >= nvertex and label[x] == 2 and blossombase[x] >= 0
+                        and (deltatype == -1 or dualvar[x] < delta)):
+                    delta = dualvar[x]
+                    deltatype = 4
+                    deltablossom = x
+            if deltatype == -1:
+                # Nothing left to grow: the matching has maximum cardinality.
+                deltatype = 1
+                delta = max(0, min(dualvar[:nvertex]))
+
+            for x in touched:
+                if x < nvertex:
+                    if label[inblossom[x]] == 1:
+                        dualvar[x] -= delta
+                    elif label[inblossom[x]] == 2:
+                        dualvar[x] += delta
+                elif blossombase[x] >= 0 and blossomparent[x] == -1:
+                    if label[x] == 1:
+                        dualvar[x] += delta
+                    elif label[x] == 2:
+                        dualvar[x] -= delta
+
+            if deltatype == 1:
+                break
+            elif deltatype == 2:
+                allowedge[deltaedge] = True
+                (i, j, wt) = edges[deltaedge]
+                if label[inblossom[i]] == 0:
+                    i, j = j, i
+                queue.append(i)
+            elif deltatype == 3:
+                allowedge[deltaedge] = True
+                (i, j, wt) = edges[deltaedge]
+                queue.append(i)
+            else:
+                expandBlossom(deltablossom, False)
+
+        if not augmented:
+            break
+        # Expand S blossoms whose dual has dropped to zero.
+        for b in range(nvertex, 2 * nvertex):
+            if (blossomparent[b] == -1 and blossombase[b] >= 0
+                    and label[b] == 1 and dualvar[b] == 0):
+                expandBlossom(b, True)
+
+    return [endpoint[mate[v]] if mate[v] >= 0 else -1 for v in range(nvertex)]
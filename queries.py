@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+#
+# queries.py -- the SQL run by both tournament.py and tournament_aio.py
+#
+# Both modules send the same statements with the same %s placeholders, so a
+# change to the schema is made here once. Queries only one module runs are
+# kept next to the code that runs them.
+#
+
+# deleteTournaments, deleteMatches and deletePlayers
+DROP_MATCH_PARTITIONS = "SELECT drop_match_partitions()"
+TRUNCATE_TOURNAMENTS = "TRUNCATE tournaments, careers, head_to_head RESTART IDENTITY CASCADE"
+DELETE_ROUNDS_IN_TOURNAMENT = "DELETE FROM rounds WHERE tournament_id=(%s)"
+DELETE_MATCHES_IN_TOURNAMENT = "DELETE FROM matches WHERE tournament_id=(%s)"
+DELETE_ALL_ROUNDS = "DELETE FROM rounds"
+DELETE_ALL_MATCHES = "DELETE FROM matches"
+TRUNCATE_PLAYERS = "TRUNCATE players RESTART IDENTITY CASCADE"
+
+# archiveTournament
+LOCK_TOURNAMENT = "SELECT tournament_id FROM tournaments WHERE tournament_id=(%s) FOR UPDATE"
+ARCHIVE_TOURNAMENT = "SELECT archive_tournament(%s)"
+
+CREATE_TOURNAMENT = "INSERT INTO tournaments(tournament_name) VALUES(%s) RETURNING tournament_id"
+ADD_PLAYER_TO_TOURNAMENT = "INSERT INTO players_in_tournaments(player_id, tournament_id) VALUES(%s, %s)"
+# The tournament, then an array of player ids
+ADD_PLAYERS_TO_TOURNAMENT = """
+INSERT INTO players_in_tournaments(player_id, tournament_id)
+SELECT player_id, %s FROM unnest(%s::integer[]) AS player_id
+"""
+
+# Every player in a tournament has a row in its standings
+COUNT_TOURNAMENT_PLAYERS = "SELECT COUNT(*) FROM standings WHERE tournament_id=(%s)"
+COUNT_PLAYERS = "SELECT COUNT(*) FROM players"
+
+REGISTER_PLAYER = "INSERT INTO players(player_name) VALUES(%s) RETURNING player_id"
+# An array of names; the ids come back in the same order
+REGISTER_PLAYERS = """
+INSERT INTO players(player_name)
+SELECT player_name FROM unnest(%s::text[]) AS player_name
+RETURNING player_id
+"""
+
+# The standings table is kept up to date by triggers as matches are reported
+PLAYER_STANDINGS = """
+SELECT standings.player_id AS id, players.player_name AS name, standings.wins, standings.matches,
+       standings.points
+FROM standings JOIN players ON players.player_id = standings.player_id
+WHERE standings.tournament_id=(%s)
+ORDER BY standings.points DESC, standings.player_id
+"""
+# Tiebreaks are worked out from every match but byes
+ORDERED_MATCHES = """
+SELECT winner_id, loser_id, result = 'draw' FROM matches WHERE tournament_id=(%s) AND result <> 'bye'
+ORDER BY match_id
+"""
+
+REPORT_MATCH = """
+INSERT INTO matches(winner_id, loser_id, tournament_id, round_no, result)
+VALUES(%s,%s, %s, (SELECT MAX(round_no) FROM rounds WHERE tournament_id=(%s)), %s)
+"""
+REPORT_BYE = """
+INSERT INTO matches(winner_id, loser_id, tournament_id, round_no, result)
+VALUES(%s, NULL, %s, (SELECT MAX(round_no) FROM rounds WHERE tournament_id=(%s)), 'bye')
+"""
+# reportMatches checks the players of the batch, then writes it from arrays of winners, losers and results, with the
+# match ids coming back in the same order
+TOURNAMENT_MEMBERS = "SELECT player_id FROM standings WHERE tournament_id=(%s) AND player_id = ANY(%s)"
+REPORT_MATCHES = """
+INSERT INTO matches(winner_id, loser_id, tournament_id, round_no, result)
+SELECT winner_id, loser_id, %s, (SELECT MAX(round_no) FROM rounds WHERE tournament_id=(%s)), result
+FROM unnest(%s::integer[], %s::integer[], %s::match_result[]) AS result(winner_id, loser_id, result)
+RETURNING match_id
+"""
+
+PLAYED_MATCHES = "SELECT winner_id, loser_id FROM matches WHERE tournament_id=(%s)"
+CURRENT_ROUND = "SELECT COALESCE(MAX(round_no), 0) FROM rounds WHERE tournament_id=(%s)"
+ROUND_PAIRINGS = """
+SELECT pairs.player1_id, player1.player_name, pairs.player2_id, player2.player_name,
+       CASE WHEN played.result <> 'draw' THEN played.winner_id END, played.result::text
+FROM round_pairings AS pairs
+JOIN players AS player1 ON player1.player_id = pairs.player1_id
+LEFT JOIN players AS player2 ON player2.player_id = pairs.player2_id
+LEFT JOIN LATERAL (SELECT matches.winner_id, matches.result FROM matches
+                   WHERE matches.tournament_id=(%s) AND matches.round_no = pairs.round_no
+                     AND ((matches.winner_id = pairs.player1_id
+                           AND matches.loser_id IS NOT DISTINCT FROM pairs.player2_id)
+                          OR (matches.winner_id = pairs.player2_id AND matches.loser_id = pairs.player1_id))
+                   ORDER BY matches.match_id DESC LIMIT 1) AS played ON true
+WHERE pairs.tournament_id=(%s)
+  AND pairs.round_no = COALESCE(%s, (SELECT MAX(round_no) FROM rounds WHERE tournament_id=(%s)))
+ORDER BY pairs.board
+"""
+STANDINGS_SNAPSHOT = """
+SELECT snapshot.player_id AS id, players.player_name AS name, snapshot.wins, snapshot.matches
+FROM standings_snapshots AS saved
+CROSS JOIN LATERAL unnest(saved.player_ids, saved.wins, saved.matches)
+     WITH ORDINALITY AS snapshot(player_id, wins, matches, position)
+JOIN players ON players.player_id = snapshot.player_id
+WHERE saved.tournament_id=(%s) AND saved.round_no=(%s)
+ORDER BY snapshot.position
+"""
+
+PLAYER_CAREER = """
+SELECT players.player_id, players.player_name, COALESCE(careers.events, 0), COALESCE(careers.wins, 0),
+       COALESCE(careers.draws, 0), COALESCE(careers.matches, 0), COALESCE(careers.points, 0)
+FROM players LEFT JOIN careers ON careers.player_id = players.player_id
+WHERE players.player_id=(%s)
+"""
+HEAD_TO_HEAD = "SELECT wins, draws, losses FROM head_to_head WHERE player_id=(%s) AND opponent_id=(%s)"
+
+PAIRING_STATE = """
+SELECT standings.player_id, players.player_name, standings.wins, standings.matches, standings.points,
+       standings.byes, standings.opponents, standings.last_float, players.rating
+FROM standings JOIN players ON players.player_id = standings.player_id
+WHERE standings.tournament_id=(%s)
+ORDER BY standings.points DESC, standings.player_id
+"""
+PAIRING_CANDIDATES = """
+SELECT seat, player_id, player_name, points, byes, candidates FROM pairing_candidates(%s, %s) ORDER BY seat
+"""
+
+# pairAll, for an array of tournaments. They are locked in order, so that two calls with overlapping tournaments
+# cannot deadlock.
+LOCK_TOURNAMENTS = """
+SELECT tournament_id FROM tournaments WHERE tournament_id = ANY(%s) ORDER BY tournament_id FOR UPDATE
+"""
+CURRENT_ROUNDS = """
+SELECT tournament_id, MAX(round_no) FROM rounds WHERE tournament_id = ANY(%s) GROUP BY tournament_id
+"""
+UNFINISHED_ROUNDS = """
+SELECT DISTINCT pairs.tournament_id
+FROM round_pairings AS pairs
+JOIN (SELECT tournament_id, MAX(round_no) AS round_no FROM rounds WHERE tournament_id = ANY(%s)
+      GROUP BY tournament_id) AS current
+  ON current.tournament_id = pairs.tournament_id AND current.round_no = pairs.round_no
+WHERE NOT EXISTS (SELECT 1 FROM matches
+                  WHERE matches.tournament_id = pairs.tournament_id AND matches.round_no = pairs.round_no
+                    AND ((matches.winner_id = pairs.player1_id
+                          AND matches.loser_id IS NOT DISTINCT FROM pairs.player2_id)
+                         OR (matches.winner_id = pairs.player2_id AND matches.loser_id = pairs.player1_id)))
+ORDER BY pairs.tournament_id
+"""
+SNAPSHOT_STANDINGS = """
+INSERT INTO standings_snapshots(tournament_id, round_no, player_ids, wins, matches, points)
+SELECT standings.tournament_id, current.round_no, array_agg(player_id ORDER BY points DESC, player_id),
+       array_agg(wins ORDER BY points DESC, player_id), array_agg(matches ORDER BY points DESC, player_id),
+       array_agg(points ORDER BY points DESC, player_id)
+FROM standings
+JOIN (SELECT tournament_id, MAX(round_no) AS round_no FROM rounds WHERE tournament_id = ANY(%s)
+      GROUP BY tournament_id) AS current ON current.tournament_id = standings.tournament_id
+GROUP BY standings.tournament_id, current.round_no
+"""
+SECTIONS_PAIRING_STATE = """
+SELECT standings.tournament_id, standings.player_id, standings.points, standings.byes, standings.opponents,
+       standings.last_float, players.player_name, players.rating
+FROM standings JOIN players ON players.player_id = standings.player_id
+WHERE standings.tournament_id = ANY(%s)
+ORDER BY standings.tournament_id, standings.points DESC, standings.player_id
+"""
+# The new rounds, their pairings and their byes, each from one array per column
+START_ROUNDS = "INSERT INTO rounds(tournament_id, round_no) SELECT * FROM unnest(%s::integer[], %s::integer[])"
+START_ROUND_PAIRINGS = """
+INSERT INTO round_pairings(tournament_id, round_no, board, player1_id, player2_id)
+SELECT * FROM unnest(%s::integer[], %s::integer[], %s::integer[], %s::integer[], %s::integer[])
+"""
+REPORT_BYES = """
+INSERT INTO matches(winner_id, tournament_id, round_no, result)
+SELECT winner_id, tournament_id, round_no, 'bye' FROM unnest(%s::integer[], %s::integer[], %s::integer[])
+     AS byes(winner_id, tournament_id, round_no)
+"""
+
+# rateRound
+LOCK_ROUND = """
+SELECT round_no, rated FROM rounds
+WHERE tournament_id=(%s)
+  AND round_no = COALESCE(%s, (SELECT MAX(round_no) FROM rounds WHERE tournament_id=(%s)))
+FOR UPDATE
+"""
+ROUND_RESULTS = """
+SELECT matches.winner_id, matches.loser_id, matches.result = 'draw', winner.rating, loser.rating,
+       COALESCE(matches.round_no, 0)
+FROM matches
+JOIN players AS winner ON winner.player_id = matches.winner_id
+JOIN players AS loser ON loser.player_id = matches.loser_id
+WHERE matches.tournament_id=(%s) AND matches.result <> 'bye'
+  AND (matches.round_no=(%s) OR (%s = 1 AND matches.round_no IS NULL))
+"""
+# An array of player ids and one of their new ratings
+UPDATE_RATINGS = """
+UPDATE players SET rating = rated.rating
+FROM unnest(%s::integer[], %s::double precision[]) AS rated(player_id, rating)
+WHERE players.player_id = rated.player_id
+"""
+MARK_RATED = "UPDATE rounds SET rated = true WHERE tournament_id=(%s) AND round_no=(%s)"
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+#
+# ratings.py -- Elo ratings, updated with NumPy one rating period at a time
+#
+
+import numpy as np
+
+
+def eloPeriod(ratings, winners, losers, draws, k):
+    """Applies one rating period's results to an array of ratings.
+
+    Every result is scored against the ratings as they stood at the start of
+    the period, with the Elo expectation, and each player's changes are
+    added up, so the order of the results within a period does not matter.
+    A round is one period: each player plays at most once in it.
+
+    Args:
+      ratings: a float array of ratings by dense player index, changed in place
+      winners: the dense indexes of the winners, one per result
+      losers: the dense indexes of the losers
+      draws: a bool array, true where the result was a draw
+      k: the K-factor, the most a rating can move in one game
+
+    Returns:
+      The ratings array.
+    """
+    expected = 1.0 / (1.0 + 10.0 ** ((ratings[losers] - ratings[winners]) / 400.0))
+    change = k * (np.where(draws, 0.5, 1.0) - expected)
+    np.add.at(ratings, winners, change)
+    np.subtract.at(ratings, losers, change)
+    return ratings
+
+def replayRatings(ratings, winners, losers, draws, periods, k):
+    """Applies results period after period, as eloPeriod does for one.
+
+    Args:
+      ratings: a float array of ratings by dense player index, changed in place
+      winners, losers, draws: the results, as for eloPeriod
+      periods: the rating period of each result, a number that only grows
+        from one period to the next; results must be sorted by it
+      k: the K-factor
+
+    Returns:
+      The ratings array.
+    """
+    if not len(periods):
+        return ratings
+    bounds = np.flatnonzero(np.diff(periods)) + 1
+    for start, end in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(periods)]))):
+        eloPeriod(ratings, winners[start:end], losers[start:end], draws[start:end], k)
+    return ratings
+
+def periodRanks(rounds, tournaments, round_numbers):
+    """
+    Returns the rating period of each match, as a number ordering the periods.
+    Rounds are periods in the order they were started. The matches a
+    tournament has outside of any round form one period before its first
+    round, or, for a tournament that never started one, before every round.
+    :param rounds:(tournament_id, round_no) tuples in the order they started
+    :param tournaments:an int array of each match's tournament
+    :param round_numbers:an int array of each match's round, 0 outside of one
+    :return:an int64 array of period numbers, one per match
+    """
+    stride = max([round_no for (tournament, round_no) in rounds] + [0]) + 1
+    keys = []
+    ranks = []
+    started = set()
+    for rank, (tournament, round_no) in enumerate(rounds):
+        if tournament not in started:
+            started.add(tournament)
+            keys.append(tournament * stride)
+            ranks.append(2 * rank)
+        keys.append(tournament * stride + round_no)
+        ranks.append(2 * rank + 1)
+    tournaments = np.asarray(tournaments, dtype=np.int64)
+    match_keys = tournaments * stride + np.asarray(round_numbers, dtype=np.int64)
+    # Tournaments that never started a round come first, one period each, in id order
+    periods = tournaments - (int(tournaments.max()) + 1 if len(tournaments) else 0)
+    if keys:
+        keys = np.array(keys, dtype=np.int64)
+        sort = np.argsort(keys)
+        keys = keys[sort]
+        ranks = np.array(ranks, dtype=np.int64)[sort]
+        found = np.minimum(np.searchsorted(keys, match_keys), len(keys) - 1)
+        known = keys[found] == match_keys
+        periods[known] = ranks[found[known]]
+    return periods
+
+class CopyBinaryRows(object):
+    """
+    A file for cursor.copy_expert to write a COPY ... TO STDOUT WITH (FORMAT
+    binary) into, for rows of non-null int4 columns only. The bytes are
+    parsed as they arrive, a chunk at a time, into native int32 arrays, so
+    the whole of the COPY's output is never held at once.
+    :param columns:the names of the columns, in order
+    :param chunk_size:how many bytes to gather before parsing them
+    """
+
+    def __init__(self, columns, chunk_size=1 << 20):
+        self.columns = columns
+        self.chunk_size = chunk_size
+        fields = [('count', '>i2')]
+        for column in columns:
+            fields += [(column + '_length', '>i4'), (column, '>i4')]
+        self._row = np.dtype(fields)
+        self._parsed = np.dtype([(column, np.int32) for column in columns])
+        self._buffer = bytearray()
+        # Where the rows start in the buffer, once the header has arrived
+        self._start = None
+        self._chunks = []
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= self.chunk_size:
+            self._parse()
+
+    def _parse(self):
+        if self._start is None:
+            # An 11 byte signature, 4 bytes of flags and the length of a header extension
+            if len(self._buffer) < 19:
+                return
+            self._start = 19 + int(np.frombuffer(self._buffer, dtype='>i4', count=1, offset=15)[0])
+        count = max(len(self._buffer) - self._start, 0) // self._row.itemsize
+        if not count:
+            return
+        # Copied out by a method of its own, so that no view of the buffer is left when it shrinks
+        self._chunks.append(self._copyRows(count))
+        del self._buffer[:self._start + count * self._row.itemsize]
+        self._start = 0
+
+    def _copyRows(self, count):
+        rows = np.frombuffer(self._buffer, dtype=self._row, count=count, offset=self._start)
+        if (rows['count'] != len(self.columns)).any() or \
+                any((rows[column + '_length'] != 4).any() for column in self.columns):
+            raise ValueError("Not A COPY Of int4 Columns")
+        chunk = np.empty(count, dtype=self._parsed)
+        for column in self.columns:
+            chunk[column] = rows[column]
+        return chunk
+
+    def rows(self):
+        """
+        Returns every row written as a NumPy record array, with one int32
+        field per column.
+        """
+        self._parse()
+        # Only the two bytes ending the data are left
+        chunks, self._chunks = self._chunks, []
+        if not chunks:
+            return np.empty(0, dtype=self._parsed)
+        return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+def readCopyBinary(data, columns):
+    """
+    Returns the rows of a COPY ... TO STDOUT WITH (FORMAT binary) as a NumPy
+    record array, for rows of non-null int4 columns only, as CopyBinaryRows
+    does for a COPY written to it.
+    :param data:the bytes written by the COPY
+    :param columns:the names of the columns, in order
+    :return:a record array with one int32 field per column
+    """
+    sink = CopyBinaryRows(columns)
+    sink.write(data)
+    return sink.rows()
+
+def rateResults(results, k):
+    """Rates the results of one or more periods from the players' current ratings.
+
+    Args:
+      results: a list of (winner_id, loser_id, draw, winner_rating,
+        loser_rating, period) tuples, with the ratings as they stand before
+        any of the results
+      k: the K-factor
+
+    Returns:
+      A dict from the id of every player in the results to their new rating.
+    """
+    if not results:
+        return {}
+    winner_ids, loser_ids, draws, winner_ratings, loser_ratings, periods = [np.array(column)
+                                                                            for column in zip(*results)]
+    player_ids, indexes = np.unique(np.concatenate((winner_ids, loser_ids)), return_inverse=True)
+    ratings = np.empty(len(player_ids))
+    ratings[indexes] = np.concatenate((winner_ratings, loser_ratings))
+    order = np.argsort(periods, kind='mergesort')
+    replayRatings(ratings, indexes[:len(results)][order], indexes[len(results):][order],
+                  draws[order].astype(bool), periods[order], k)
+    return dict(zip(player_ids.tolist(), ratings.tolist()))
+
+def replayMatches(matches, rounds, player_ids, initial, k):
+    """Rates every player again from scratch over the whole match history.
+
+    Args:
+      matches: a record array of every result that is not a bye, with
+        tournament_id, round_no, winner_id, loser_id and draw fields, as
+        readCopyBinary returns them; round_no is 0 outside of any round
+      rounds: (tournament_id, round_no) tuples in the order they started
+      player_ids: the ids of every player
+      initial: the rating every player starts from
+      k: the K-factor
+
+    Returns:
+      A float array of the players' ratings, in the order of player_ids.
+    """
+    player_ids = np.asarray(player_ids, dtype=np.int64)
+    ratings = np.full(len(player_ids), float(initial))
+    if not len(matches) or not len(player_ids):
+        return ratings
+    # Player ids are dense enough to map to indexes through a lookup table
+    lookup = np.zeros(int(player_ids.max()) + 1, dtype=np.int64)
+    lookup[player_ids] = np.arange(len(player_ids))
+    periods = periodRanks(rounds, matches['tournament_id'], matches['round_no'])
+    order = np.argsort(periods, kind='mergesort')
+    return replayRatings(ratings, lookup[matches['winner_id'][order]], lookup[matches['loser_id'][order]],
+                         matches['draw'][order] != 0, periods[order], k)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+#
+# simulation.py -- Monte Carlo simulation of a tournament's remaining rounds, with NumPy
+#
+
+import numpy as np
+
+
+def _rematches(first, second, played, history, rows):
+    """Returns where the pairs of one board, over every trial, have met before."""
+    players = history.shape[1]
+    keys = np.minimum(first, second).astype(np.int64) * players + np.maximum(first, second)
+    found = np.minimum(np.searchsorted(played, keys), max(len(played) - 1, 0))
+    before = played[found] == keys if len(played) else np.zeros(len(keys), dtype=bool)
+    return before | (history[rows, first] == second[:, None]).any(axis=1)
+
+def _pairRound(points, byes, rating_ranks, played, history):
+    """Pairs one round of every trial in the batch, as swissPairings would.
+
+    Each trial's players are sorted by points and rating, and every score
+    group folded so that its top half plays its bottom half, as
+    pairing.ratingOrder does, without the float order. The bye goes to the
+    lowest player in that order who has not had one. A board that would be a
+    rematch swaps its second player with the next board's, which is as far
+    as the backtracking of pairPlayers is followed.
+
+    Returns:
+      Two int arrays of shape (trials, boards), the players of each board,
+      and an array of the player given the bye in each trial, or None.
+    """
+    trials, players = points.shape
+    rows = np.arange(trials)
+    order = np.argsort((points.max() - points) * players + rating_ranks, axis=1, kind='mergesort')
+    sorted_points = np.take_along_axis(points, order, axis=1)
+    positions = np.broadcast_to(np.arange(players), (trials, players))
+    # The first and last position of every player's score group
+    new_group = np.ones((trials, players), dtype=bool)
+    new_group[:, 1:] = sorted_points[:, 1:] != sorted_points[:, :-1]
+    starts = np.maximum.accumulate(np.where(new_group, positions, 0), axis=1)
+    group_end = np.ones((trials, players), dtype=bool)
+    group_end[:, :-1] = new_group[:, 1:]
+    ends = np.minimum.accumulate(np.where(group_end, positions, players - 1)[:, ::-1], axis=1)[:, ::-1]
+    place = positions - starts
+    size = ends - starts + 1
+    half = size // 2
+    # The player left over from an odd group stays last
+    folded = starts + np.where(place < half, 2 * place, np.minimum(2 * (place - half) + 1, size - 1))
+    seats = np.empty_like(order)
+    np.put_along_axis(seats, folded, order, axis=1)
+
+    bye = None
+    if players % 2:
+        # The lowest seat without a bye, or the lowest seat if everyone has had one
+        eligible = byes[rows[:, None], seats] == 0
+        last = players - 1 - np.argmax(eligible[:, ::-1], axis=1)
+        last = np.where(eligible.any(axis=1), last, players - 1)
+        bye = seats[rows, last]
+        keep = np.ones((trials, players), dtype=bool)
+        keep[rows, last] = False
+        seats = seats[keep].reshape(trials, players - 1)
+
+    first, second = seats[:, 0::2].copy(), seats[:, 1::2].copy()
+    boards = first.shape[1]
+    for board in range(boards):
+        swap = _rematches(first[:, board], second[:, board], played, history, rows)
+        other = board + 1 if board + 1 < boards else board - 1
+        if not swap.any() or other < 0:
+            continue
+        second[swap, board], second[swap, other] = second[swap, other], second[swap, board]
+    return first, second, bye
+
+def simulateTrials(task):
+    """Plays the remaining rounds of a tournament for a batch of trials at once.
+
+    Every array holds one row per trial and one column per player, so each
+    round is paired and played in every trial with the same few NumPy
+    operations. Results follow the Elo expectation of the players' ratings,
+    with a share of draws, and ratings stay as they are. Players tied on
+    points at the end are put in a random order, as an unknown tiebreak
+    would.
+
+    Args:
+      task: a (points, byes, ratings, played, rounds, trials, draw_rate,
+        top, seed) tuple, where points are each player's half-points, played
+        is a sorted array of the pairs already met, each as
+        min(i, j) * players + max(i, j) of their indexes, and top lists the
+        places to count finishes within
+
+    Returns:
+      An int array with a row for each place in top, counting the trials in
+      which each player finished within it, and a float array of each
+      player's half-points summed over the trials.
+    """
+    points, byes, ratings, played, rounds, trials, draw_rate, top, seed = task
+    generator = np.random.RandomState(seed)
+    players = len(points)
+    rows = np.arange(trials)
+    points = np.tile(np.asarray(points, dtype=np.int64), (trials, 1))
+    byes = np.tile(np.asarray(byes, dtype=np.int64), (trials, 1))
+    ratings = np.asarray(ratings, dtype=np.float64)
+    rating_ranks = np.empty(players, dtype=np.int64)
+    rating_ranks[np.argsort(-ratings, kind='mergesort')] = np.arange(players)
+    # The opponents of every simulated round, -1 for none
+    history = np.full((trials, players, max(rounds, 1)), -1, dtype=np.int32)
+    for round_index in range(rounds):
+        first, second, bye = _pairRound(points, byes, rating_ranks, played, history)
+        expected = 1.0 / (1.0 + 10.0 ** ((ratings[second] - ratings[first]) / 400.0))
+        outcome = generator.random_sample(first.shape)
+        draw = outcome < draw_rate
+        first_wins = ~draw & (outcome < draw_rate + (1.0 - draw_rate) * expected)
+        points[rows[:, None], first] += np.where(draw, 1, np.where(first_wins, 2, 0))
+        points[rows[:, None], second] += np.where(draw, 1, np.where(first_wins, 0, 2))
+        history[rows[:, None], first, round_index] = second
+        history[rows[:, None], second, round_index] = first
+        if bye is not None:
+            points[rows, bye] += 2
+            byes[rows, bye] += 1
+    finish = np.lexsort((generator.random_sample((trials, players)), -points))
+    places = np.empty_like(finish)
+    np.put_along_axis(places, finish, np.broadcast_to(np.arange(players), (trials, players)), axis=1)
+    counts = np.array([(places < n).sum(axis=0) for n in top], dtype=np.int64).reshape(len(top), players)
+    return counts, points.sum(axis=0).astype(np.float64)
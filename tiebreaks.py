@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+# tiebreaks.py -- Swiss tiebreak scores, computed with NumPy
+#
+
+from itertools import chain
+
+import numpy as np
+
+
+TIEBREAKS = ("buchholz", "sonneborn_berger", "cumulative")
+
+
+def computeTiebreaks(standings, matches, tiebreaks, scores=None):
+    """Adds tiebreak scores to a tournament's standings and sorts by them.
+
+    Players are mapped to dense indexes, and every score is computed over
+    the whole edge list at once, on the same scale as the scores they
+    separate:
+      buchholz: the sum of the scores of each opponent.
+      sonneborn_berger: the sum of the scores of each opponent beaten, and
+        half the scores of each opponent drawn with.
+      cumulative: the sum of the player's running score after each of their
+        matches, which rewards scoring early.
+    Only the matches passed in are counted, so byes can be left out of the
+    tiebreaks while scores still decide the order.
+
+    Args:
+      standings: a list of (id, name, wins, matches, ...) tuples
+      matches: a list of (winner_id, loser_id, draw) tuples, in the order
+        played, where draw is true for a drawn match
+      tiebreaks: a list of tiebreak names, most important first
+      scores: an optional list of each player's score to sort by before the
+        tiebreaks, in standings order, e.g. points; wins by default
+
+    Returns:
+      The standings with one extra column per tiebreak, sorted by score and
+      then by each tiebreak, highest first, and by id last.
+
+    Raises:
+      ValueError: if a tiebreak is unknown, or a match names a player who is
+        not in the standings.
+    """
+    for name in tiebreaks:
+        if name not in TIEBREAKS:
+            raise ValueError("Unknown Tiebreak")
+    if not standings:
+        return []
+    ids = np.fromiter((row[0] for row in standings), dtype=np.int64, count=len(standings))
+    if scores is None:
+        scores = np.fromiter((row[2] for row in standings), dtype=np.float64, count=len(standings))
+    else:
+        scores = np.asarray(scores, dtype=np.float64)
+    results = np.fromiter(chain.from_iterable((winner, loser) for (winner, loser, draw) in matches),
+                          dtype=np.int64, count=2 * len(matches))
+    draws = np.fromiter((draw for (winner, loser, draw) in matches), dtype=bool, count=len(matches))
+    # Dense indexes for the winner and loser of every match, looked up in a
+    # table indexed by player id; ids are serial, so the table stays small.
+    # Players of the matches who are not in the standings are left at -1.
+    index = np.full(max(ids.max(), results.max() if len(results) else 0) + 1, -1, dtype=np.int64)
+    index[ids] = np.arange(len(ids))
+    players = index[results]
+    if (players < 0).any():
+        raise ValueError("Players Not In Standings: {0}".format(sorted(set(results[players < 0].tolist()))))
+    winners = players[0::2]
+    losers = players[1::2]
+    # What each side scored in every match
+    winner_results = np.where(draws, 0.5, 1.0)
+    loser_results = np.where(draws, 0.5, 0.0)
+
+    def total(index, values):
+        # Sums values per player; much faster than np.add.at
+        return np.bincount(index, weights=values, minlength=len(ids))
+
+    columns = []
+    for name in tiebreaks:
+        if name == "buchholz":
+            score = total(winners, scores[losers]) + total(losers, scores[winners])
+        elif name == "sonneborn_berger":
+            score = total(winners, winner_results * scores[losers]) + total(losers, loser_results * scores[winners])
+        else:
+            # Number each player's matches 0, 1, 2, ... in the order played;
+            # a result in match k is counted in the running total of that
+            # match and every later one. players lists both sides of each
+            # match in match order, so a stable sort groups them by player in
+            # order.
+            by_player = np.argsort(players, kind='mergesort')
+            counts = np.bincount(players, minlength=len(ids))
+            first = np.cumsum(counts) - counts
+            rank = np.empty(len(players), dtype=np.int64)
+            rank[by_player] = np.arange(len(players)) - first[players[by_player]]
+            remaining = counts[players] - rank
+            score = (total(winners, winner_results * remaining[0::2]) +
+                     total(losers, loser_results * remaining[1::2]))
+        columns.append(score)
+
+    # np.lexsort sorts by its last key first
+    keys = [ids] + [-column for column in reversed(columns)] + [-scores]
+    ranked = np.lexsort(keys)
+    columns = [column.tolist() for column in columns]
+    return [tuple(standings[i]) + tuple(column[i] for column in columns) for i in ranked.tolist()]
@@ -3,105 +3,796 @@
 # tournament.py -- implementation of a Swiss-system tournament
 #
 
+import multiprocessing
+import numbers
+import re
+import threading
+import time
+import weakref
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import chain, groupby
+
 import psycopg2
-import bleach
-from itertools import chain
+from psycopg2.extras import execute_values
+
+import instrumentation
+import pairing
+import queries
 
 DBNAME = 'tournament'
 
+# How many seats below each player swissPairings(server_side=True) asks the
+# database for candidate opponents at first; as many as optimalPairing looks
+# at, so that the optimal mode rarely needs a second query
+CANDIDATE_WINDOW = 16
+
+# The rating new players start from, as in the players table, and the most a
+# rating can move in one game
+INITIAL_RATING = 1500
+RATING_K_FACTOR = 32
+
+# Ids may also be given as strings of digits, e.g. straight from a URL
+_DIGITS = re.compile(r'^\s*[0-9]+\s*$')
+
+# Control characters, including newlines and tabs, are never kept in names
+_CONTROL_CHARACTERS = re.compile(u'[\x00-\x1f\x7f]+')
+
+try:
+    _string_types = (str, unicode)
+except NameError:
+    _string_types = (str,)
+
+def _id(value):
+    """
+    Returns an id number as an int. Ints and strings of digits are accepted;
+    anything else, including bools and floats, raises ValueError.
+    """
+    if isinstance(value, numbers.Integral) and not isinstance(value, bool):
+        return int(value)
+    if isinstance(value, _string_types) and _DIGITS.match(value):
+        return int(value)
+    raise ValueError("Invalid Id: {0!r}".format(value))
+
+def _optionalId(value):
+    """Like _id, but None (meaning every record) is passed through."""
+    return None if value is None else _id(value)
+
+def _name(value):
+    """
+    Returns a player or tournament name cleaned for storage: control characters
+    become spaces and surrounding whitespace is dropped. Names are stored as
+    plain text, so they have to be escaped wherever they are shown as HTML.
+    """
+    if not isinstance(value, _string_types):
+        raise ValueError("Invalid Name: {0!r}".format(value))
+    value = _CONTROL_CHARACTERS.sub(u' ', value).strip()
+    if not value:
+        raise ValueError("Invalid Name: {0!r}".format(value))
+    return value
+
 def connect(dbname=DBNAME):
     """Connect to the PostgreSQL database.  Returns a database connection."""
-    connection = psycopg2.connect('dbname=' + dbname)
-    cursor = connection.cursor()
+    connection = instrumentation.connect('dbname=' + dbname)
+    cursor = connection.cursor(cursor_factory=instrumentation.TimedCursor)
     return connection, cursor
 
-def deleteTournaments():
-    """Delete all tournaments from database."""
-    db, cursor = connect()
-    delete_tournaments_query = "DELETE FROM tournaments"
-    cursor.execute(delete_tournaments_query)
-    db.commit()
-    db.close()
 
-def deleteMatches(tournament=None):
+class ConnectionPool(object):
+    """A thread-safe pool of PostgreSQL connections.
+
+    At least min_size connections are kept open and no more than max_size are
+    ever open at once; a caller asking for a connection while max_size are in
+    use waits for one to be returned. Idle connections above min_size are
+    closed once they have been unused for idle_timeout seconds (None keeps
+    them forever).
     """
-    If a tournament id number is passed, delete that tournament's matches,
-    else, remove all the match records from the database.
+
+    def __init__(self, dbname=DBNAME, min_size=1, max_size=10, idle_timeout=300):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size")
+        self.dbname = dbname
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        # (connection, released_at) pairs, the most recently used last
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._lock = threading.Condition()
+        for _ in range(min_size):
+            self._idle.append((instrumentation.connect('dbname=' + dbname), time.time()))
+            self._size += 1
+
+    def getconn(self):
+        """Borrow a connection from the pool, opening one if needed."""
+        with self._lock:
+            if self._closed:
+                raise psycopg2.InterfaceError("Connection pool is closed")
+            self._expire()
+            while True:
+                while self._idle:
+                    connection, _ = self._idle.pop()
+                    if not connection.closed:
+                        return connection
+                    self._size -= 1
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                self._lock.wait()
+        try:
+            return instrumentation.connect('dbname=' + self.dbname)
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+            raise
+
+    def putconn(self, connection):
+        """Return a borrowed connection, rolling back anything uncommitted."""
+        if not connection.closed:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                connection.close()
+        with self._lock:
+            if self._closed and not connection.closed:
+                connection.close()
+            if connection.closed:
+                self._size -= 1
+            else:
+                self._idle.append((connection, time.time()))
+            self._lock.notify()
+
+    def closeall(self):
+        """Close every idle connection; borrowed ones are closed on return."""
+        with self._lock:
+            self._closed = True
+            for connection, _ in self._idle:
+                connection.close()
+                self._size -= 1
+            self._idle = []
+
+    def _expire(self):
+        # Oldest idle connections sit at the front of the list.
+        if self.idle_timeout is None:
+            return
+        cutoff = time.time() - self.idle_timeout
+        while (self._idle and self._size > self.min_size
+               and self._idle[0][1] < cutoff):
+            connection, _ = self._idle.pop(0)
+            connection.close()
+            self._size -= 1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def configurePool(dbname=DBNAME, min_size=1, max_size=10, idle_timeout=300):
     """
-    db, cursor = connect()
-    tournament = bleach.clean(tournament)
-    if tournament:
-        delete_match_in_tournament_query = "DELETE FROM matches WHERE tournament_id=(%s)"
-        cursor.execute(delete_match_in_tournament_query, (tournament,))
+    Replace the connection pool shared by all functions in this module.
+    Returns the new pool.
+    """
+    global _pool
+    pool = ConnectionPool(dbname, min_size, max_size, idle_timeout)
+    with _pool_lock:
+        old_pool, _pool = _pool, pool
+    if old_pool is not None:
+        old_pool.closeall()
+    return pool
+
+def getPool():
+    """Returns the shared connection pool, creating a default one if needed."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
+
+_read_pool = None
+_read_max_wait = 1.0
+_read_stats = {'replica': 0, 'fallbacks': 0, 'waits': 0}
+# The position in the primary's WAL of the latest commit made by each thread
+_last_write = threading.local()
+
+def configureReadPool(dbname=None, min_size=1, max_size=10, idle_timeout=300, max_wait=1.0):
+    """
+    Send the reads of this module to a second database, such as a streaming
+    replica of the primary, while writes stay on the pool of configurePool.
+    dbname may carry other connection settings too, as in
+    'tournament host=replica port=5433'; with dbname None, reads go back to
+    the primary. Each thread reads its own writes: a read waits for the
+    replica to replay the thread's latest commit, for at most max_wait
+    seconds, and then goes to the primary instead.
+    Returns the new pool, or None.
+    """
+    global _read_pool, _read_max_wait
+    pool = ConnectionPool(dbname, min_size, max_size, idle_timeout) if dbname is not None else None
+    with _pool_lock:
+        old_pool, _read_pool = _read_pool, pool
+        _read_max_wait = max_wait
+    if old_pool is not None:
+        old_pool.closeall()
+    return pool
+
+def getReadStats():
+    """
+    Returns how many reads went to the replica, how many went to the primary
+    because the replica was too far behind, and how many had to wait.
+    """
+    with _pool_lock:
+        return dict(_read_stats)
+
+def getLastWriteLsn(session=None):
+    """
+    Returns the WAL position of this thread's latest commit on the primary,
+    or of the session's if one is given, as text, or None. Hand it to
+    setLastWriteLsn or readSession in another thread or process, e.g.
+    through a cookie, to read those writes there too.
+    """
+    lsn = session.lsn if session is not None else getattr(_last_write, 'lsn', 0)
+    return _lsnText(lsn) if lsn else None
+
+def setLastWriteLsn(lsn):
+    """Make this thread's reads wait for a WAL position from getLastWriteLsn."""
+    _last_write.lsn = max(getattr(_last_write, 'lsn', 0), _lsn(lsn))
+
+def _lsn(text):
+    """Turns a WAL position such as '16/B374D848' into an int, to compare them."""
+    high, low = text.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+def _lsnText(lsn):
+    return "%X/%X" % (lsn >> 32, lsn & 0xFFFFFFFF)
+
+
+class Session(object):
+    """A database session on a connection borrowed from the pool.
+
+    Every function in this module takes an optional session argument. When a
+    session is passed, the call runs on its connection and inside its
+    transaction, and nothing is committed until the session is. Used as a
+    context manager, a session commits on success, rolls back on error and
+    hands its connection back to the pool. The cached results of the
+    tournaments it wrote to are dropped when it commits.
+
+    While reads are routed to a read pool, a commit of a session that wrote
+    records the primary's WAL position on the session, in lsn, as well as
+    for the committing thread; see readSession.
+    """
+
+    def __init__(self, pool=None):
+        self.pool = pool or getPool()
+        with instrumentation.timing('acquire'):
+            self.connection = self.pool.getconn()
+        self.cursor = self.connection.cursor(cursor_factory=instrumentation.TimedCursor)
+        # Set by the calls of this module that write; raw writes on the cursor should set it too
+        self.wrote = False
+        self.lsn = 0
+        # The tournaments written to, with None for all of them, whose cached results are dropped on commit
+        self.changed = set()
+
+    def commit(self):
+        with instrumentation.timing('commit'):
+            self.connection.commit()
+        changed, self.changed = self.changed, set()
+        for tournament in ([None] if None in changed else changed):
+            _invalidate(tournament)
+        wrote, self.wrote = self.wrote, False
+        if wrote and _read_pool is not None and self.pool is not _read_pool:
+            # Reads from now on wait for the replica to replay this commit. Asked
+            # in autocommit, so the connection is not left inside a new transaction
+            self.connection.autocommit = True
+            try:
+                self.cursor.execute("SELECT pg_current_wal_lsn()::text")
+                lsn = self.cursor.fetchone()[0]
+            finally:
+                self.connection.autocommit = False
+            self.lsn = max(self.lsn, _lsn(lsn))
+            setLastWriteLsn(lsn)
+
+    def rollback(self):
+        self.connection.rollback()
+        self.wrote = False
+        self.changed.clear()
+
+    def close(self):
+        """Return the connection to the pool, discarding uncommitted work."""
+        if self.connection is not None:
+            self.cursor.close()
+            self.pool.putconn(self.connection)
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            self.close()
+
+
+@contextmanager
+def _borrow(session=None, read=False):
+    """
+    Yields the caller's session, or a new pooled one that is committed and
+    returned to the pool when the block ends. With read=True and a read pool
+    configured, the new session is on the replica. Without it, the session
+    is marked as having written, so its commit records where to read from.
+    """
+    if session is not None:
+        if not read:
+            session.wrote = True
+        yield session
+    elif read and _read_pool is not None:
+        with _readSession(_read_pool) as session:
+            yield session
     else:
-        delete_all_matches_query = "DELETE FROM matches"
-        cursor.execute(delete_all_matches_query)
-    db.commit()
-    db.close()
+        with Session() as session:
+            session.wrote = not read
+            yield session
+
+def readSession(after=None):
+    """
+    Returns a session to pass to the reads of this module in any thread, on
+    the read pool once it has replayed the writes of after, a Session or a
+    WAL position from getLastWriteLsn, as well as this thread's own. Without
+    a read pool, or if the replica takes longer than max_wait, it is on the
+    primary.
+    """
+    if isinstance(after, Session):
+        lsn = after.lsn
+    else:
+        lsn = _lsn(after) if after else 0
+    pool = _read_pool
+    if pool is None:
+        return Session()
+    return _readSession(pool, lsn)
+
+def _readSession(pool, lsn=0):
+    """
+    Returns a session on the read pool once its database has replayed the
+    position lsn, this thread's latest write and any change the standings
+    cache has been told of, or a session on the primary if it takes longer
+    than max_wait.
+    """
+    # The replica reports its replay position, and a stand-in that is not replicating its own
+    replayed_query = """
+    SELECT COALESCE(CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END
+                    >= %s::pg_lsn, false)
+    """
+    cache = _cache
+    target = max(lsn, getattr(_last_write, 'lsn', 0), cache.lsn if cache is not None else 0)
+    session = Session(pool)
+    if target:
+        deadline = time.time() + _read_max_wait
+        delay = 0.001
+        waited = False
+        try:
+            while True:
+                session.cursor.execute(replayed_query, (_lsnText(target),))
+                if session.cursor.fetchone()[0]:
+                    break
+                if time.time() >= deadline:
+                    session.close()
+                    with _pool_lock:
+                        _read_stats['fallbacks'] += 1
+                    return Session()
+                waited = True
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+        except Exception:
+            session.close()
+            raise
+        if waited:
+            with _pool_lock:
+                _read_stats['waits'] += 1
+    with _pool_lock:
+        _read_stats['replica'] += 1
+    return session
+
+
+# Hot queries are prepared once per connection and executed by name after
+# that; see _execute
+_prepare_statements = True
+# name -> (PREPARE text, EXECUTE text with the query's %s placeholders)
+_statements = {}
+# connection -> names of the statements prepared on it
+_prepared = weakref.WeakKeyDictionary()
+_statement_stats = {}
+_statements_lock = threading.Lock()
+
+def configureStatements(prepare=True):
+    """
+    Turn preparing the hot queries on or off, and start their counts again.
+    Turn it off behind a connection pooler that hands each transaction a
+    different server connection, where a prepared statement may be missing.
+    """
+    global _prepare_statements
+    with _statements_lock:
+        _prepare_statements = prepare
+        _statement_stats.clear()
+
+def getStatementStats(session=None):
+    """
+    Returns a dict from each prepared statement's name to how many times it
+    was prepared and executed, and so how many executions found it already
+    prepared on their connection. With a session, each statement prepared
+    on its connection also has the server's count of generic and custom
+    plans made for it; a generic plan is planned once and reused.
+    """
+    plans_query = "SELECT name, generic_plans, custom_plans FROM pg_prepared_statements"
+    with _statements_lock:
+        stats = dict((name, {'prepares': prepares, 'executes': executes, 'hits': executes - prepares})
+                     for (name, (prepares, executes)) in _statement_stats.items())
+    if session is not None:
+        session.cursor.execute(plans_query)
+        for (name, generic_plans, custom_plans) in session.cursor.fetchall():
+            if name in stats:
+                stats[name].update(generic_plans=generic_plans, custom_plans=custom_plans)
+    return stats
+
+def _execute(db, name, query, args=()):
+    """
+    Runs one of the hot queries on a session as the prepared statement name.
+    It is PREPAREd the first time it runs on each connection and EXECUTEd
+    by name from then on, so the server parses it once per connection and,
+    once it settles on a generic plan, stops planning it on every call.
+    """
+    if not _prepare_statements:
+        db.cursor.execute(query, args)
+        return
+    statement = _statements.get(name)
+    if statement is None:
+        # The query's %s placeholders become the statement's $1, $2, ...
+        parts = query.split('%s')
+        text = parts[0] + ''.join('$%d%s' % (number, part) for (number, part) in enumerate(parts[1:], 1))
+        statement = _statements[name] = (
+            'PREPARE {0} AS {1}'.format(name, text),
+            'EXECUTE {0}({1})'.format(name, ', '.join(['%s'] * len(args))) if args else 'EXECUTE ' + name)
+        instrumentation.namePreparedStatement(name, query)
+    connection = db.connection
+    with _statements_lock:
+        prepared = _prepared.get(connection)
+        if prepared is None:
+            prepared = _prepared[connection] = set()
+        counts = _statement_stats.setdefault(name, [0, 0])
+    if name not in prepared:
+        # A prepared statement outlives the transaction, even one rolled back
+        db.cursor.execute(statement[0])
+        prepared.add(name)
+        with _statements_lock:
+            counts[0] += 1
+    db.cursor.execute(statement[1], args)
+    with _statements_lock:
+        counts[1] += 1
+
+
+class StandingsCache(object):
+    """An in-process LRU cache of standings and pairings, per tournament.
+
+    Screens polling playerStandings and swissPairings during a round are
+    served from here instead of re-running the queries. Each tournament has
+    a version counter, bumped whenever its standings may have changed: by the
+    write functions in this module, and, with listen=True, by the
+    standings_changed notifications the database sends when any process
+    commits a change. A result is only stored if its tournament's version did
+    not move while it was being read, and only served at that version, so a
+    stale result is never handed out once the change is known here.
+
+    Notifications arrive when the writing transaction commits, so another
+    process's change shows up on the first call after its commit reaches
+    this process. While the listening connection is down, nothing is served
+    from or stored in the cache, and each call tries to connect it again.
+    At most max_size tournaments are kept, dropping the least recently used.
+    """
+
+    def __init__(self, max_size=128, dbname=DBNAME, listen=True):
+        if max_size < 1:
+            raise ValueError("Invalid cache size")
+        self.max_size = max_size
+        self.dbname = dbname
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        # tournament -> (version, {key: result}), the most recently used last
+        self._entries = OrderedDict()
+        self._versions = {}
+        # Bumped to invalidate every tournament at once
+        self._generation = 0
+        self._lock = threading.Lock()
+        # Where the primary's WAL stood when the latest notification was read,
+        # for reads from a replica to wait for
+        self.lsn = 0
+        self._listening = listen
+        self._listener = None
+        if listen:
+            self._listen()
+
+    def _listen(self):
+        self._listener = psycopg2.connect('dbname=' + self.dbname)
+        self._listener.autocommit = True
+        self._listener.cursor().execute("LISTEN standings_changed")
+
+    def _drain(self):
+        # Apply the notifications received so far; poll() does not block.
+        # Returns False while the listener is down and cannot be reconnected.
+        if not self._listening:
+            return True
+        try:
+            if self._listener is None:
+                self._listen()
+            self._listener.poll()
+            if self._listener.notifies and _read_pool is not None:
+                cursor = self._listener.cursor()
+                cursor.execute("SELECT pg_current_wal_lsn()::text")
+                self.lsn = _lsn(cursor.fetchone()[0])
+        except psycopg2.Error:
+            # Changes may have been missed while the connection was down.
+            if self._listener is not None:
+                self._listener.close()
+                self._listener = None
+            self._invalidate()
+            return False
+        while self._listener.notifies:
+            notify = self._listener.notifies.pop(0)
+            # An empty payload, from a TRUNCATE, stands for every tournament
+            self._invalidate(int(notify.payload) if notify.payload else None)
+        return True
+
+    def _version(self, tournament):
+        return (self._generation, self._versions.get(tournament, 0))
+
+    def _invalidate(self, tournament=None):
+        self.invalidations += 1
+        if tournament is None:
+            self._generation += 1
+            self._versions.clear()
+            self._entries.clear()
+        else:
+            self._versions[tournament] = self._versions.get(tournament, 0) + 1
+            self._entries.pop(tournament, None)
+
+    def lookup(self, tournament, key):
+        """
+        Look up a cached result for a tournament.
+        :param tournament:the id number of the tournament
+        :param key:what was computed, e.g. ('standings', ())
+        :return:(version, found, result); pass version to store()
+        """
+        with self._lock:
+            listening = self._drain()
+            version = self._version(tournament)
+            entry = self._entries.get(tournament)
+            if listening and entry is not None and entry[0] == version and key in entry[1]:
+                self.hits += 1
+                # Move the tournament to the most recently used end
+                self._entries[tournament] = self._entries.pop(tournament)
+                return version, True, entry[1][key]
+            self.misses += 1
+            return version, False, None
+
+    def store(self, tournament, key, version, result):
+        """Cache a result read at version, unless the tournament has changed since."""
+        with self._lock:
+            if not self._drain() or version != self._version(tournament):
+                return
+            entry = self._entries.pop(tournament, None)
+            if entry is None or entry[0] != version:
+                entry = (version, {})
+            entry[1][key] = result
+            self._entries[tournament] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, tournament=None):
+        """Drop a tournament's cached results, or every tournament's if None."""
+        with self._lock:
+            self._invalidate(_optionalId(tournament))
+
+    def stats(self):
+        """Returns the hit, miss, invalidation and eviction counts and the size."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations,
+                    'evictions': self.evictions, 'size': len(self._entries)}
+
+    def close(self):
+        self._listening = False
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
 
 
-def deletePlayers():
-    """Remove all the player records from the database."""
-    db, cursor = connect()
-    delete_all_players_query = "DELETE FROM players"
-    cursor.execute(delete_all_players_query)
-    db.commit()
-    db.close()
+_cache = None
 
-def createTournament(name):
+def configureCache(max_size=128, dbname=DBNAME, listen=True):
+    """
+    Cache playerStandings and swissPairings results for up to max_size
+    tournaments, or stop caching if max_size is 0. Calls made with a session
+    always bypass the cache, since the session may hold uncommitted changes.
+    Returns the new cache.
+    """
+    global _cache
+    cache = StandingsCache(max_size, dbname, listen) if max_size else None
+    old_cache, _cache = _cache, cache
+    if old_cache is not None:
+        old_cache.close()
+    return cache
+
+def getCacheStats():
+    """Returns the standings cache's hit and miss counts, or None without a cache."""
+    cache = _cache
+    return cache.stats() if cache is not None else None
+
+def _cached(tournament, key, session, load):
+    """Returns load(), through the standings cache when there is one and no session."""
+    cache = _cache
+    if cache is None or session is not None:
+        return load()
+    tournament = int(tournament)
+    version, found, result = cache.lookup(tournament, key)
+    if not found:
+        result = load()
+        cache.store(tournament, key, version, result)
+    # Callers are free to change the list they get
+    return list(result)
+
+def _withPoints(rows):
+    """Turns the half-points stored in the fifth column of rows into points."""
+    return [row[:4] + (row[4] / 2.0,) + row[5:] for row in rows]
+
+def _invalidate(tournament=None, session=None):
+    """
+    Drop cached results after a write, for one tournament or all of them.
+    A write made in a caller's session is only dropped once the session
+    commits: dropped any earlier, a read of the old standings could cache
+    them again before the commit, for good when nothing else notifies.
+    """
+    if session is not None:
+        session.changed.add(tournament)
+        return
+    cache = _cache
+    if cache is not None:
+        cache.invalidate(tournament)
+
+
+@instrumentation.timed
+def deleteTournaments(session=None):
+    """
+    Delete all tournaments from database, with everything played in them and
+    the players' careers, and start the tournament, match and round numbering
+    again. The matches
+    partitions are dropped and the other tables truncated rather than deleted
+    from row by row, so this takes as long for millions of matches as for
+    none, but it locks every tournament table until the transaction ends.
+    """
+    with _borrow(session) as db:
+        db.cursor.execute(queries.DROP_MATCH_PARTITIONS)
+        db.cursor.execute(queries.TRUNCATE_TOURNAMENTS)
+    _invalidate(session=session)
+
+@instrumentation.timed
+def deleteMatches(tournament=None, session=None):
+    """
+    If a tournament id number is passed, delete that tournament's matches and
+    rounds, else, remove all the match and round records from the database.
+    """
+    tournament = _optionalId(tournament)
+    with _borrow(session) as db:
+        # Deleting the rounds also deletes the matches played in them
+        if tournament is not None:
+            db.cursor.execute(queries.DELETE_ROUNDS_IN_TOURNAMENT, (tournament,))
+            db.cursor.execute(queries.DELETE_MATCHES_IN_TOURNAMENT, (tournament,))
+        else:
+            db.cursor.execute(queries.DELETE_ALL_ROUNDS)
+            db.cursor.execute(queries.DELETE_ALL_MATCHES)
+    _invalidate(tournament, session)
+
+
+@instrumentation.timed
+def deletePlayers(session=None):
+    """
+    Remove all the player records from the database, with their matches and
+    memberships, and start the player and match numbering again. Tables are
+    truncated, as by deleteTournaments.
+    """
+    with _borrow(session) as db:
+        db.cursor.execute(queries.TRUNCATE_PLAYERS)
+    _invalidate(session=session)
+
+@instrumentation.timed
+def archiveTournament(tournament, session=None):
+    """Moves a finished tournament out of the live tables.
+
+    Its matches partition is detached from matches as a whole and kept as a
+    plain table, archived_matches_[tournament], for pg_dump or a later DROP
+    TABLE; the rest of the tournament, its rounds, standings and
+    memberships, is deleted. Detaching locks matches until the transaction
+    ends, so archive between rounds rather than during them.
+
+    Args:
+      tournament: the id number of the tournament
+      session: an optional Session to run the statements in
+
+    Returns:
+      The name of the archive table.
+
+    Raises:
+      ValueError: if the tournament does not exist.
+    """
+    tournament = _id(tournament)
+    with _borrow(session) as db:
+        db.cursor.execute(queries.LOCK_TOURNAMENT, (tournament,))
+        if db.cursor.fetchone() is None:
+            raise ValueError("Unknown Tournament")
+        db.cursor.execute(queries.ARCHIVE_TOURNAMENT, (tournament,))
+        archive = db.cursor.fetchone()[0]
+    _invalidate(tournament, session)
+    return archive
+
+@instrumentation.timed
+def createTournament(name, session=None):
     """Create a new tournament"""
-    db, cursor = connect()
-    name = bleach.clean(name)
-    create_tournament_query = "INSERT INTO tournaments(tournament_name) VALUES(%s) RETURNING tournament_id"
-    cursor.execute(create_tournament_query, (name,))
-    row_id = cursor.fetchone()[0]
-    db.commit()
-    db.close()
+    name = _name(name)
+    with _borrow(session) as db:
+        db.cursor.execute(queries.CREATE_TOURNAMENT, (name,))
+        row_id = db.cursor.fetchone()[0]
     return row_id
 
-def addPlayerToTournament(player_id, tournament):
+@instrumentation.timed
+def addPlayerToTournament(player_id, tournament, session=None):
     """Add a player to a specific tournament"""
-    db, cursor = connect()
-    player_id = bleach.clean(player_id)
-    tournament = bleach.clean(tournament)
-    add_player_to_tournament_query = "INSERT INTO players_in_tournaments(player_id, tournament_id) VALUES(%s, %s)"
-    cursor.execute(add_player_to_tournament_query,
-                   (player_id, tournament))
-    db.commit()
-    db.close()
+    player_id = _id(player_id)
+    tournament = _id(tournament)
+    with _borrow(session) as db:
+        db.cursor.execute(queries.ADD_PLAYER_TO_TOURNAMENT,
+                          (player_id, tournament))
+    _invalidate(tournament, session)
+
+@instrumentation.timed
+def addPlayersToTournament(player_ids, tournament, session=None):
+    """
+    Add many players to a specific tournament in a single statement.
+    :param player_ids:an iterable of player id numbers, each at most once
+    :param tournament:the id number of the tournament
+    :param session:an optional Session to run the insert in
+    """
+    player_ids = [_id(player_id) for player_id in player_ids]
+    tournament = _id(tournament)
+    if len(set(player_ids)) != len(player_ids):
+        raise ValueError("Duplicate Players In Batch")
+    if not player_ids:
+        return
+    with _borrow(session) as db:
+        db.cursor.execute(queries.ADD_PLAYERS_TO_TOURNAMENT, (tournament, player_ids))
+    _invalidate(tournament, session)
 
-def countPlayers(tournament=None):
+@instrumentation.timed
+def countPlayers(tournament=None, session=None):
     """
     if a tournament id is passed, count the number of players added to this tournament,
     else return the all number of players currently registered.
     """
-    db, cursor = connect()
-    tournament = bleach.clean(tournament)
-    if tournament:
-        # Create a view to get the number of players in each tournament
-        number_of_players_for_all_tournaments_query = """
-        CREATE VIEW players_per_tournament AS SELECT tournaments.tournament_id AS tournament_id,
-        COUNT(players_in_tournaments.player_id) AS players_number
-        FROM tournaments LEFT JOIN players_in_tournaments
-        ON tournaments.tournament_id = players_in_tournaments.tournament_id
-        GROUP BY tournaments.tournament_id
-        """
-        cursor.execute(number_of_players_for_all_tournaments_query)
-        # Get number of players from this specific tournament
-        number_of_players_for_specific_tournament_query = """
-        SELECT players_number FROM players_per_tournament WHERE tournament_id=(%s)
-        """
-        cursor.execute(number_of_players_for_specific_tournament_query, (tournament,))
-    else:
-        numer_of_all_players_query = "SELECT COUNT(*) FROM players"
-        cursor.execute(numer_of_all_players_query)
-    result = cursor.fetchone()
+    tournament = _optionalId(tournament)
+    with _borrow(session, read=True) as db:
+        if tournament is not None:
+            _execute(db, 'count_tournament_players', queries.COUNT_TOURNAMENT_PLAYERS, (tournament,))
+        else:
+            _execute(db, 'count_players', queries.COUNT_PLAYERS)
+        result = db.cursor.fetchone()
     number_of_players = result[0]
-    db.close()
     return number_of_players
 
 
-def registerPlayer(name):
+@instrumentation.timed
+def registerPlayer(name, session=None):
     """Adds a player to the tournament database.
   
     The database assigns a unique serial id number for the player.  (This
@@ -109,137 +800,737 @@ def registerPlayer(name):
   
     Args:
       name: the player's full name (need not be unique).
+      session: an optional Session to run the insert in.
     """
-    db, cursor = connect()
-    register_player_query = "INSERT INTO players(player_name) VALUES(%s) RETURNING player_id"
-    name = bleach.clean(name)
-    cursor.execute(register_player_query, (name,))
-    row_id = cursor.fetchone()[0]
-    db.commit()
-    db.close()
+    name = _name(name)
+    with _borrow(session) as db:
+        db.cursor.execute(queries.REGISTER_PLAYER, (name,))
+        row_id = db.cursor.fetchone()[0]
     return row_id
 
 
-def playerStandings(tournament):
-    """Returns a list of the players and their win records, sorted by wins.
+@instrumentation.timed
+def registerPlayers(names, session=None):
+    """Adds many players to the tournament database in a single statement.
+
+    Args:
+      names: an iterable of the players' full names.
+      session: an optional Session to run the insert in.
+
+    Returns:
+      The players' new id numbers, in the same order as names.
+    """
+    names = [_name(name) for name in names]
+    if not names:
+        return []
+    with _borrow(session) as db:
+        db.cursor.execute(queries.REGISTER_PLAYERS, (names,))
+        rows = db.cursor.fetchall()
+    return [row[0] for row in rows]
+
+
+@instrumentation.timed
+def playerStandings(tournament, tiebreaks=None, points=False, session=None):
+    """Returns a list of the players and their win records, sorted by points.
 
     The first entry in the list should be the player in first place, or a player
     tied for first place if there is currently a tie.
 
+    Args:
+      tournament: the id number of the tournament
+      tiebreaks: an optional list of tiebreaks, most important first, from
+        "buchholz", "sonneborn_berger" and "cumulative" (needs NumPy)
+      points: if true, each tuple also holds the player's points
+      session: an optional Session to run the queries in
+
     Returns:
       A list of tuples, each of which contains (id, name, wins, matches):
         id: the player's unique id (assigned by the database)
         name: the player's full name (as registered)
-        wins: the number of matches the player has won
-        matches: the number of matches the player has played
-    """
-    db, cursor = connect()
-    # number of wins
-    number_of_wins_query = """
-    CREATE VIEW winners AS
-    SELECT players.player_id, players.player_name, COUNT(matches.match_id) AS number_of_wins,
-    players_in_tournaments.tournament_id AS tournament_id
-    FROM players
-    LEFT JOIN players_in_tournaments ON players.player_id = players_in_tournaments.player_id
-    LEFT JOIN matches ON players.player_id = matches.winner_id
-    AND
-    players_in_tournaments.tournament_id = matches.tournament_id
-    GROUP BY players.player_id, players_in_tournaments.tournament_id
-    ORDER BY number_of_wins DESC
-    """
-    cursor.execute(number_of_wins_query)
-
-    # number of losses
-    number_of_losses_query = """
-    CREATE VIEW losers AS
-    SELECT players.player_id, players.player_name, COUNT(matches.match_id) AS number_of_losses,
-    players_in_tournaments.tournament_id AS tournament_id
-    FROM players
-    LEFT JOIN players_in_tournaments ON players.player_id = players_in_tournaments.player_id
-    LEFT JOIN matches ON players.player_id = matches.loser_id
-    AND
-    players_in_tournaments.tournament_id = matches.tournament_id
-    GROUP BY players.player_id, players_in_tournaments.tournament_id
-    ORDER BY number_of_losses DESC
-    """
-    cursor.execute(number_of_losses_query)
-
-    # player standings
-    player_standings_query = """
-    SELECT winners.player_id AS id, winners.player_name AS name, winners.number_of_wins AS wins,
-    number_of_wins+number_of_losses AS matches
-    FROM winners LEFT JOIN losers ON winners.player_id = losers.player_id AND winners.tournament_id=losers.tournament_id
-    WHERE winners.tournament_id=(%s)
-    """
-    tournament = bleach.clean(tournament)
-    cursor.execute(player_standings_query, (tournament,))
-    player_standings = cursor.fetchall()
-    db.close()
-    return player_standings
-
-
-def reportMatch(winner, loser, tournament):
+        wins: the number of matches the player has won, counting a bye
+        matches: the number of matches the player has played, counting a bye
+      then, with points=True, the player's points, 1 for a win or a bye and
+      0.5 for a draw, followed by one score per tiebreak. Players are sorted
+      by points; players tied on points are sorted by the tiebreaks, and
+      then by id.
+    """
+    tournament = _id(tournament)
+
+    def load():
+        with _borrow(session, read=True) as db:
+            _execute(db, 'player_standings', queries.PLAYER_STANDINGS, (tournament,))
+            player_standings = _withPoints(db.cursor.fetchall())
+            if tiebreaks:
+                _execute(db, 'ordered_matches', queries.ORDERED_MATCHES, (tournament,))
+                matches = db.cursor.fetchall()
+        if tiebreaks:
+            # NumPy is only needed for tiebreaks
+            import tiebreaks as tiebreak_scores
+            player_standings = tiebreak_scores.computeTiebreaks(
+                player_standings, matches, tiebreaks, scores=[row[4] for row in player_standings])
+        if not points:
+            player_standings = [row[:4] + row[5:] for row in player_standings]
+        return player_standings
+
+    return _cached(tournament, ('standings', tuple(tiebreaks or ()), bool(points)), session, load)
+
+
+@instrumentation.timed
+def reportMatch(winner, loser, tournament, draw=False, session=None):
     """Records the  outcome of a single match between two players.
 
+    The match is counted in the tournament's current round, if one has been
+    started.
+
     Args:
       winner:  the id number of the player who won
       loser:  the id number of the player who lost
       tournament: the id number of the match's tournament
+      draw: if true, the match was drawn, and winner and loser are just the
+        two players
+      session: an optional Session to run the insert in
     """
-    db, cursor = connect()
-    report_match_query = "INSERT INTO matches(winner_id, loser_id, tournament_id) VALUES(%s,%s, %s)"
-    winner = bleach.clean(winner)
-    loser = bleach.clean(loser)
-    tournament = bleach.clean(tournament)
-    cursor.execute(report_match_query, (winner, loser, tournament))
-    db.commit()
-    db.close()
+    winner = _id(winner)
+    loser = _id(loser)
+    tournament = _id(tournament)
+    with _borrow(session) as db:
+        _execute(db, 'report_match', queries.REPORT_MATCH,
+                 (winner, loser, tournament, tournament, "draw" if draw else "win"))
+    _invalidate(tournament, session)
 
-def getPlayedMatches(tournament):
+@instrumentation.timed
+def reportBye(player, tournament, session=None):
+    """Records a bye, which scores as a win, for a player left unpaired.
+
+    Args:
+      player: the id number of the player given the bye
+      tournament: the id number of the tournament
+      session: an optional Session to run the insert in
+
+    Raises:
+      psycopg2.IntegrityError: if the player has already had a bye.
+    """
+    player = _id(player)
+    tournament = _id(tournament)
+    with _borrow(session) as db:
+        db.cursor.execute(queries.REPORT_BYE, (player, tournament, tournament))
+    _invalidate(tournament, session)
+
+@instrumentation.timed
+def reportMatches(results, tournament, session=None):
+    """Records the outcomes of a whole round of matches in a single statement.
+
+    The batch is checked before anything is written: both players of every
+    match must be in the tournament, nobody can play themselves, and no
+    player may appear in two matches. The matches are counted in the tournament's
+    current round, if one has been started.
+
+    Args:
+      results: an iterable of (winner, loser) id number pairs. A third item,
+        if true, marks a draw, and (player, None) is a bye.
+      tournament: the id number of the matches' tournament
+      session: an optional Session to run the insert in
+
+    Returns:
+      The new match id numbers, in the same order as results.
+    """
+    matches = []
+    for result in results:
+        winner, loser = _id(result[0]), _optionalId(result[1])
+        if loser is None:
+            matches.append((winner, None, "bye"))
+        else:
+            matches.append((winner, loser, "draw" if len(result) > 2 and result[2] else "win"))
+    tournament = _id(tournament)
+    pairs = set()
+    players = set()
+    for (winner, loser, _) in matches:
+        pair = frozenset((winner, loser))
+        if winner == loser:
+            raise ValueError("Player Cannot Play Themselves")
+        if pair in pairs:
+            raise ValueError("Duplicate Pair In Batch")
+        repeated = pair & players
+        if repeated:
+            raise ValueError("Player Twice In Batch: {0}".format(min(repeated)))
+        pairs.add(pair)
+        players.update(pair - set([None]))
+    if not matches:
+        return []
+    player_ids = list(players)
+    with _borrow(session) as db:
+        db.cursor.execute(queries.TOURNAMENT_MEMBERS, (tournament, player_ids))
+        missing = set(player_ids) - set(row[0] for row in db.cursor.fetchall())
+        if missing:
+            raise ValueError("Players Not In Tournament: {0}".format(sorted(missing)))
+        db.cursor.execute(queries.REPORT_MATCHES,
+                          (tournament, tournament, [match[0] for match in matches], [match[1] for match in matches],
+                           [match[2] for match in matches]))
+        rows = db.cursor.fetchall()
+    _invalidate(tournament, session)
+    return [row[0] for row in rows]
+
+
+@instrumentation.timed
+def getPlayedMatches(tournament, session=None):
     """
     Returns the list of matches played in a specific tournament.
     :param tournament:the id number of the tournament
+    :param session:an optional Session to run the query in
     :return:list of played matches
     """
-    db, cursor = connect()
-    playerd_matches_query = "SELECT winner_id, loser_id FROM matches WHERE tournament_id=(%s)"
-    tournament = bleach.clean(tournament)
-    cursor.execute(playerd_matches_query, (tournament,))
-    matches = cursor.fetchall()
-    db.close()
+    tournament = _id(tournament)
+    with _borrow(session, read=True) as db:
+        # Sent as text: it returns the whole tournament, so planning is a sliver of its time, and it measured
+        # slower prepared
+        db.cursor.execute(queries.PLAYED_MATCHES, (tournament,))
+        matches = db.cursor.fetchall()
     return  matches
 
-def swissPairings(tournament):
+@instrumentation.timed
+def getCurrentRound(tournament, session=None):
+    """
+    Returns the number of the latest round started in a tournament, or 0 if
+    none has been.
+    :param tournament:the id number of the tournament
+    :param session:an optional Session to run the query in
+    """
+    tournament = _id(tournament)
+    with _borrow(session, read=True) as db:
+        _execute(db, 'current_round', queries.CURRENT_ROUND, (tournament,))
+        current_round = db.cursor.fetchone()[0]
+    return current_round
+
+@instrumentation.timed
+def roundPairings(tournament, round_no=None, session=None):
+    """
+    Returns the pairings made when a round was started, with their results.
+    :param tournament:the id number of the tournament
+    :param round_no:the number of the round, or None for the current round
+    :param session:an optional Session to run the query in
+    :return:a list of (id1, name1, id2, name2, winner_id, result) tuples in
+    board order, where id2 and name2 are None for a bye, result is "win",
+    "draw", "bye" or None while the match is still to be reported, and
+    winner_id is None unless the match was won or a bye
+    """
+    tournament = _id(tournament)
+    round_no = _optionalId(round_no)
+    with _borrow(session, read=True) as db:
+        db.cursor.execute(queries.ROUND_PAIRINGS, (tournament, tournament, round_no, tournament))
+        pairings = db.cursor.fetchall()
+    return pairings
+
+@instrumentation.timed
+def standingsAsOf(tournament, round_no, session=None):
+    """Returns the standings of a tournament as they were at the end of a round.
+
+    The standings of every finished round are copied when the next round is
+    started, so earlier rounds are read from that snapshot without going
+    through the matches, and the current round from the live standings.
+
+    Args:
+      tournament: the id number of the tournament
+      round_no: the number of a round that has been started
+      session: an optional Session to run the queries in
+
+    Returns:
+      A list of (id, name, wins, matches) tuples, sorted as playerStandings
+      sorts them.
+
+    Raises:
+      ValueError: if the round has not been started.
+    """
+    tournament = _id(tournament)
+    round_no = _id(round_no)
+    with _borrow(session, read=True) as db:
+        current_round = getCurrentRound(tournament, session=db)
+        if not 1 <= round_no <= current_round:
+            raise ValueError("Unknown Round")
+        if round_no == current_round:
+            return playerStandings(tournament, session=db)
+        db.cursor.execute(queries.STANDINGS_SNAPSHOT, (tournament, round_no))
+        standings = db.cursor.fetchall()
+    return standings
+
+@instrumentation.timed
+def playerCareer(player_id, session=None):
+    """Returns a player's record over every tournament they have entered.
+
+    The careers table is kept up to date by triggers as players enter
+    tournaments and matches are reported or deleted, so this reads one row
+    by its key however long the player's history is.
+
+    Args:
+      player_id: the id number of the player
+      session: an optional Session to run the query in
+
+    Returns:
+      An (id, name, events, wins, draws, losses, matches, points,
+      points_per_event) tuple, where events counts the tournaments entered,
+      wins and matches count byes as in playerStandings, points are 1 for a
+      win or a bye and 0.5 for a draw, and points_per_event is 0.0 before
+      the first event.
+
+    Raises:
+      ValueError: if the player does not exist.
+    """
+    player_id = _id(player_id)
+    with _borrow(session, read=True) as db:
+        _execute(db, 'player_career', queries.PLAYER_CAREER, (player_id,))
+        row = db.cursor.fetchone()
+    if row is None:
+        raise ValueError("Unknown Player")
+    player_id, name, events, wins, draws, matches, points = row
+    return (player_id, name, events, wins, draws, matches - wins - draws, matches, points / 2.0,
+            points / 2.0 / events if events else 0.0)
+
+@instrumentation.timed
+def headToHead(player1, player2, session=None):
+    """
+    Returns the record between two players over every tournament, read by
+    its key from the head_to_head table.
+    :param player1:the id number of one player
+    :param player2:the id number of the other
+    :param session:an optional Session to run the query in
+    :return:a (player1 wins, draws, player2 wins) tuple, all 0 if they have
+    never met
+    """
+    player1 = _id(player1)
+    player2 = _id(player2)
+    if player1 == player2:
+        raise ValueError("Same Player Twice")
+    # Each pair is kept once, under the lower id
+    with _borrow(session, read=True) as db:
+        _execute(db, 'head_to_head', queries.HEAD_TO_HEAD, (min(player1, player2), max(player1, player2)))
+        row = db.cursor.fetchone() or (0, 0, 0)
+    return row if player1 < player2 else row[::-1]
+
+@instrumentation.timed
+def getPairingState(tournament, session=None):
+    """
+    Returns what pairing the next round of a tournament needs, kept up to date
+    in the standings table as results are reported, so the matches table is
+    not read.
+    :param tournament:the id number of the tournament
+    :param session:an optional Session to run the query in
+    :return:a list of (id, name, wins, matches, points, byes, opponents,
+    last_float, rating) tuples in standings order, where the first five are as
+    in playerStandings(points=True), byes counts the byes had, opponents lists
+    the ids of the players met so far, last_float is 1 if the player's latest
+    match was against a player with more points, -1 if fewer, else 0, and
+    rating is the player's rating
+    """
+    tournament = _id(tournament)
+    with _borrow(session, read=True) as db:
+        _execute(db, 'pairing_state', queries.PAIRING_STATE, (tournament,))
+        records = _withPoints(db.cursor.fetchall())
+    return records
+
+@instrumentation.timed
+def swissPairings(tournament, mode="greedy", stats=None, server_side=False, session=None):
     """Returns a list of pairs of players for the next round of a match for a specific tournament.
   
-    Assuming that there are an even number of players registered, each player
-    appears exactly once in the pairings.  Each player is paired with another
-    player with an equal or nearly-equal win record, that is, a player adjacent
-    to him or her in the standings.
+    Each player appears exactly once in the pairings.  Each player is paired
+    with another player with an equal or nearly-equal score, that they have
+    not played yet. Within a score group players are sorted by rating, and
+    the top half plays the bottom half, the best rated against the best of
+    the bottom half. With an odd number of players, the lowest player in the
+    pairing order who has not had a bye yet is given one.
+
+    Args:
+      tournament: the id number of the tournament
+      mode: "greedy" pairs down the standings, backtracking to avoid
+        rematches; "optimal" solves a maximum-weight matching that
+        minimises rematches first and then the score differences of pairs
+      stats: an optional dict, filled by the "optimal" mode with the number
+        of candidate pairs considered and the solve time in seconds
+      server_side: if true, the database orders the players and lists each
+        one's candidate opponents with the pairing_candidates() function,
+        so only the players CANDIDATE_WINDOW seats below each are sent
+        instead of everyone's opponents; the window is doubled, with
+        another query, whenever pairing needs a pair outside it, so the
+        pairings are the same either way
+      session: an optional Session to run the queries in
   
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
         id1: the first player's unique id
         name1: the first player's name
-        id2: the second player's unique id
-        name2: the second player's name
+        id2: the second player's unique id, or None for the bye
+        name2: the second player's name, or None for the bye
+      The bye, if there is one, comes last.
+
+    Raises:
+      ValueError: if there are fewer than two players, or the players cannot
+        all be paired.
+    """
+    if mode not in ("greedy", "optimal"):
+        raise ValueError("Unknown Pairing Mode")
+    tournament = _id(tournament)
+
+    def load():
+        records = getPairingState(tournament, session=session)
+        if len(records) < 2:
+            raise ValueError("Not Enough Players")
+        played = pairing.PlayedPairs()
+        for record in records:
+            for opponent in record[6]:
+                played.add(record[0], opponent)
+        order = pairing.ratingOrder([record[4] for record in records], [record[7] for record in records],
+                                    [record[8] for record in records])
+        return pairing.pairRound([records[i][:2] for i in order], [records[i][4] for i in order], played,
+                                 [records[i][5] for i in order], mode=mode, stats=stats)
+
+    def loadCandidates():
+        window = CANDIDATE_WINDOW
+        while True:
+            with _borrow(session, read=True) as db:
+                db.cursor.execute(queries.PAIRING_CANDIDATES, (tournament, window))
+                records = db.cursor.fetchall()
+            if len(records) < 2:
+                raise ValueError("Not Enough Players")
+            allowed = pairing.CandidatePairs(((record[0], record[1], record[5]) for record in records), window)
+            try:
+                pairings = pairing.pairRound([record[1:3] for record in records], [record[3] for record in records],
+                                             allowed, [record[4] for record in records], mode=mode, stats=stats)
+            except ValueError:
+                if not allowed.outside:
+                    raise
+            else:
+                # Pairing never asked about a pair it had no answer for, so it went as with every pair known
+                if not allowed.outside:
+                    return pairings
+            window *= 2
+
+    # Only the optimal mode fills stats, and it has to solve to do so
+    if server_side:
+        if stats is not None:
+            return loadCandidates()
+        return _cached(tournament, ('pairings', mode, 'server'), session, loadCandidates)
+    if stats is not None:
+        return load()
+    return _cached(tournament, ('pairings', mode), session, load)
+
+
+def _pairSection(task):
     """
-    # Get list of matches played
-    tournament = bleach.clean(tournament)
-    matches = getPlayedMatches(tournament)
-    standings = [(record[0], record[1]) for record in playerStandings(tournament)]
+    Pairs one section for pairAll, in a worker process. A task holds only ids
+    and numbers, in pairing order, as (tournament, mode, ids, scores, byes,
+    opponent_counts, opponents), with the opponents of every player run
+    together in one array. Returns (tournament, pairings, seconds), with None
+    for the names in the pairings.
+    """
+    tournament, mode, ids, scores, byes, counts, opponents = task
+    start = time.time()
+    played = pairing.PlayedPairs()
+    position = 0
+    for player, count in zip(ids, counts):
+        for opponent in opponents[position:position + count]:
+            played.add(player, opponent)
+        position += count
+    try:
+        pairings = pairing.pairRound([(player, None) for player in ids], list(scores), played, list(byes), mode=mode)
+    except ValueError as e:
+        raise ValueError("Cannot Pair Tournament {0}: {1}".format(tournament, e))
+    return tournament, pairings, time.time() - start
+
+def _pairingTasks(records, mode):
+    """Groups pairing state rows, tournament first, into the tasks of _pairSection."""
+    tasks = {}
+    for tournament, rows in groupby(records, key=lambda record: record[0]):
+        rows = list(rows)
+        if len(rows) < 2:
+            raise ValueError("Not Enough Players In Tournament {0}".format(tournament))
+        order = pairing.ratingOrder([row[2] for row in rows], [row[5] for row in rows], [row[7] for row in rows])
+        tasks[tournament] = (tournament, mode, array('i', (rows[i][1] for i in order)),
+                             array('i', (rows[i][2] for i in order)), array('i', (rows[i][3] for i in order)),
+                             array('i', (len(rows[i][4]) for i in order)),
+                             array('i', chain.from_iterable(rows[i][4] for i in order)))
+    return tasks
+
+@instrumentation.timed
+def pairAll(tournaments, mode="greedy", workers=None, timings=None, session=None):
+    """Starts the next round of many tournaments at once, such as the sections of one event.
+
+    The pairing state of every section is read in one query and each section
+    is paired in a pool of worker processes, which are handed only ids and
+    numbers. The finished rounds are snapshotted and the new rounds and
+    their pairings written in one transaction, as startRound does for one
+    tournament, so either every section starts its round or none does.
+
+    Args:
+      tournaments: the id numbers of the tournaments
+      mode: the pairing mode, as for swissPairings
+      workers: how many processes to pair in; None for one per CPU, and 1 to
+        pair in this process
+      timings: an optional dict, filled with the seconds each tournament
+        took to pair, by tournament id
+      session: an optional Session to run the queries in
+
+    Returns:
+      A dict from tournament id to a (round_no, pairings) tuple, pairings as
+      swissPairings returns them.
 
-    if len(standings) < 2:
+    Raises:
+      ValueError: if a tournament does not exist, has a match of its current
+        round still to be reported, or cannot be paired.
+    """
+    if mode not in ("greedy", "optimal"):
+        raise ValueError("Unknown Pairing Mode")
+    tournaments = sorted(set(_id(tournament) for tournament in tournaments))
+    if not tournaments:
+        return {}
+    with _borrow(session) as db:
+        db.cursor.execute(queries.LOCK_TOURNAMENTS, (tournaments,))
+        found = set(row[0] for row in db.cursor.fetchall())
+        if len(found) < len(tournaments):
+            raise ValueError("Unknown Tournaments: {0}".format([t for t in tournaments if t not in found]))
+        db.cursor.execute(queries.CURRENT_ROUNDS, (tournaments,))
+        current_rounds = dict(db.cursor.fetchall())
+        db.cursor.execute(queries.UNFINISHED_ROUNDS, (tournaments,))
+        unfinished = [row[0] for row in db.cursor.fetchall()]
+        if unfinished:
+            raise ValueError("Round Not Finished: {0}".format(unfinished))
+        db.cursor.execute(queries.SNAPSHOT_STANDINGS, (tournaments,))
+        db.cursor.execute(queries.SECTIONS_PAIRING_STATE, (tournaments,))
+        records = db.cursor.fetchall()
+        names = dict((record[1], record[6]) for record in records)
+        tasks = _pairingTasks(records, mode)
+        missing = [tournament for tournament in tournaments if tournament not in tasks]
+        if missing:
+            raise ValueError("Not Enough Players In Tournament {0}".format(missing[0]))
+
+        # The largest sections are handed out first, so that no worker is left with one at the end
+        tasks = sorted(tasks.values(), key=lambda task: -len(task[2]))
+        if workers == 1 or len(tasks) == 1:
+            results = [_pairSection(task) for task in tasks]
+        else:
+            pool = multiprocessing.Pool(min(workers or multiprocessing.cpu_count(), len(tasks)))
+            try:
+                results = list(pool.imap_unordered(_pairSection, tasks))
+            finally:
+                pool.close()
+                pool.join()
+
+        rounds = {}
+        for tournament, pairings, seconds in results:
+            if timings is not None:
+                timings[tournament] = seconds
+            pairings = [(id1, names[id1], id2, names.get(id2)) for (id1, name1, id2, name2) in pairings]
+            rounds[tournament] = (current_rounds.get(tournament, 0) + 1, pairings)
+        db.cursor.execute(queries.START_ROUNDS, (list(rounds), [round_no for round_no, _ in rounds.values()]))
+        boards = [(tournament, round_no, board, id1, id2)
+                  for tournament, (round_no, pairings) in rounds.items()
+                  for board, (id1, name1, id2, name2) in enumerate(pairings, 1)]
+        db.cursor.execute(queries.START_ROUND_PAIRINGS, [list(column) for column in zip(*boards)])
+        byes = [(pairings[-1][0], tournament, round_no)
+                for tournament, (round_no, pairings) in rounds.items() if pairings[-1][2] is None]
+        if byes:
+            db.cursor.execute(queries.REPORT_BYES, [list(column) for column in zip(*byes)])
+    for tournament in tournaments:
+        _invalidate(tournament, session)
+    return rounds
+
+@instrumentation.timed
+def startRound(tournament, mode="greedy", session=None):
+    """Finishes the current round of a tournament and starts the next one.
+
+    The standings at the end of the current round are kept as its snapshot,
+    for standingsAsOf, and the new round is paired by swissPairings. Its
+    pairings are stored so that roundPairings can tell which of its matches
+    are still to be reported, and matches reported from now on are counted
+    in it. A bye is reported straight away. This is pairAll for a single
+    tournament, paired in this process.
+
+    Args:
+      tournament: the id number of the tournament
+      mode: the pairing mode, as for swissPairings
+      session: an optional Session to run the queries in
+
+    Returns:
+      A (round_no, pairings) tuple, pairings as swissPairings returns them.
+
+    Raises:
+      ValueError: if the tournament does not exist, a match of the current
+        round has not been reported, or swissPairings cannot pair the round.
+    """
+    tournament = _id(tournament)
+    return pairAll([tournament], mode=mode, workers=1, session=session)[tournament]
+
+@instrumentation.timed
+def simulateOutcomes(tournament, rounds_remaining, trials=10000, top=(1,), draw_rate=None, workers=1,
+                     batch_size=1000, seed=None, session=None):
+    """Estimates each player's chances of finishing in the top places, by Monte Carlo simulation.
+
+    The remaining rounds are played out from the current pairing state, so
+    the players already met are not paired again, in trials batch_size at
+    a time: each batch is one set of NumPy arrays with a row per trial, and
+    batches can be spread over a pool of worker processes. Each round is
+    paired as swissPairings pairs it, by points and rating, and results
+    follow the Elo expectation of the players' ratings. The pairing is an
+    approximation: it leaves out the float order, and a rematch is avoided
+    by swapping with the next board only.
+
+    Args:
+      tournament: the id number of the tournament
+      rounds_remaining: how many rounds are still to be played
+      trials: how many times to play them
+      top: the places to give chances for, e.g. (1, 3, 8) for winning,
+        finishing in the top three and qualifying in the top eight
+      draw_rate: the share of games drawn; None for the share drawn so far
+      workers: how many processes to simulate in; None for one per CPU
+      batch_size: how many trials to simulate at once in each process
+      seed: an optional seed, for the same results every time
+      session: an optional Session to run the query in
+
+    Returns:
+      A list of (id, name, points, expected_points, chances) tuples in
+      standings order, where points are the points so far, expected_points
+      the mean points at the end, and chances a list with the probability of
+      finishing within each place of top.
+
+    Raises:
+      ValueError: if there are fewer than two players, or an argument is
+        out of range.
+    """
+    rounds_remaining = _id(rounds_remaining)
+    trials = _id(trials)
+    top = [_id(n) for n in top]
+    if trials < 1 or batch_size < 1 or not top or min(top) < 1:
+        raise ValueError("Invalid Simulation")
+    records = getPairingState(tournament, session=session)
+    if len(records) < 2:
         raise ValueError("Not Enough Players")
-    left = standings[0::2]
-    right = standings[1::2]
-    pairings = zip(left, right)
-    #results = []
-    #for pairing in pairings:
-        #if set(pairing) not in matches:
-            #pairing = chain(*pairing)
-            #results.append(pairing)
-    results = [chain(*pairing) for pairing in pairings if set(pairing) not in matches]
-    return results
+    if draw_rate is None:
+        # A draw is the only result worth an odd number of half-points
+        draws = sum(int(record[4] * 2) - 2 * record[2] for record in records)
+        games = sum(record[3] - record[5] for record in records)
+        draw_rate = float(draws) / games if games else 0.0
+    # NumPy is only needed for simulations
+    import numpy as np
+    import simulation
+    indexes = dict((record[0], i) for i, record in enumerate(records))
+    played = np.unique(np.array([min(i, indexes[opponent]) * len(records) + max(i, indexes[opponent])
+                                 for i, record in enumerate(records) for opponent in record[6]
+                                 if opponent in indexes], dtype=np.int64))
+    points = [int(record[4] * 2) for record in records]
+    byes = [record[5] for record in records]
+    ratings = [record[8] for record in records]
+    batches = [min(batch_size, trials - start) for start in range(0, trials, batch_size)]
+    tasks = [(points, byes, ratings, played, rounds_remaining, size, draw_rate, top,
+              None if seed is None else seed + i)
+             for i, size in enumerate(batches)]
+    if workers == 1 or len(tasks) == 1:
+        results = [simulation.simulateTrials(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(min(workers or multiprocessing.cpu_count(), len(tasks)))
+        try:
+            results = pool.map(simulation.simulateTrials, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    counts = sum(result[0] for result in results)
+    totals = sum(result[1] for result in results)
+    return [(record[0], record[1], record[4], float(totals[i]) / 2 / trials,
+             [float(counts[j][i]) / trials for j in range(len(top))])
+            for i, record in enumerate(records)]
+
+
+@instrumentation.timed
+def rateRound(tournament, round_no=None, session=None):
+    """Applies the results of a finished round to the players' ratings.
 
+    The round is one Elo rating period: every game is scored against the
+    ratings as they stood before the round, and the changes are worked out
+    together with NumPy and written back in a single UPDATE. Rating a
+    tournament's first round also rates, as a period of their own before
+    it, the matches reported before any round was started. Rating the rounds
+    of all tournaments in the order they were started gives the ratings
+    recomputeRatings does.
 
+    Args:
+      tournament: the id number of the tournament
+      round_no: the number of the round, or None for the current round
+      session: an optional Session to run the queries in
+
+    Returns:
+      A dict from the id of every player who played in the round to their
+      new rating.
+
+    Raises:
+      ValueError: if the round has not been started, has already been rated,
+        or has a match still to be reported.
+    """
+    tournament = _id(tournament)
+    round_no = _optionalId(round_no)
+    with _borrow(session) as db:
+        db.cursor.execute(queries.LOCK_ROUND, (tournament, round_no, tournament))
+        row = db.cursor.fetchone()
+        if row is None:
+            raise ValueError("Unknown Round")
+        round_no, rated = row
+        if rated:
+            raise ValueError("Round Already Rated")
+        if any(pair[5] is None for pair in roundPairings(tournament, round_no, session=db)):
+            raise ValueError("Round Not Finished")
+        db.cursor.execute(queries.ROUND_RESULTS, (tournament, round_no, round_no))
+        results = db.cursor.fetchall()
+        # NumPy is only needed for ratings
+        import ratings
+        new_ratings = ratings.rateResults(results, RATING_K_FACTOR)
+        if new_ratings:
+            db.cursor.execute(queries.UPDATE_RATINGS, (list(new_ratings), list(new_ratings.values())))
+        db.cursor.execute(queries.MARK_RATED, (tournament, round_no))
+    # Ratings order the pairings of every tournament the players are in
+    _invalidate(session=session)
+    return new_ratings
+
+@instrumentation.timed
+def recomputeRatings(session=None):
+    """Rates every player again from scratch, over every match ever reported.
+
+    The matches are read with one binary COPY, parsed into NumPy arrays a
+    chunk at a time as it arrives, and replayed period by period: each
+    round is a period, in the order the rounds were started, and the
+    matches a tournament had before its first round form a period just
+    before it. Every player's rating is then written back in a single
+    UPDATE, and every round is marked as rated. Byes are not rated. Replaying ten million matches in memory takes
+    seconds at most; reading the matches and writing the ratings back takes
+    most of the time.
+
+    Args:
+      session: an optional Session to run the queries in
+
+    Returns:
+      The number of matches replayed.
+    """
+    rounds_query = "SELECT tournament_id, round_no FROM rounds ORDER BY started_at, tournament_id, round_no"
+    player_ids_query = "SELECT player_id FROM players"
+    copy_matches_query = """
+    COPY (SELECT tournament_id, COALESCE(round_no, 0), winner_id, loser_id, (result = 'draw')::int
+          FROM matches WHERE result <> 'bye') TO STDOUT WITH (FORMAT binary)
+    """
+    # Players whose rating comes out the same, such as those who never played, are not written again
+    update_ratings_query = """
+    UPDATE players SET rating = rated.rating
+    FROM (VALUES %s) AS rated(player_id, rating)
+    WHERE players.player_id = rated.player_id AND players.rating <> rated.rating
+    """
+    mark_rated_query = "UPDATE rounds SET rated = true WHERE NOT rated"
+    # NumPy is only needed for ratings
+    import ratings
+    with _borrow(session) as db:
+        db.cursor.execute(rounds_query)
+        rounds = db.cursor.fetchall()
+        db.cursor.execute(player_ids_query)
+        player_ids = [row[0] for row in db.cursor.fetchall()]
+        sink = ratings.CopyBinaryRows(("tournament_id", "round_no", "winner_id", "loser_id", "draw"))
+        db.cursor.copy_expert(copy_matches_query, sink)
+        matches = sink.rows()
+        new_ratings = ratings.replayMatches(matches, rounds, player_ids, INITIAL_RATING, RATING_K_FACTOR)
+        if player_ids:
+            execute_values(db.cursor, update_ratings_query, list(zip(player_ids, new_ratings.tolist())),
+                           page_size=len(player_ids))
+        db.cursor.execute(mark_rated_query)
+    _invalidate(session=session)
+    return len(matches)
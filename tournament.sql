@@ -17,9 +17,12 @@ CREATE DATABASE tournament;
 -- Create players table
 -- player_id : the serial id of players
 -- player_name : the name of each player
+-- rating : the player's Elo rating, from every rated round of every tournament; swissPairings sorts by it within
+-- score groups
 CREATE TABLE players (
     player_id serial primary key,
-    player_name text
+    player_name text,
+    rating double precision not null default 1500
 );
 
 -- Create tournaments table
@@ -30,22 +33,131 @@ CREATE TABLE tournaments(
     tournament_name text
 );
 
+-- Create rounds table
+-- A row for every round started in a tournament, numbered from 1; the current round is the one with the highest number.
+-- tournament_id : the int id of the tournament
+-- round_no : the number of the round in its tournament
+-- started_at : when the round was started
+-- rated : whether the round's results have been applied to the players' ratings
+-- if a tournament is deleted, its rounds will be deleted too.
+CREATE TABLE rounds(
+    tournament_id int references tournaments(tournament_id) on delete cascade,
+    round_no int,
+    started_at timestamptz not null default now(),
+    rated boolean not null default false,
+    primary key(tournament_id, round_no),
+    constraint rounds_positive check (round_no > 0)
+);
+
+-- The outcome of a match: won by winner_id, drawn between winner_id and loser_id, or a bye for winner_id
+CREATE TYPE match_result AS ENUM ('win', 'draw', 'bye');
+
 -- Create matches table
 -- match_id : the serial id of matches
--- winner_id : the int id of the winner player
--- loser_id : the int id of the loser player
+-- winner_id : the int id of the winner player, or of either player of a draw, or of the player given a bye
+-- loser_id : the int id of the loser player, or of the other player of a draw, or null for a bye
 -- tournament_id : the int id of the tournament that holds this match
+-- round_no : the round the match was played in, or null for a match reported before any round was started
+-- result : whether the match was won, drawn or a bye
 -- if a player is deleted, his corresponding match will be deleted too.
--- if a tournament is deleted, the corresponding matches to this tournament will be deleted too.
+-- if a tournament or a round is deleted, the corresponding matches will be deleted too.
+-- a player cannot play against themselves.
+-- Every tournament has its own partition, matches_[tournament_id], made when the tournament is created, so that a
+-- tournament's matches are read without touching any other's, and archived by detaching the partition whole.
 CREATE TABLE matches(
-    match_id serial primary key,
+    match_id serial,
     winner_id int,
     loser_id int,
-    tournament_id int,
+    tournament_id int not null,
+    round_no int,
+    result match_result not null default 'win',
+    primary key(tournament_id, match_id),
     foreign key(winner_id) references players(player_id) on delete cascade,
     foreign key(loser_id) references players(player_id) on delete cascade,
-    foreign key(tournament_id) references tournaments(tournament_id) on delete cascade
-);
+    foreign key(tournament_id) references tournaments(tournament_id) on delete cascade,
+    foreign key(tournament_id, round_no) references rounds(tournament_id, round_no) on delete cascade,
+    constraint matches_different_players check (winner_id <> loser_id),
+    constraint matches_bye_has_no_loser check ((result = 'bye') = (loser_id IS NULL))
+) PARTITION BY LIST (tournament_id);
+
+-- Matches are always read one tournament at a time, by winner or by loser. The tournament indexes also serve the
+-- cascade when a tournament is deleted, and the player indexes the cascade when a player is deleted.
+CREATE INDEX matches_tournament_winner_idx ON matches(tournament_id, winner_id);
+CREATE INDEX matches_tournament_loser_idx ON matches(tournament_id, loser_id);
+CREATE INDEX matches_winner_idx ON matches(winner_id);
+CREATE INDEX matches_loser_idx ON matches(loser_id);
+-- Find the matches of one round, and serve the cascade when a round is deleted
+CREATE INDEX matches_tournament_round_idx ON matches(tournament_id, round_no);
+-- A player has at most one bye in a tournament
+CREATE UNIQUE INDEX matches_one_bye_idx ON matches(tournament_id, winner_id) WHERE result = 'bye';
+
+-- Give every new tournament its matches partition. The partition is made apart and then attached, which only blocks
+-- other changes to the partitions of matches rather than every read and write of it. A partition left behind by a
+-- TRUNCATE of tournaments that restarted the ids is empty, and is used again.
+CREATE FUNCTION matches_add_partition() RETURNS trigger AS $$
+DECLARE
+    partition text := 'matches_' || NEW.tournament_id;
+BEGIN
+    IF to_regclass(quote_ident(partition)) IS NULL THEN
+        EXECUTE format('CREATE TABLE %I (LIKE matches INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition);
+        EXECUTE format('ALTER TABLE matches ATTACH PARTITION %I FOR VALUES IN (%s)', partition, NEW.tournament_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER tournaments_inserted_partition AFTER INSERT ON tournaments
+FOR EACH ROW EXECUTE PROCEDURE matches_add_partition();
+
+-- Drop the partitions of deleted tournaments, once the cascade has emptied them
+CREATE FUNCTION matches_drop_partitions() RETURNS trigger AS $$
+DECLARE
+    partition text;
+BEGIN
+    FOR partition IN SELECT 'matches_' || tournament_id FROM old_tournaments LOOP
+        IF to_regclass(quote_ident(partition)) IS NOT NULL THEN
+            EXECUTE format('DROP TABLE %I', partition);
+        END IF;
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER tournaments_deleted_partitions AFTER DELETE ON tournaments
+REFERENCING OLD TABLE AS old_tournaments
+FOR EACH STATEMENT EXECUTE PROCEDURE matches_drop_partitions();
+
+-- Drop every partition of matches, with the matches in it, for a full reset; a TRUNCATE cannot drop them itself.
+CREATE FUNCTION drop_match_partitions() RETURNS void AS $$
+DECLARE
+    partition regclass;
+BEGIN
+    FOR partition IN SELECT inhrelid::regclass FROM pg_inherits WHERE inhparent = 'matches'::regclass LOOP
+        EXECUTE format('DROP TABLE %s', partition);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Move a tournament out of the live tables: its matches partition is detached and kept as archived_matches_[id],
+-- a plain table no longer tied to players, tournaments or rounds, and everything else of the tournament is deleted.
+-- Returns the name of the archive table.
+CREATE FUNCTION archive_tournament(p_tournament int) RETURNS text AS $$
+DECLARE
+    partition text := 'matches_' || p_tournament;
+    archive text := 'archived_matches_' || p_tournament;
+    constraint_name name;
+BEGIN
+    EXECUTE format('ALTER TABLE matches DETACH PARTITION %I', partition);
+    FOR constraint_name IN SELECT conname FROM pg_constraint
+                           WHERE conrelid = partition::regclass AND contype = 'f' LOOP
+        EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', partition, constraint_name);
+    END LOOP;
+    EXECUTE format('ALTER TABLE %I ALTER COLUMN match_id DROP DEFAULT', partition);
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', partition, archive);
+    DELETE FROM tournaments WHERE tournament_id = p_tournament;
+    RETURN archive;
+END;
+$$ LANGUAGE plpgsql;
 
 -- Create a table to old relations between players and tournaments
 -- player_id : the int id of the player that is associated to tournament_id, the int id of the tournament
@@ -55,4 +167,444 @@ CREATE TABLE players_in_tournaments(
     player_id int references players(player_id) on delete cascade,
     tournament_id int references tournaments(tournament_id) on delete cascade,
     primary key(player_id, tournament_id)
-);
\ No newline at end of file
+);
+
+-- Find the players of a tournament, and serve the cascade when a tournament is deleted
+CREATE INDEX players_in_tournaments_tournament_idx ON players_in_tournaments(tournament_id);
+
+-- Create standings table
+-- A running record of every player in each tournament they entered, kept up to date by the triggers below so that
+-- standings and player counts are read from here instead of being recomputed from all matches.
+-- tournament_id : the int id of the tournament
+-- player_id : the int id of the player
+-- wins : the number of matches the player has won in this tournament, counting a bye as a win
+-- matches : the number of matches the player has played in this tournament, counting a bye as a match
+-- points : the player's score in half-points: 2 for a win or a bye, 1 for a draw; standings are sorted by it
+-- byes : the number of byes the player has had, which is at most one
+-- opponents : the ids of the players they have met, in the order the matches were reported
+-- up_floats, down_floats : how many times they were paired against a player with more, or fewer, points
+-- last_float : 1 if their latest match was against a player with more points, -1 if fewer, else 0
+-- Together these are the state swissPairings needs, so pairing a round never reads the matches table.
+-- if a player leaves a tournament, or either of them is deleted, the record will be deleted too.
+CREATE TABLE standings(
+    tournament_id int,
+    player_id int,
+    wins int not null default 0,
+    matches int not null default 0,
+    points smallint not null default 0,
+    byes int not null default 0,
+    opponents int[] not null default '{}',
+    up_floats int not null default 0,
+    down_floats int not null default 0,
+    last_float smallint not null default 0,
+    primary key(tournament_id, player_id),
+    foreign key(player_id, tournament_id) references players_in_tournaments(player_id, tournament_id) on delete cascade
+);
+
+-- Create round_pairings table
+-- The pairings made when a round is started, so that the round's pending matches can be listed.
+-- tournament_id, round_no : the round
+-- board : the number of the pairing in its round, from 1
+-- player1_id, player2_id : the int ids of the paired players; player2_id is null for a bye
+-- if a round or either player is deleted, the pairing will be deleted too.
+CREATE TABLE round_pairings(
+    tournament_id int,
+    round_no int,
+    board int,
+    player1_id int references players(player_id) on delete cascade,
+    player2_id int references players(player_id) on delete cascade,
+    primary key(tournament_id, round_no, board),
+    foreign key(tournament_id, round_no) references rounds(tournament_id, round_no) on delete cascade
+);
+
+-- Create standings_snapshots table
+-- A copy of the standings taken when each round is closed by starting the next, so that the standings as of any
+-- earlier round are read from here rather than worked out again from the matches. Each round is one row of arrays
+-- in standings order, which keeps taking a snapshot of a large tournament to a single row write.
+-- tournament_id, round_no : the round whose results the snapshot includes
+-- player_ids, wins, matches, points : as in standings at the end of that round, one element per player
+-- if a round is deleted, its snapshot will be deleted too; deleted players are left out when it is read.
+CREATE TABLE standings_snapshots(
+    tournament_id int,
+    round_no int,
+    player_ids int[] not null,
+    wins int[] not null,
+    matches int[] not null,
+    points smallint[] not null,
+    primary key(tournament_id, round_no),
+    foreign key(tournament_id, round_no) references rounds(tournament_id, round_no) on delete cascade
+);
+
+-- Start an empty record for every player added to a tournament
+CREATE FUNCTION standings_add_players() RETURNS trigger AS $$
+BEGIN
+    -- importTournament sets tournament.importing for its transaction, and counts the whole event at once with
+    -- count_imported_tournament() once its matches are in
+    IF current_setting('tournament.importing', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO standings(tournament_id, player_id)
+    SELECT tournament_id, player_id FROM new_players;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER players_in_tournaments_standings AFTER INSERT ON players_in_tournaments
+REFERENCING NEW TABLE AS new_players
+FOR EACH STATEMENT EXECUTE PROCEDURE standings_add_players();
+
+-- Add inserted matches to, and take deleted matches off, the records of both players.
+-- The triggers run once per statement, so a whole round reported at once is a single update.
+-- Each match is split into one row per player: a bye has only the one, and no opponent.
+CREATE FUNCTION standings_count_matches() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('tournament.importing', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        -- Floats compare the points of both players before this statement's results are counted.
+        UPDATE standings SET wins = standings.wins + results.wins,
+                             matches = standings.matches + results.matches,
+                             points = standings.points + results.points,
+                             byes = standings.byes + results.byes,
+                             opponents = standings.opponents || results.opponents,
+                             up_floats = standings.up_floats + results.up_floats,
+                             down_floats = standings.down_floats + results.down_floats,
+                             last_float = results.last_float
+        FROM (SELECT played.tournament_id, played.player_id, SUM(played.won) AS wins, COUNT(*) AS matches,
+                     SUM(played.points) AS points, COUNT(*) FILTER (WHERE played.opponent_id IS NULL) AS byes,
+                     COALESCE(array_agg(played.opponent_id ORDER BY played.match_id)
+                              FILTER (WHERE played.opponent_id IS NOT NULL), '{}') AS opponents,
+                     COUNT(*) FILTER (WHERE opponent.points > player.points) AS up_floats,
+                     COUNT(*) FILTER (WHERE opponent.points < player.points) AS down_floats,
+                     COALESCE((array_agg(sign(opponent.points - player.points) ORDER BY played.match_id DESC))[1],
+                              0) AS last_float
+              FROM (SELECT match_id, tournament_id, winner_id AS player_id, loser_id AS opponent_id,
+                           CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                           CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points
+                    FROM new_matches
+                    UNION ALL
+                    SELECT match_id, tournament_id, loser_id, winner_id, 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END
+                    FROM new_matches WHERE result <> 'bye') AS played
+              JOIN standings AS player
+                ON player.tournament_id = played.tournament_id AND player.player_id = played.player_id
+              LEFT JOIN standings AS opponent
+                ON opponent.tournament_id = played.tournament_id AND opponent.player_id = played.opponent_id
+              GROUP BY played.tournament_id, played.player_id) AS results
+        WHERE standings.tournament_id = results.tournament_id AND standings.player_id = results.player_id;
+    ELSE
+        -- Opponents are listed again from the matches left. Floats cannot be worked out again after the fact,
+        -- so they are only cleared once a player has no matches left.
+        UPDATE standings SET wins = standings.wins - results.wins,
+                             matches = standings.matches - results.matches,
+                             points = standings.points - results.points,
+                             byes = standings.byes - results.byes,
+                             opponents = ARRAY(SELECT CASE WHEN matches.winner_id = standings.player_id
+                                                           THEN matches.loser_id ELSE matches.winner_id END
+                                               FROM matches
+                                               WHERE matches.tournament_id = standings.tournament_id
+                                                 AND (matches.winner_id = standings.player_id
+                                                      OR matches.loser_id = standings.player_id)
+                                                 AND matches.result <> 'bye'
+                                               ORDER BY matches.match_id),
+                             up_floats = CASE WHEN standings.matches = results.matches THEN 0
+                                              ELSE standings.up_floats END,
+                             down_floats = CASE WHEN standings.matches = results.matches THEN 0
+                                                ELSE standings.down_floats END,
+                             last_float = CASE WHEN standings.matches = results.matches THEN 0
+                                               ELSE standings.last_float END
+        FROM (SELECT tournament_id, player_id, SUM(won) AS wins, COUNT(*) AS matches, SUM(points) AS points,
+                     COUNT(*) FILTER (WHERE bye) AS byes
+              FROM (SELECT tournament_id, winner_id AS player_id, CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                           CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points, result = 'bye' AS bye
+                    FROM old_matches
+                    UNION ALL
+                    SELECT tournament_id, loser_id, 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END, false
+                    FROM old_matches WHERE result <> 'bye') AS played
+              GROUP BY tournament_id, player_id) AS results
+        WHERE standings.tournament_id = results.tournament_id AND standings.player_id = results.player_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER matches_inserted_standings AFTER INSERT ON matches
+REFERENCING NEW TABLE AS new_matches
+FOR EACH STATEMENT EXECUTE PROCEDURE standings_count_matches();
+
+CREATE TRIGGER matches_deleted_standings AFTER DELETE ON matches
+REFERENCING OLD TABLE AS old_matches
+FOR EACH STATEMENT EXECUTE PROCEDURE standings_count_matches();
+
+-- Tell listening processes which tournaments' standings changed, so that they can drop cached standings and pairings.
+-- Notifications are delivered when the transaction commits, and once per tournament however many rows changed.
+CREATE FUNCTION standings_notify() RETURNS trigger AS $$
+DECLARE
+    changed text := CASE TG_OP WHEN 'DELETE' THEN 'old_standings' ELSE 'new_standings' END;
+BEGIN
+    EXECUTE format($query$
+        SELECT pg_notify('standings_changed', tournament_id::text) FROM (SELECT DISTINCT tournament_id FROM %I) AS tournaments
+    $query$, changed);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER standings_inserted_notify AFTER INSERT ON standings
+REFERENCING NEW TABLE AS new_standings
+FOR EACH STATEMENT EXECUTE PROCEDURE standings_notify();
+
+CREATE TRIGGER standings_updated_notify AFTER UPDATE ON standings
+REFERENCING NEW TABLE AS new_standings
+FOR EACH STATEMENT EXECUTE PROCEDURE standings_notify();
+
+CREATE TRIGGER standings_deleted_notify AFTER DELETE ON standings
+REFERENCING OLD TABLE AS old_standings
+FOR EACH STATEMENT EXECUTE PROCEDURE standings_notify();
+
+-- A TRUNCATE has no rows to tell the tournaments from, so it notifies with an empty payload, meaning all of them
+CREATE FUNCTION standings_notify_truncate() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('standings_changed', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER standings_truncated_notify AFTER TRUNCATE ON standings
+FOR EACH STATEMENT EXECUTE PROCEDURE standings_notify_truncate();
+
+-- Ratings decide the pairings of every tournament the players are in, so a change to them is notified as a change
+-- of those tournaments' standings
+CREATE FUNCTION players_rating_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('standings_changed', tournament_id::text)
+    FROM (SELECT DISTINCT entered.tournament_id
+          FROM new_players
+          JOIN old_players ON old_players.player_id = new_players.player_id
+          JOIN players_in_tournaments AS entered ON entered.player_id = new_players.player_id
+          WHERE new_players.rating <> old_players.rating) AS tournaments;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER players_rating_notify AFTER UPDATE ON players
+REFERENCING OLD TABLE AS old_players NEW TABLE AS new_players
+FOR EACH STATEMENT EXECUTE PROCEDURE players_rating_notify();
+
+-- Create careers table
+-- Every player's record over all the tournaments they entered, kept up to date by the triggers below so that a
+-- player's career is one row read by its key, however many matches they have played.
+-- player_id : the int id of the player
+-- events : the number of tournaments the player has entered
+-- wins, matches, points, byes : as in standings, summed over every tournament
+-- draws : the number of matches the player has drawn
+-- Archiving a tournament keeps it in its players' careers; resetting the tournaments or players clears them.
+-- if a player is deleted, their career will be deleted too.
+CREATE TABLE careers(
+    player_id int primary key references players(player_id) on delete cascade,
+    events int not null default 0,
+    wins int not null default 0,
+    matches int not null default 0,
+    draws int not null default 0,
+    points int not null default 0,
+    byes int not null default 0
+);
+
+-- Create head_to_head table
+-- The record between every two players who have met, in any tournament, kept once per pair under the lower id.
+-- player_id, opponent_id : the int ids of the two players, player_id the lower
+-- wins, losses : the matches player_id has won against and lost to opponent_id
+-- draws : the matches they have drawn
+-- if either player is deleted, the record will be deleted too.
+CREATE TABLE head_to_head(
+    player_id int references players(player_id) on delete cascade,
+    opponent_id int references players(player_id) on delete cascade,
+    wins int not null default 0,
+    losses int not null default 0,
+    draws int not null default 0,
+    primary key(player_id, opponent_id),
+    constraint head_to_head_ordered check (player_id < opponent_id)
+);
+
+-- Serve the cascade when a player is deleted
+CREATE INDEX head_to_head_opponent_idx ON head_to_head(opponent_id);
+
+-- Count every tournament a player enters as an event of their career
+CREATE FUNCTION careers_add_events() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('tournament.importing', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO careers AS career(player_id, events)
+    SELECT player_id, COUNT(*) FROM new_players GROUP BY player_id ORDER BY player_id
+    ON CONFLICT (player_id) DO UPDATE SET events = career.events + EXCLUDED.events;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER players_in_tournaments_careers AFTER INSERT ON players_in_tournaments
+REFERENCING NEW TABLE AS new_players
+FOR EACH STATEMENT EXECUTE PROCEDURE careers_add_events();
+
+-- Add inserted matches to, and take deleted matches off, the careers and head-to-head records of both players, as
+-- standings_count_matches does for the standings. New results are written in key order, so that concurrent reports
+-- lock the rows they share in the same order.
+CREATE FUNCTION careers_count_matches() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('tournament.importing', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO careers AS career(player_id, wins, matches, draws, points, byes)
+        SELECT player_id, SUM(won), COUNT(*), SUM(drawn), SUM(points), SUM(bye)
+        FROM (SELECT winner_id AS player_id, CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                     CASE result WHEN 'draw' THEN 1 ELSE 0 END AS drawn,
+                     CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points,
+                     CASE result WHEN 'bye' THEN 1 ELSE 0 END AS bye
+              FROM new_matches
+              UNION ALL
+              SELECT loser_id, 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END,
+                     CASE result WHEN 'draw' THEN 1 ELSE 0 END, 0
+              FROM new_matches WHERE result <> 'bye') AS played
+        GROUP BY player_id ORDER BY player_id
+        ON CONFLICT (player_id) DO UPDATE SET wins = career.wins + EXCLUDED.wins,
+                                              matches = career.matches + EXCLUDED.matches,
+                                              draws = career.draws + EXCLUDED.draws,
+                                              points = career.points + EXCLUDED.points,
+                                              byes = career.byes + EXCLUDED.byes;
+        INSERT INTO head_to_head AS record(player_id, opponent_id, wins, losses, draws)
+        SELECT LEAST(winner_id, loser_id), GREATEST(winner_id, loser_id),
+               COUNT(*) FILTER (WHERE result = 'win' AND winner_id < loser_id),
+               COUNT(*) FILTER (WHERE result = 'win' AND winner_id > loser_id),
+               COUNT(*) FILTER (WHERE result = 'draw')
+        FROM new_matches WHERE result <> 'bye'
+        GROUP BY 1, 2 ORDER BY 1, 2
+        ON CONFLICT (player_id, opponent_id) DO UPDATE SET wins = record.wins + EXCLUDED.wins,
+                                                           losses = record.losses + EXCLUDED.losses,
+                                                           draws = record.draws + EXCLUDED.draws;
+    ELSE
+        UPDATE careers SET wins = careers.wins - results.wins,
+                           matches = careers.matches - results.matches,
+                           draws = careers.draws - results.draws,
+                           points = careers.points - results.points,
+                           byes = careers.byes - results.byes
+        FROM (SELECT player_id, SUM(won) AS wins, COUNT(*) AS matches, SUM(drawn) AS draws, SUM(points) AS points,
+                     SUM(bye) AS byes
+              FROM (SELECT winner_id AS player_id, CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                           CASE result WHEN 'draw' THEN 1 ELSE 0 END AS drawn,
+                           CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points,
+                           CASE result WHEN 'bye' THEN 1 ELSE 0 END AS bye
+                    FROM old_matches
+                    UNION ALL
+                    SELECT loser_id, 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END,
+                           CASE result WHEN 'draw' THEN 1 ELSE 0 END, 0
+                    FROM old_matches WHERE result <> 'bye') AS played
+              GROUP BY player_id) AS results
+        WHERE careers.player_id = results.player_id;
+        UPDATE head_to_head SET wins = head_to_head.wins - results.wins,
+                                losses = head_to_head.losses - results.losses,
+                                draws = head_to_head.draws - results.draws
+        FROM (SELECT LEAST(winner_id, loser_id) AS player_id, GREATEST(winner_id, loser_id) AS opponent_id,
+                     COUNT(*) FILTER (WHERE result = 'win' AND winner_id < loser_id) AS wins,
+                     COUNT(*) FILTER (WHERE result = 'win' AND winner_id > loser_id) AS losses,
+                     COUNT(*) FILTER (WHERE result = 'draw') AS draws
+              FROM old_matches WHERE result <> 'bye'
+              GROUP BY 1, 2) AS results
+        WHERE head_to_head.player_id = results.player_id AND head_to_head.opponent_id = results.opponent_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER matches_inserted_careers AFTER INSERT ON matches
+REFERENCING NEW TABLE AS new_matches
+FOR EACH STATEMENT EXECUTE PROCEDURE careers_count_matches();
+
+CREATE TRIGGER matches_deleted_careers AFTER DELETE ON matches
+REFERENCING OLD TABLE AS old_matches
+FOR EACH STATEMENT EXECUTE PROCEDURE careers_count_matches();
+
+-- Counts a tournament imported with tournament.importing on, whose players and matches the triggers above skipped:
+-- its standings rows are written once, already counted, rather than started empty and updated, and its players'
+-- careers and head-to-head records are added to in one statement each. Every result of an import is counted in the
+-- same statement, so nobody has floated yet, as with the triggers. The players of an import are new, so the
+-- standings are only ever inserted.
+CREATE FUNCTION count_imported_tournament(p_tournament int) RETURNS void AS $$
+BEGIN
+    INSERT INTO standings(tournament_id, player_id, wins, matches, points, byes, opponents)
+    SELECT p_tournament, members.player_id, COALESCE(SUM(played.won), 0), COUNT(played.match_id),
+           COALESCE(SUM(played.points), 0), COUNT(played.match_id) FILTER (WHERE played.opponent_id IS NULL),
+           COALESCE(array_agg(played.opponent_id ORDER BY played.match_id)
+                    FILTER (WHERE played.opponent_id IS NOT NULL), '{}')
+    FROM players_in_tournaments AS members
+    LEFT JOIN (SELECT match_id, winner_id AS player_id, loser_id AS opponent_id,
+                      CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                      CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points
+               FROM matches WHERE tournament_id = p_tournament
+               UNION ALL
+               SELECT match_id, loser_id, winner_id, 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END
+               FROM matches WHERE tournament_id = p_tournament AND result <> 'bye') AS played
+      ON played.player_id = members.player_id
+    WHERE members.tournament_id = p_tournament
+    GROUP BY members.player_id;
+
+    INSERT INTO careers AS career(player_id, events, wins, matches, draws, points, byes)
+    SELECT members.player_id, 1, COALESCE(SUM(played.won), 0), COUNT(played.player_id),
+           COALESCE(SUM(played.drawn), 0), COALESCE(SUM(played.points), 0), COALESCE(SUM(played.bye), 0)
+    FROM players_in_tournaments AS members
+    LEFT JOIN (SELECT winner_id AS player_id, CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                      CASE result WHEN 'draw' THEN 1 ELSE 0 END AS drawn,
+                      CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points,
+                      CASE result WHEN 'bye' THEN 1 ELSE 0 END AS bye
+               FROM matches WHERE tournament_id = p_tournament
+               UNION ALL
+               SELECT loser_id, 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END,
+                      CASE result WHEN 'draw' THEN 1 ELSE 0 END, 0
+               FROM matches WHERE tournament_id = p_tournament AND result <> 'bye') AS played
+      ON played.player_id = members.player_id
+    WHERE members.tournament_id = p_tournament
+    GROUP BY members.player_id ORDER BY members.player_id
+    ON CONFLICT (player_id) DO UPDATE SET events = career.events + EXCLUDED.events,
+                                          wins = career.wins + EXCLUDED.wins,
+                                          matches = career.matches + EXCLUDED.matches,
+                                          draws = career.draws + EXCLUDED.draws,
+                                          points = career.points + EXCLUDED.points,
+                                          byes = career.byes + EXCLUDED.byes;
+
+    INSERT INTO head_to_head AS record(player_id, opponent_id, wins, losses, draws)
+    SELECT LEAST(winner_id, loser_id), GREATEST(winner_id, loser_id),
+           COUNT(*) FILTER (WHERE result = 'win' AND winner_id < loser_id),
+           COUNT(*) FILTER (WHERE result = 'win' AND winner_id > loser_id),
+           COUNT(*) FILTER (WHERE result = 'draw')
+    FROM matches WHERE tournament_id = p_tournament AND result <> 'bye'
+    GROUP BY 1, 2 ORDER BY 1, 2
+    ON CONFLICT (player_id, opponent_id) DO UPDATE SET wins = record.wins + EXCLUDED.wins,
+                                                       losses = record.losses + EXCLUDED.losses,
+                                                       draws = record.draws + EXCLUDED.draws;
+END;
+$$ LANGUAGE plpgsql;
+
+-- The next round's pairing candidates, for swissPairings(server_side=True): every player of a tournament in pairing
+-- order, with the players up to p_window seats below them that they have not met yet. Each score group is placed
+-- with those who last floated down first and those who last floated up last, then by rating, and folded so that
+-- its top half sits next to its bottom half, the first player beside the first of the bottom half, as
+-- pairing.ratingOrder does. The seats and candidate lists come from window functions over the standings, so the
+-- whole answer is one statement.
+CREATE FUNCTION pairing_candidates(p_tournament int, p_window int)
+RETURNS TABLE(seat bigint, player_id int, player_name text, points smallint, byes int, candidates int[]) AS $$
+    SELECT seat, player_id, player_name, points, byes,
+           ARRAY(SELECT candidate FROM unnest(following) AS candidate WHERE candidate <> ALL(opponents))
+    FROM (SELECT player_id, player_name, points, byes, opponents,
+                 row_number() OVER seats AS seat,
+                 array_agg(player_id) OVER (seats ROWS BETWEEN 1 FOLLOWING AND p_window FOLLOWING) AS following
+          FROM (SELECT standings.player_id, players.player_name, standings.points, standings.byes,
+                       standings.opponents, row_number() OVER score_group - 1 AS place,
+                       count(*) OVER (PARTITION BY standings.points) / 2 AS half
+                FROM standings JOIN players ON players.player_id = standings.player_id
+                WHERE standings.tournament_id = p_tournament
+                WINDOW score_group AS (PARTITION BY standings.points
+                                       ORDER BY CASE standings.last_float WHEN -1 THEN 0 WHEN 0 THEN 1 ELSE 2 END,
+                                                players.rating DESC, standings.player_id)) AS grouped
+          WINDOW seats AS (ORDER BY points DESC,
+                                    CASE WHEN place < half THEN 2 * place ELSE 2 * (place - half) + 1 END))
+         AS ranked
+$$ LANGUAGE sql STABLE;
@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+#
+# tournament_aio.py -- asyncio counterparts of the functions in tournament.py
+#
+# Needs Python 3 and aiopg. Every function is a coroutine taking the same
+# arguments as its tournament.py namesake, and runs on a connection from an
+# aiopg pool instead of blocking the event loop.
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import aiopg
+
+import pairing
+import queries
+from tournament import CANDIDATE_WINDOW, DBNAME, RATING_K_FACTOR, _id, _name, _optionalId, _pairingTasks, _pairSection, _withPoints
+
+
+_pool = None
+
+async def configurePool(dbname=DBNAME, min_size=1, max_size=10):
+    """
+    Replace the connection pool shared by all coroutines in this module.
+    Returns the new pool.
+    """
+    global _pool
+    pool = await aiopg.create_pool('dbname=' + dbname, minsize=min_size, maxsize=max_size,
+                                   enable_hstore=False)
+    old_pool, _pool = _pool, pool
+    if old_pool is not None:
+        old_pool.close()
+        await old_pool.wait_closed()
+    return pool
+
+async def getPool():
+    """Returns the shared connection pool, creating a default one if needed."""
+    if _pool is None:
+        await configurePool()
+    return _pool
+
+async def closePool():
+    """Close the shared connection pool, waiting for borrowed connections."""
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+        await pool.wait_closed()
+
+
+class Session(object):
+    """A transaction on a connection borrowed from the pool.
+
+    The asyncio version of tournament.Session, used with "async with". aiopg
+    connections are in autocommit mode, so the session opens its own
+    transaction: it commits on success, rolls back on error and hands its
+    connection back to the pool.
+    """
+
+    def __init__(self, pool=None):
+        self.pool = pool
+        self.connection = None
+        self.cursor = None
+
+    async def __aenter__(self):
+        if self.pool is None:
+            self.pool = await getPool()
+        self.connection = await self.pool.acquire()
+        try:
+            self.cursor = await self.connection.cursor()
+            await self.cursor.execute("BEGIN")
+        except Exception:
+            await self.pool.release(self.connection)
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        try:
+            await self.cursor.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        finally:
+            self.cursor.close()
+            await self.pool.release(self.connection)
+            self.connection = None
+
+
+class _borrow(object):
+    """
+    Yields the caller's session, or a new pooled one that is committed and
+    returned to the pool when the block ends.
+    """
+
+    def __init__(self, session=None):
+        self.session = session
+        self._owned = None
+
+    async def __aenter__(self):
+        if self.session is not None:
+            return self.session
+        self._owned = Session()
+        return await self._owned.__aenter__()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self._owned is not None:
+            await self._owned.__aexit__(exc_type, exc_value, traceback)
+
+
+async def deleteTournaments(session=None):
+    """Delete all tournaments from database, by truncating, as tournament.deleteTournaments does."""
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.DROP_MATCH_PARTITIONS)
+        await db.cursor.execute(queries.TRUNCATE_TOURNAMENTS)
+
+async def deleteMatches(tournament=None, session=None):
+    """
+    If a tournament id number is passed, delete that tournament's matches and
+    rounds, else, remove all the match and round records from the database.
+    """
+    tournament = _optionalId(tournament)
+    async with _borrow(session) as db:
+        if tournament is not None:
+            await db.cursor.execute(queries.DELETE_ROUNDS_IN_TOURNAMENT, (tournament,))
+            await db.cursor.execute(queries.DELETE_MATCHES_IN_TOURNAMENT, (tournament,))
+        else:
+            await db.cursor.execute(queries.DELETE_ALL_ROUNDS)
+            await db.cursor.execute(queries.DELETE_ALL_MATCHES)
+
+async def deletePlayers(session=None):
+    """Remove all the player records from the database, by truncating, as tournament.deletePlayers does."""
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.TRUNCATE_PLAYERS)
+
+async def archiveTournament(tournament, session=None):
+    """
+    Detaches a tournament's matches partition as archived_matches_[tournament]
+    and deletes the rest of it, as tournament.archiveTournament does. Returns
+    the name of the archive table.
+    """
+    tournament = _id(tournament)
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.LOCK_TOURNAMENT, (tournament,))
+        if await db.cursor.fetchone() is None:
+            raise ValueError("Unknown Tournament")
+        await db.cursor.execute(queries.ARCHIVE_TOURNAMENT, (tournament,))
+        archive = (await db.cursor.fetchone())[0]
+    return archive
+
+async def createTournament(name, session=None):
+    """Create a new tournament"""
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.CREATE_TOURNAMENT, (_name(name),))
+        row = await db.cursor.fetchone()
+    return row[0]
+
+async def addPlayerToTournament(player_id, tournament, session=None):
+    """Add a player to a specific tournament"""
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.ADD_PLAYER_TO_TOURNAMENT, (_id(player_id), _id(tournament)))
+
+async def addPlayersToTournament(player_ids, tournament, session=None):
+    """
+    Add many players to a specific tournament in a single statement.
+    :param player_ids:an iterable of player id numbers, each at most once
+    :param tournament:the id number of the tournament
+    :param session:an optional Session to run the insert in
+    """
+    player_ids = [_id(player_id) for player_id in player_ids]
+    if len(set(player_ids)) != len(player_ids):
+        raise ValueError("Duplicate Players In Batch")
+    if not player_ids:
+        return
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.ADD_PLAYERS_TO_TOURNAMENT, (_id(tournament), player_ids))
+
+async def countPlayers(tournament=None, session=None):
+    """
+    if a tournament id is passed, count the number of players added to this tournament,
+    else return the all number of players currently registered.
+    """
+    tournament = _optionalId(tournament)
+    async with _borrow(session) as db:
+        if tournament is not None:
+            await db.cursor.execute(queries.COUNT_TOURNAMENT_PLAYERS, (tournament,))
+        else:
+            await db.cursor.execute(queries.COUNT_PLAYERS)
+        result = await db.cursor.fetchone()
+    return result[0]
+
+async def registerPlayer(name, session=None):
+    """Adds a player to the tournament database, and returns their id number."""
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.REGISTER_PLAYER, (_name(name),))
+        row = await db.cursor.fetchone()
+    return row[0]
+
+async def registerPlayers(names, session=None):
+    """
+    Adds many players to the tournament database in a single statement.
+    :param names:an iterable of the players' full names
+    :param session:an optional Session to run the insert in
+    :return:the players' new id numbers, in the same order as names
+    """
+    names = [_name(name) for name in names]
+    if not names:
+        return []
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.REGISTER_PLAYERS, (names,))
+        rows = await db.cursor.fetchall()
+    return [row[0] for row in rows]
+
+async def playerStandings(tournament, tiebreaks=None, points=False, session=None):
+    """
+    Returns a list of (id, name, wins, matches) tuples, sorted by points, as
+    tournament.playerStandings does, with the points if asked for and one
+    extra score per tiebreak.
+    """
+    tournament = _id(tournament)
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.PLAYER_STANDINGS, (tournament,))
+        player_standings = _withPoints(await db.cursor.fetchall())
+        if tiebreaks:
+            await db.cursor.execute(queries.ORDERED_MATCHES, (tournament,))
+            matches = await db.cursor.fetchall()
+    if tiebreaks:
+        import tiebreaks as tiebreak_scores
+        player_standings = tiebreak_scores.computeTiebreaks(
+            player_standings, matches, tiebreaks, scores=[row[4] for row in player_standings])
+    if not points:
+        player_standings = [row[:4] + row[5:] for row in player_standings]
+    return player_standings
+
+async def reportMatch(winner, loser, tournament, draw=False, session=None):
+    """Records the outcome of a single match between two players, in the current round."""
+    tournament = _id(tournament)
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.REPORT_MATCH, (_id(winner), _id(loser), tournament, tournament,
+                                                     "draw" if draw else "win"))
+
+async def reportBye(player, tournament, session=None):
+    """Records a bye, which scores as a win, for a player left unpaired."""
+    tournament = _id(tournament)
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.REPORT_BYE, (_id(player), tournament, tournament))
+
+async def reportMatches(results, tournament, session=None):
+    """
+    Records the outcomes of a whole round of matches in a single statement,
+    with the same checks as tournament.reportMatches.
+    :param results:an iterable of (winner, loser) id number pairs; a third
+    item, if true, marks a draw, and (player, None) is a bye
+    :param tournament:the id number of the matches' tournament
+    :param session:an optional Session to run the insert in
+    :return:the new match id numbers, in the same order as results
+    """
+    matches = []
+    for result in results:
+        winner, loser = _id(result[0]), _optionalId(result[1])
+        if loser is None:
+            matches.append((winner, None, "bye"))
+        else:
+            matches.append((winner, loser, "draw" if len(result) > 2 and result[2] else "win"))
+    tournament = _id(tournament)
+    pairs = set()
+    players = set()
+    for (winner, loser, _) in matches:
+        pair = frozenset((winner, loser))
+        if winner == loser:
+            raise ValueError("Player Cannot Play Themselves")
+        if pair in pairs:
+            raise ValueError("Duplicate Pair In Batch")
+        repeated = pair & players
+        if repeated:
+            raise ValueError("Player Twice In Batch: {0}".format(min(repeated)))
+        pairs.add(pair)
+        players.update(pair - {None})
+    if not matches:
+        return []
+    player_ids = list(players)
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.TOURNAMENT_MEMBERS, (tournament, player_ids))
+        members = await db.cursor.fetchall()
+        missing = set(player_ids) - set(row[0] for row in members)
+        if missing:
+            raise ValueError("Players Not In Tournament: {0}".format(sorted(missing)))
+        await db.cursor.execute(queries.REPORT_MATCHES,
+                                (tournament, tournament, [match[0] for match in matches],
+                                 [match[1] for match in matches], [match[2] for match in matches]))
+        rows = await db.cursor.fetchall()
+    return [row[0] for row in rows]
+
+async def getPlayedMatches(tournament, session=None):
+    """
+    Returns the list of matches played in a specific tournament.
+    :param tournament:the id number of the tournament
+    :param session:an optional Session to run the query in
+    :return:list of played matches
+    """
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.PLAYED_MATCHES, (_id(tournament),))
+        matches = await db.cursor.fetchall()
+    return matches
+
+async def getCurrentRound(tournament, session=None):
+    """Returns the number of the latest round started in a tournament, or 0."""
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.CURRENT_ROUND, (_id(tournament),))
+        row = await db.cursor.fetchone()
+    return row[0]
+
+async def roundPairings(tournament, round_no=None, session=None):
+    """
+    Returns the (id1, name1, id2, name2, winner_id, result) tuples of
+    tournament.roundPairings, for the current round if round_no is None.
+    """
+    tournament = _id(tournament)
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.ROUND_PAIRINGS, (tournament, tournament, _optionalId(round_no), tournament))
+        pairings = await db.cursor.fetchall()
+    return pairings
+
+async def standingsAsOf(tournament, round_no, session=None):
+    """
+    Returns the standings of a tournament at the end of a round, from its
+    snapshot or, for the current round, the live standings.
+    """
+    tournament = _id(tournament)
+    round_no = _id(round_no)
+    async with _borrow(session) as db:
+        current_round = await getCurrentRound(tournament, session=db)
+        if not 1 <= round_no <= current_round:
+            raise ValueError("Unknown Round")
+        if round_no == current_round:
+            return await playerStandings(tournament, session=db)
+        await db.cursor.execute(queries.STANDINGS_SNAPSHOT, (tournament, round_no))
+        standings = await db.cursor.fetchall()
+    return standings
+
+async def playerCareer(player_id, session=None):
+    """
+    Returns a player's (id, name, events, wins, draws, losses, matches,
+    points, points_per_event) over every tournament, as
+    tournament.playerCareer does.
+    """
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.PLAYER_CAREER, (_id(player_id),))
+        row = await db.cursor.fetchone()
+    if row is None:
+        raise ValueError("Unknown Player")
+    player_id, name, events, wins, draws, matches, points = row
+    return (player_id, name, events, wins, draws, matches - wins - draws, matches, points / 2.0,
+            points / 2.0 / events if events else 0.0)
+
+async def headToHead(player1, player2, session=None):
+    """
+    Returns the (player1 wins, draws, player2 wins) record between two
+    players, as tournament.headToHead does.
+    """
+    player1 = _id(player1)
+    player2 = _id(player2)
+    if player1 == player2:
+        raise ValueError("Same Player Twice")
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.HEAD_TO_HEAD, (min(player1, player2), max(player1, player2)))
+        row = await db.cursor.fetchone() or (0, 0, 0)
+    return row if player1 < player2 else row[::-1]
+
+async def getPairingState(tournament, session=None):
+    """
+    Returns the (id, name, wins, matches, points, byes, opponents, last_float,
+    rating) tuples of tournament.getPairingState, in standings order.
+    """
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.PAIRING_STATE, (_id(tournament),))
+        records = _withPoints(await db.cursor.fetchall())
+    return records
+
+async def swissPairings(tournament, mode="greedy", stats=None, server_side=False, session=None):
+    """
+    Returns a list of (id1, name1, id2, name2) pairs for the next round, with
+    any bye last as (id, name, None, None), as tournament.swissPairings does,
+    from a single read of the pairing state, or with server_side of the
+    pairing_candidates() function.
+    The pairing itself runs in the loop's default executor, so a large
+    optimal pairing does not stall other coroutines.
+    """
+    if mode not in ("greedy", "optimal"):
+        raise ValueError("Unknown Pairing Mode")
+    loop = asyncio.get_running_loop()
+    if server_side:
+        return await _pairCandidates(_id(tournament), mode, stats, session, loop)
+    records = await getPairingState(tournament, session=session)
+    if len(records) < 2:
+        raise ValueError("Not Enough Players")
+    played = pairing.PlayedPairs()
+    for record in records:
+        for opponent in record[6]:
+            played.add(record[0], opponent)
+    order = pairing.ratingOrder([record[4] for record in records], [record[7] for record in records],
+                                [record[8] for record in records])
+    solve = partial(pairing.pairRound, [records[i][:2] for i in order], [records[i][4] for i in order], played,
+                    [records[i][5] for i in order], mode=mode, stats=stats)
+    return await loop.run_in_executor(None, solve)
+
+async def _pairCandidates(tournament, mode, stats, session, loop):
+    """swissPairings(server_side=True), widening the window as tournament.swissPairings does."""
+    window = CANDIDATE_WINDOW
+    while True:
+        async with _borrow(session) as db:
+            await db.cursor.execute(queries.PAIRING_CANDIDATES, (tournament, window))
+            records = await db.cursor.fetchall()
+        if len(records) < 2:
+            raise ValueError("Not Enough Players")
+        allowed = pairing.CandidatePairs(((record[0], record[1], record[5]) for record in records), window)
+        solve = partial(pairing.pairRound, [record[1:3] for record in records], [record[3] for record in records],
+                        allowed, [record[4] for record in records], mode=mode, stats=stats)
+        try:
+            pairings = await loop.run_in_executor(None, solve)
+        except ValueError:
+            if not allowed.outside:
+                raise
+        else:
+            if not allowed.outside:
+                return pairings
+        window *= 2
+
+async def startRound(tournament, mode="greedy", session=None):
+    """
+    Finishes the current round of a tournament and starts the next one, as
+    tournament.startRound does, through pairAll for the one tournament.
+    Returns (round_no, pairings).
+    """
+    tournament = _id(tournament)
+    rounds = await pairAll([tournament], mode=mode, workers=1, session=session)
+    return rounds[tournament]
+
+async def pairAll(tournaments, mode="greedy", workers=None, timings=None, session=None):
+    """
+    Starts the next round of many tournaments in one transaction, as
+    tournament.pairAll does, with the sections paired in a process pool
+    while the event loop waits. Returns {tournament_id: (round_no, pairings)}.
+    """
+    if mode not in ("greedy", "optimal"):
+        raise ValueError("Unknown Pairing Mode")
+    tournaments = sorted(set(_id(tournament) for tournament in tournaments))
+    if not tournaments:
+        return {}
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.LOCK_TOURNAMENTS, (tournaments,))
+        found = set(row[0] for row in await db.cursor.fetchall())
+        if len(found) < len(tournaments):
+            raise ValueError("Unknown Tournaments: {0}".format([t for t in tournaments if t not in found]))
+        await db.cursor.execute(queries.CURRENT_ROUNDS, (tournaments,))
+        current_rounds = dict(await db.cursor.fetchall())
+        await db.cursor.execute(queries.UNFINISHED_ROUNDS, (tournaments,))
+        unfinished = [row[0] for row in await db.cursor.fetchall()]
+        if unfinished:
+            raise ValueError("Round Not Finished: {0}".format(unfinished))
+        await db.cursor.execute(queries.SNAPSHOT_STANDINGS, (tournaments,))
+        await db.cursor.execute(queries.SECTIONS_PAIRING_STATE, (tournaments,))
+        records = await db.cursor.fetchall()
+        names = dict((record[1], record[6]) for record in records)
+        tasks = _pairingTasks(records, mode)
+        missing = [tournament for tournament in tournaments if tournament not in tasks]
+        if missing:
+            raise ValueError("Not Enough Players In Tournament {0}".format(missing[0]))
+
+        loop = asyncio.get_running_loop()
+        tasks = sorted(tasks.values(), key=lambda task: -len(task[2]))
+        if workers == 1 or len(tasks) == 1:
+            results = [await loop.run_in_executor(None, _pairSection, task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(min(workers or os.cpu_count(), len(tasks))) as executor:
+                results = await asyncio.gather(*[loop.run_in_executor(executor, _pairSection, task)
+                                                 for task in tasks])
+
+        rounds = {}
+        for tournament, pairings, seconds in results:
+            if timings is not None:
+                timings[tournament] = seconds
+            pairings = [(id1, names[id1], id2, names.get(id2)) for (id1, name1, id2, name2) in pairings]
+            rounds[tournament] = (current_rounds.get(tournament, 0) + 1, pairings)
+        await db.cursor.execute(queries.START_ROUNDS, (list(rounds), [round_no for round_no, _ in rounds.values()]))
+        boards = [(tournament, round_no, board, id1, id2)
+                  for tournament, (round_no, pairings) in rounds.items()
+                  for board, (id1, name1, id2, name2) in enumerate(pairings, 1)]
+        await db.cursor.execute(queries.START_ROUND_PAIRINGS, [list(column) for column in zip(*boards)])
+        byes = [(pairings[-1][0], tournament, round_no)
+                for tournament, (round_no, pairings) in rounds.items() if pairings[-1][2] is None]
+        if byes:
+            await db.cursor.execute(queries.REPORT_BYES, [list(column) for column in zip(*byes)])
+    return rounds
+
+async def rateRound(tournament, round_no=None, session=None):
+    """
+    Applies the results of a finished round to the players' ratings, as
+    tournament.rateRound does, and returns their new ratings by player id.
+    recomputeRatings has no asyncio version, as aiopg cannot COPY.
+    """
+    tournament = _id(tournament)
+    async with _borrow(session) as db:
+        await db.cursor.execute(queries.LOCK_ROUND, (tournament, _optionalId(round_no), tournament))
+        row = await db.cursor.fetchone()
+        if row is None:
+            raise ValueError("Unknown Round")
+        round_no, rated = row
+        if rated:
+            raise ValueError("Round Already Rated")
+        if any(pair[5] is None for pair in await roundPairings(tournament, round_no, session=db)):
+            raise ValueError("Round Not Finished")
+        await db.cursor.execute(queries.ROUND_RESULTS, (tournament, round_no, round_no))
+        results = await db.cursor.fetchall()
+        # NumPy is only needed for ratings
+        import ratings
+        new_ratings = ratings.rateResults(results, RATING_K_FACTOR)
+        if new_ratings:
+            await db.cursor.execute(queries.UPDATE_RATINGS, (list(new_ratings), list(new_ratings.values())))
+        await db.cursor.execute(queries.MARK_RATED, (tournament, round_no))
+    return new_ratings
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+#
+# tournament_aio_bench.py -- load test for tournament_aio.py
+#
+# Kept apart from tournament_bench.py, which has to stay importable on
+# Python 2; run it with "python3 tournament_bench.py aio".
+
+import asyncio
+import random
+import time
+
+import tournament_aio
+
+
+async def worker(tournament_id, players, deadline, counts):
+    """Reports a match and reads the standings until the deadline."""
+    while time.time() < deadline:
+        winner, loser = random.sample(players, 2)
+        await tournament_aio.reportMatch(winner, loser, tournament_id)
+        await tournament_aio.playerStandings(tournament_id)
+        counts[0] += 2
+
+async def loadTest(args):
+    """Measures report/standings throughput of concurrent tasks in one process."""
+    await tournament_aio.configurePool(args.dbname, max_size=args.concurrency)
+    tournament_id = await tournament_aio.createTournament("Load test")
+    players = await tournament_aio.registerPlayers("Player %d" % i for i in range(args.players))
+    await tournament_aio.addPlayersToTournament(players, tournament_id)
+    for concurrency in sorted(set([1, args.concurrency])):
+        counts = [0]
+        start = time.time()
+        deadline = start + args.seconds
+        await asyncio.gather(*[worker(tournament_id, players, deadline, counts)
+                               for _ in range(concurrency)])
+        print("{0:>4} concurrent tasks: {1:8.1f} calls/s".format(
+            concurrency, counts[0] / (time.time() - start)))
+    await tournament_aio.closePool()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+#
+# Test cases for tournament_aio.py
+
+import asyncio
+
+import tournament_aio as aio
+
+
+async def testAioStandings():
+    await aio.deleteMatches()
+    await aio.deletePlayers()
+    await aio.deleteTournaments()
+    tournament1 = await aio.createTournament("t1")
+    [p1, p2, p3, p4] = await aio.registerPlayers(["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie"])
+    await aio.addPlayersToTournament([p1, p2, p3, p4], tournament1)
+    if await aio.countPlayers(tournament1) != 4:
+        raise ValueError("After adding four players, countPlayers should return 4.")
+    await asyncio.gather(aio.reportMatch(p1, p2, tournament1), aio.reportMatch(p3, p4, tournament1))
+    standings = await aio.playerStandings(tournament1)
+    if [(row[0], row[2], row[3]) for row in standings] != [(p1, 1, 1), (p3, 1, 1), (p2, 0, 1), (p4, 0, 1)]:
+        raise ValueError("Concurrently reported matches should all be in the standings.")
+    print("1. Coroutines register players, report matches and return standings.")
+
+    pairings = await aio.swissPairings(tournament1)
+    if set(frozenset((id1, id2)) for (id1, name1, id2, name2) in pairings) != \
+            set([frozenset((p1, p3)), frozenset((p2, p4))]):
+        raise ValueError("After one round, winners should be paired with winners and losers with losers.")
+    try:
+        await aio.reportMatches([(p1, p3), (p1, p2)], tournament1)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("reportMatches should reject a player in two matches.")
+    match_ids = await aio.reportMatches([(p1, p3), (p4, p2)], tournament1)
+    if len(match_ids) != 2 or len(await aio.getPlayedMatches(tournament1)) != 4:
+        raise ValueError("reportMatches should record a whole round.")
+    print("2. swissPairings and reportMatches work from coroutines.")
+
+    (round_no, pairings) = await aio.startRound(tournament1)
+    if round_no != 1 or [pair[4] for pair in await aio.roundPairings(tournament1)] != [None, None]:
+        raise ValueError("startRound should store the round's pairings as pending.")
+    await aio.reportMatches([(id1, id2) for (id1, name1, id2, name2) in pairings], tournament1)
+    if await aio.standingsAsOf(tournament1, 1) != await aio.playerStandings(tournament1):
+        raise ValueError("The standings as of the current round should be the live standings.")
+    print("3. Rounds are started, paired and read from coroutines.")
+
+
+async def testAioSessions():
+    await aio.deleteMatches()
+    await aio.deletePlayers()
+    try:
+        async with aio.Session() as session:
+            await aio.registerPlayer("Chandra Nalaar", session=session)
+            raise RuntimeError("abort")
+    except RuntimeError:
+        pass
+    if await aio.countPlayers() != 0:
+        raise ValueError("A session that fails should roll back its work.")
+    async with aio.Session() as session:
+        await aio.registerPlayer("Chandra Nalaar", session=session)
+        await aio.registerPlayer("Markov Chaney", session=session)
+    if await aio.countPlayers() != 2:
+        raise ValueError("A session that succeeds should commit its work.")
+    print("4. Sessions commit or roll back as one transaction.")
+
+
+async def testAioPairAll():
+    await aio.deleteMatches()
+    await aio.deletePlayers()
+    await aio.deleteTournaments()
+    sections = [await aio.createTournament("Section %d" % i) for i in range(3)]
+    for (section, size) in zip(sections, (6, 5, 4)):
+        await aio.addPlayersToTournament(await aio.registerPlayers("Player %d" % i for i in range(size)), section)
+    timings = {}
+    rounds = await aio.pairAll(sections, workers=2, timings=timings)
+    if sorted(timings) != sorted(sections) or [rounds[section][0] for section in sections] != [1, 1, 1]:
+        raise ValueError("pairAll should start a round in every section and time each one.")
+    for section in sections:
+        if [pair[:4] for pair in await aio.roundPairings(section)] != rounds[section][1]:
+            raise ValueError("pairAll should store the pairings of every section.")
+    if (await aio.roundPairings(sections[1]))[-1][5] != "bye":
+        raise ValueError("pairAll should report the bye of a section with an odd number of players.")
+    print("5. pairAll starts the rounds of many sections from a coroutine.")
+
+    for section in sections:
+        await aio.reportMatches([(id1, id2) for (id1, name1, id2, name2) in rounds[section][1] if id2 is not None],
+                                section)
+        if await aio.swissPairings(section, server_side=True) != await aio.swissPairings(section):
+            raise ValueError("Pairing from pairing_candidates() should match pairing from the pairing state.")
+    print("6. swissPairings pairs from the pairing_candidates() function from a coroutine.")
+
+
+async def testAioArchive():
+    await aio.deletePlayers()
+    await aio.deleteTournaments()
+    tournament1 = await aio.createTournament("t1")
+    tournament2 = await aio.createTournament("t2")
+    players = await aio.registerPlayers(["Player 1", "Player 2"])
+    for tournament in (tournament1, tournament2):
+        await aio.addPlayersToTournament(players, tournament)
+        await aio.reportMatches([tuple(players)], tournament)
+    async with aio.Session() as session:
+        archive = await aio.archiveTournament(tournament1, session=session)
+        await session.cursor.execute("SELECT count(*) FROM {0}".format(archive))
+        archived = (await session.cursor.fetchone())[0]
+        await session.cursor.execute("DROP TABLE {0}".format(archive))
+    if tournament1 != 1 or archived != 1 or len(await aio.getPlayedMatches(tournament2)) != 1:
+        raise ValueError("archiveTournament should detach only the archived tournament's matches.")
+    print("7. Resets truncate and archiveTournament detaches a partition from a coroutine.")
+
+
+async def testAioRatings():
+    await aio.deletePlayers()
+    await aio.deleteTournaments()
+    tournament1 = await aio.createTournament("t1")
+    players = await aio.registerPlayers(["Player %d" % i for i in range(4)])
+    await aio.addPlayersToTournament(players, tournament1)
+    round_no, pairings = await aio.startRound(tournament1)
+    await aio.reportMatches([(id1, id2) for (id1, name1, id2, name2) in pairings], tournament1)
+    ratings = await aio.rateRound(tournament1)
+    if sorted(ratings.values()) != [1484, 1484, 1516, 1516]:
+        raise ValueError("rateRound should rate the round's results from a coroutine.")
+    if await aio.swissPairings(tournament1) != await aio.swissPairings(tournament1, server_side=True):
+        raise ValueError("Pairing by rating should be the same from pairing_candidates().")
+    print("8. rateRound rates a round and swissPairings pairs by rating from a coroutine.")
+
+
+async def testAioCareers():
+    await aio.deletePlayers()
+    await aio.deleteTournaments()
+    tournament1 = await aio.createTournament("t1")
+    tournament2 = await aio.createTournament("t2")
+    player1, player2 = await aio.registerPlayers(["Player 1", "Player 2"])
+    for tournament in (tournament1, tournament2):
+        await aio.addPlayersToTournament([player1, player2], tournament)
+        await aio.reportMatch(player2, player1, tournament, draw=tournament == tournament2)
+    if await aio.playerCareer(player2) != (player2, "Player 2", 2, 1, 1, 0, 2, 1.5, 0.75) or \
+            await aio.headToHead(player2, player1) != (1, 1, 0):
+        raise ValueError("playerCareer and headToHead should add up both tournaments from a coroutine.")
+    print("9. playerCareer and headToHead read careers from a coroutine.")
+
+
+async def main():
+    await aio.configurePool(max_size=4)
+    try:
+        await testAioStandings()
+        await testAioSessions()
+        await testAioPairAll()
+        await testAioArchive()
+        await testAioRatings()
+        await testAioCareers()
+    finally:
+        await aio.closePool()
+    print("Success!  All tests pass!")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,531 @@
+#!/usr/bin/env python
+#
+# tournament_bench.py -- benchmarks for the tournament module
+#
+# Run "python tournament_bench.py --help" to list the benchmarks. They use the
+# same database as tournament.py, so run them against a throwaway copy.
+
+from __future__ import print_function
+
+import argparse
+import random
+import subprocess
+import sys
+import time
+
+import instrumentation
+import pairing
+import tiebreaks
+import tournament
+import tournament_io
+from tournament_state import TournamentState
+
+
+def timeCalls(function, calls):
+    """Calls function repeatedly and returns the sorted per-call times in ms."""
+    timings = []
+    for _ in range(calls):
+        start = time.time()
+        function()
+        timings.append((time.time() - start) * 1000.0)
+    timings.sort()
+    return timings
+
+def printTimings(label, timings):
+    """Prints the mean and median of a list of sorted per-call times."""
+    mean = sum(timings) / len(timings)
+    median = timings[len(timings) // 2]
+    print("{0:<24} mean {1:8.3f} ms   median {2:8.3f} ms".format(label, mean, median))
+
+
+def benchPool(args):
+    """Compares per-call latency of a fresh connect() against the pool."""
+    tournament.configurePool(args.dbname)
+
+    def fresh():
+        # What every function in tournament.py did before the pool existed.
+        db, cursor = tournament.connect(args.dbname)
+        cursor.execute("SELECT COUNT(*) FROM players")
+        cursor.fetchone()
+        db.close()
+
+    def pooled():
+        tournament.countPlayers()
+
+    printTimings("connect() per call", timeCalls(fresh, args.calls))
+    printTimings("pooled session", timeCalls(pooled, args.calls))
+
+
+def benchPairing(args):
+    """Times greedy and optimal pairing of synthetic rounds, without a database."""
+    players = [(i, "Player %d" % i) for i in range(args.players)]
+    wins = [0] * args.players
+    played = set()
+    for round_number in range(1, args.rounds + 1):
+        order = sorted(range(args.players), key=lambda i: -wins[i])
+        standings = [players[i] for i in order]
+        start = time.time()
+        pairing.pairPlayers(standings, played)
+        greedy_time = time.time() - start
+        stats = {}
+        pairs = pairing.optimalPairing(standings, [wins[i] for i in order], played, stats=stats)
+        print("round {0:>2}: greedy {1:7.3f} s   optimal {2:7.3f} s ({3} candidate pairs)".format(
+            round_number, greedy_time, stats['solve_time'], stats['edges']))
+        for (id1, name1, id2, name2) in pairs:
+            played.add(frozenset((id1, id2)))
+            wins[random.choice((id1, id2))] += 1
+
+
+def benchBulk(args):
+    """Compares reporting a round one match at a time against in one batch."""
+    tournament.configurePool(args.dbname)
+    tournament_id = tournament.createTournament("Bulk benchmark")
+    players = tournament.registerPlayers("Player %d" % i for i in range(2 * args.boards))
+    tournament.addPlayersToTournament(players, tournament_id)
+    results = list(zip(players[0::2], players[1::2]))
+
+    start = time.time()
+    for (winner, loser) in results:
+        tournament.reportMatch(winner, loser, tournament_id)
+    single = time.time() - start
+    tournament.deleteMatches(tournament_id)
+
+    start = time.time()
+    tournament.reportMatches(results, tournament_id)
+    bulk = time.time() - start
+    print("{0} boards: reportMatch {1:.3f} s   reportMatches {2:.3f} s".format(args.boards, single, bulk))
+
+
+def benchCache(args):
+    """Compares polling standings and pairings with and without the cache."""
+    tournament.configurePool(args.dbname)
+    tournament_id = tournament.createTournament("Cache benchmark")
+    players = tournament.registerPlayers("Player %d" % i for i in range(args.players))
+    tournament.addPlayersToTournament(players, tournament_id)
+    tournament.reportMatches(zip(players[0::2], players[1::2]), tournament_id)
+
+    def poll():
+        tournament.playerStandings(tournament_id)
+        tournament.swissPairings(tournament_id)
+
+    printTimings("uncached poll", timeCalls(poll, args.calls))
+    tournament.configureCache(dbname=args.dbname)
+    printTimings("cached poll", timeCalls(poll, args.calls))
+    print(tournament.getCacheStats())
+    tournament.configureCache(0)
+
+
+def importTime(module, runs=5):
+    """Returns the fastest of several timed imports of module, in a fresh interpreter each, in ms."""
+    script = "import time; start = time.time(); import {0}; print(time.time() - start)".format(module)
+    return min(float(subprocess.check_output([sys.executable, "-c", script])) * 1000.0
+               for _ in range(runs))
+
+
+def benchValidation(args):
+    """Compares id validation against bleach.clean, and times reportMatch and imports."""
+    tournament.configurePool(args.dbname)
+    tournament_id = tournament.createTournament("Validation benchmark")
+    players = tournament.registerPlayers("Player %d" % i for i in range(2 * args.boards))
+    tournament.addPlayersToTournament(players, tournament_id)
+    winner, loser = players[0], players[1]
+    printTimings("_id() x3", timeCalls(
+        lambda: (tournament._id(winner), tournament._id(loser), tournament._id(tournament_id)), args.calls))
+    printTimings("reportMatch", timeCalls(
+        lambda: tournament.reportMatch(winner, loser, tournament_id), args.calls))
+    try:
+        import bleach
+    except ImportError:
+        print("bleach is not installed; skipping the bleach.clean() comparison")
+    else:
+        # What reportMatch did with its arguments before. Newer bleach
+        # releases only take text, so the ids are passed as strings.
+        def cleaned():
+            return (bleach.clean(str(winner)), bleach.clean(str(loser)), bleach.clean(str(tournament_id)))
+
+        printTimings("bleach.clean() x3", timeCalls(cleaned, args.calls))
+        printTimings("reportMatch + bleach", timeCalls(
+            lambda: tournament.reportMatch(*cleaned()), args.calls))
+        print("import bleach             {0:8.3f} ms".format(importTime("bleach")))
+    print("import tournament         {0:8.3f} ms".format(importTime("tournament")))
+
+
+def benchInstrumentation(args):
+    """Compares the per-call cost of countPlayers with instrumentation off and on."""
+    tournament.configurePool(args.dbname)
+    tournament_id = tournament.createTournament("Instrumentation benchmark")
+
+    def call():
+        tournament.countPlayers(tournament_id)
+
+    printTimings("disabled", timeCalls(call, args.calls))
+    histogram = instrumentation.Histogram()
+    instrumentation.enable(histogram)
+    printTimings("histogram sink", timeCalls(call, args.calls))
+    instrumentation.disable()
+    for name, seconds, count in histogram.top('query', 3):
+        print("{0:8.3f} ms in {1} calls: {2}".format(seconds * 1000.0, count, name))
+
+
+def benchSimulate(args):
+    """Plays a whole event in memory with random results."""
+    start = time.time()
+    state = TournamentState.createTournament("Simulation")
+    for player_id in range(1, args.players + 1):
+        state.addPlayerToTournament(player_id, "Player %d" % player_id)
+    for round_number in range(1, args.rounds + 1):
+        for (id1, name1, id2, name2) in state.swissPairings():
+            if random.random() < 0.5:
+                id1, id2 = id2, id1
+            state.reportMatch(id1, id2)
+    print("{0} players, {1} rounds in memory: {2:.3f} s".format(
+        args.players, args.rounds, time.time() - start))
+
+
+def benchTiebreaks(args):
+    """Times the tiebreak computation on an event played in memory."""
+    state = TournamentState.createTournament("Tiebreaks")
+    for player_id in range(1, args.players + 1):
+        state.addPlayerToTournament(player_id, "Player %d" % player_id)
+    matches = []
+    for round_number in range(1, args.rounds + 1):
+        for (id1, name1, id2, name2) in state.swissPairings():
+            if random.random() < 0.5:
+                id1, id2 = id2, id1
+            state.reportMatch(id1, id2)
+            matches.append((id1, id2, False))
+    standings = state.playerStandings(points=True)
+    timings = timeCalls(lambda: tiebreaks.computeTiebreaks(standings, matches, tiebreaks.TIEBREAKS,
+                                                          [row[4] for row in standings]), 10)
+    printTimings("{0}x{1} tiebreaks".format(args.players, args.rounds), timings)
+
+
+def benchImport(args):
+    """Times importing a whole event with importTournament, and exporting it again."""
+    tournament.configurePool(args.dbname)
+    players = args.players - args.players % 2
+
+    def matches():
+        # Random pairings and results, made as they are read
+        order = list(range(players))
+        for round_number in range(1, args.rounds + 1):
+            random.shuffle(order)
+            for i in range(0, players, 2):
+                yield (order[i], order[i + 1], "win", round_number)
+
+    start = time.time()
+    tournament_id, player_ids = tournament_io.importTournament(
+        "Import benchmark", ((i, "Player %d" % i) for i in range(players)), matches())
+    imported = time.time() - start
+    print("import {0} players, {1} matches: {2:.3f} s".format(players, players // 2 * args.rounds, imported))
+    for what, export in (("standings", tournament_io.exportStandings), ("matches", tournament_io.exportMatches)):
+        for format in tournament_io.FORMATS:
+            start = time.time()
+            size = sum(len(line) for line in export(tournament_id, format))
+            print("export {0} as {1}: {2:.3f} s, {3} characters".format(what, format, time.time() - start, size))
+
+
+def benchSections(args):
+    """Compares starting the rounds of many sections one by one against pairAll()."""
+    tournament.configurePool(args.dbname)
+    one_by_one, together = [], []
+    for sections in (one_by_one, together):
+        for i in range(args.sections):
+            section = tournament.createTournament("Section {0}".format(i))
+            players = tournament.registerPlayers("Player %d" % j for j in range(args.players))
+            tournament.addPlayersToTournament(players, section)
+            sections.append(section)
+
+    def play(section, pairings):
+        tournament.reportMatches([(id1, id2) if random.random() < 0.5 else (id2, id1)
+                                  for (id1, name1, id2, name2) in pairings if id2 is not None], section)
+
+    for round_number in range(1, args.rounds + 1):
+        start = time.time()
+        for section in one_by_one:
+            play(section, tournament.startRound(section, mode=args.mode)[1])
+        sequential = time.time() - start
+        start = time.time()
+        timings = {}
+        rounds = tournament.pairAll(together, mode=args.mode, workers=args.workers, timings=timings)
+        paired = time.time() - start
+        for section in together:
+            play(section, rounds[section][1])
+        print("round {0:>2}: startRound each {1:8.3f} s   pairAll {2:8.3f} s   "
+              "slowest section {3:.3f} s, all sections {4:.3f} s".format(
+                  round_number, sequential, paired, max(timings.values()), sum(timings.values())))
+
+
+def benchCandidates(args):
+    """Compares swissPairings from the pairing state against pairing from pairing_candidates()."""
+    tournament.configurePool(args.dbname)
+    for size in args.sizes:
+        tournament_id = tournament.createTournament("Candidates benchmark {0}".format(size))
+        tournament.addPlayersToTournament(tournament.registerPlayers("Player %d" % i for i in range(size)),
+                                          tournament_id)
+        client, server = [], []
+        for round_number in range(args.rounds):
+            start = time.time()
+            pairings = tournament.swissPairings(tournament_id, mode=args.mode)
+            client.append((time.time() - start) * 1000.0)
+            start = time.time()
+            tournament.swissPairings(tournament_id, mode=args.mode, server_side=True)
+            server.append((time.time() - start) * 1000.0)
+            if pairings[-1][2] is None:
+                tournament.reportBye(pairings[-1][0], tournament_id)
+            tournament.reportMatches([(id1, id2) if random.random() < 0.5 else (id2, id1)
+                                      for (id1, name1, id2, name2) in pairings if id2 is not None], tournament_id)
+        printTimings("{0} client side".format(size), sorted(client))
+        printTimings("{0} server side".format(size), sorted(server))
+
+
+def benchStatements(args):
+    """Compares the hot queries sent as text against executed as prepared statements, per tournament size."""
+    tournament.configurePool(args.dbname)
+    tournament.deleteTournaments()
+    tournament.deletePlayers()
+    for size in args.sizes:
+        tournament_id = tournament.createTournament("Statements benchmark {0}".format(size))
+        players = tournament.registerPlayers("Player %d" % i for i in range(size - size % 2))
+        tournament.addPlayersToTournament(players, tournament_id)
+        for round_number in range(args.rounds):
+            random.shuffle(players)
+            tournament.reportMatches(list(zip(players[0::2], players[1::2])), tournament_id)
+        # getPlayedMatches is sent as text either way, and measures the noise between the two runs
+        calls = (("countPlayers", lambda session: tournament.countPlayers(tournament_id, session=session)),
+                 ("getPlayedMatches", lambda session: tournament.getPlayedMatches(tournament_id, session=session)),
+                 ("playerStandings", lambda session: tournament.playerStandings(tournament_id, session=session)),
+                 ("reportMatch", lambda session: tournament.reportMatch(players[0], players[1], tournament_id,
+                                                                         session=session)))
+        print("{0} players, {1} matches:".format(len(players), len(players) // 2 * args.rounds))
+        for (name, call) in calls:
+            print("  " + name)
+            for prepare in (False, True):
+                tournament.configureStatements(prepare)
+                # Writes are rolled back, so every size keeps its matches
+                with tournament.Session() as session:
+                    call(session)
+                    timings = timeCalls(lambda: call(session), args.calls)
+                    session.rollback()
+                    stats = tournament.getStatementStats(session)
+                printTimings("    prepared" if prepare else "    as text", timings)
+                for statement in sorted(stats):
+                    print("      {0}: {1[hits]} of {1[executes]} executions already prepared, {1[generic_plans]} "
+                          "generic and {1[custom_plans]} custom plans on the connection".format(statement,
+                                                                                                stats[statement]))
+                # The rolled back writes leave dead rows behind, which would slow down the next measurement
+                db, cursor = tournament.connect(args.dbname)
+                db.autocommit = True
+                cursor.execute("VACUUM matches, standings")
+                db.close()
+    tournament.configureStatements()
+    tournament.deleteTournaments()
+    tournament.deletePlayers()
+
+
+def benchReset(args):
+    """Compares archiving and resetting against deleting row by row, on imported sections."""
+    tournament.configurePool(args.dbname)
+    players = args.players - args.players % 2
+
+    def matches():
+        order = list(range(players))
+        for round_number in range(1, args.rounds + 1):
+            random.shuffle(order)
+            for i in range(0, players, 2):
+                yield (order[i], order[i + 1], "win", round_number)
+
+    start = time.time()
+    sections = [tournament_io.importTournament("Section {0}".format(i), ((j, "Player %d" % j) for j in range(players)),
+                                               matches())[0]
+                for i in range(args.sections)]
+    print("imported {0} sections of {1} matches: {2:.3f} s".format(
+        args.sections, players // 2 * args.rounds, time.time() - start))
+
+    start = time.time()
+    with tournament.Session() as session:
+        session.cursor.execute("DELETE FROM tournaments WHERE tournament_id = %s", (sections.pop(),))
+    print("delete one section:      {0:8.3f} s".format(time.time() - start))
+    start = time.time()
+    with tournament.Session() as session:
+        archive = tournament.archiveTournament(sections.pop(), session=session)
+        session.cursor.execute("DROP TABLE {0}".format(archive))
+    print("archive one section:     {0:8.3f} s".format(time.time() - start))
+
+    # The old reset is rolled back, so that the new one has the same rows to remove
+    db, cursor = tournament.connect()
+    start = time.time()
+    cursor.execute("DELETE FROM tournaments")
+    cursor.execute("DELETE FROM players")
+    print("reset with DELETE:       {0:8.3f} s".format(time.time() - start))
+    db.rollback()
+    db.close()
+    start = time.time()
+    tournament.deleteTournaments()
+    tournament.deletePlayers()
+    print("reset with TRUNCATE:     {0:8.3f} s".format(time.time() - start))
+
+
+def benchRatings(args):
+    """Times replaying --matches results in memory, then rating and recomputing imported sections."""
+    # NumPy is only needed for ratings
+    import numpy as np
+    import ratings
+    players = args.players - args.players % 2
+    periods = max(1, args.matches // (players // 2))
+    generator = np.random.RandomState(0)
+    seats = np.concatenate([generator.permutation(players) for _ in range(periods)])
+    winners, losers = seats[0::2], seats[1::2]
+    draws = generator.random_sample(len(winners)) < 0.1
+    start = time.time()
+    ratings.replayRatings(np.full(players, float(tournament.INITIAL_RATING)), winners, losers, draws,
+                          np.repeat(np.arange(periods), players // 2), tournament.RATING_K_FACTOR)
+    print("replay {0} matches in {1} periods: {2:.3f} s".format(len(winners), periods, time.time() - start))
+
+    tournament.configurePool(args.dbname)
+    tournament.deleteTournaments()
+    tournament.deletePlayers()
+
+    def matches():
+        order = list(range(players))
+        for round_number in range(1, args.rounds + 1):
+            random.shuffle(order)
+            for i in range(0, players, 2):
+                yield (order[i], order[i + 1], "win", round_number)
+
+    sections = [tournament_io.importTournament("Section {0}".format(i), ((j, "Player %d" % j) for j in range(players)),
+                                               matches())[0]
+                for i in range(args.sections)]
+    start = time.time()
+    for round_number in range(1, args.rounds + 1):
+        tournament.rateRound(sections[0], round_number)
+    print("rateRound, {0} rounds of {1} matches: {2:8.3f} ms per round".format(
+        args.rounds, players // 2, (time.time() - start) * 1000.0 / args.rounds))
+    start = time.time()
+    replayed = tournament.recomputeRatings()
+    print("recomputeRatings, {0} matches: {1:.3f} s".format(replayed, time.time() - start))
+    tournament.deleteTournaments()
+    tournament.deletePlayers()
+
+
+def benchOutcomes(args):
+    """Times simulateOutcomes on an event of --players players with --rounds rounds still to play."""
+    tournament.configurePool(args.dbname)
+    tournament.deleteTournaments()
+    tournament.deletePlayers()
+    section = tournament.createTournament("Outcomes")
+    players = tournament.registerPlayers("Player %d" % i for i in range(args.players))
+    tournament.addPlayersToTournament(players, section)
+    for round_number in range(args.played):
+        round_no, pairings = tournament.startRound(section)
+        tournament.reportMatches([(id1, id2) if random.random() < 0.5 else (id2, id1)
+                                  for (id1, name1, id2, name2) in pairings if id2 is not None], section)
+        tournament.rateRound(section)
+    for workers in (1, args.workers):
+        start = time.time()
+        tournament.simulateOutcomes(section, args.rounds, trials=args.trials, top=(1, 10), workers=workers)
+        print("{0} trials, {1} players, {2} rounds, {3} workers: {4:.3f} s".format(
+            args.trials, args.players, args.rounds, workers or "all", time.time() - start))
+    tournament.deleteTournaments()
+    tournament.deletePlayers()
+
+
+def benchCareers(args):
+    """Compares playerCareer and headToHead against scanning the matches, as histories grow."""
+    scan_career_query = """
+    SELECT COUNT(*), COUNT(*) FILTER (WHERE result <> 'draw' AND winner_id = %s)
+    FROM matches WHERE winner_id = %s OR loser_id = %s
+    """
+    scan_head_to_head_query = """
+    SELECT COUNT(*) FILTER (WHERE result = 'win' AND winner_id = %s), COUNT(*) FILTER (WHERE result = 'draw'),
+           COUNT(*) FILTER (WHERE result = 'win' AND winner_id = %s)
+    FROM matches WHERE (winner_id = %s AND loser_id = %s) OR (winner_id = %s AND loser_id = %s)
+    """
+    tournament.configurePool(args.dbname)
+    tournament.deleteTournaments()
+    tournament.deletePlayers()
+    players = tournament.registerPlayers("Player %d" % i for i in range(args.players - args.players % 2))
+    player1, player2 = players[0], players[1]
+    for section_number in range(args.sections):
+        section = tournament.createTournament("Section {0}".format(section_number))
+        tournament.addPlayersToTournament(players, section)
+        start = time.time()
+        for round_number in range(args.rounds):
+            # The two players timed meet every round, and the rest are paired at random
+            order = players[2:]
+            random.shuffle(order)
+            order[:0] = [player1, player2]
+            tournament.reportMatches(list(zip(order[0::2], order[1::2])), section)
+        reported = time.time() - start
+        with tournament.Session() as session:
+            scanned = timeCalls(lambda: session.cursor.execute(scan_career_query, (player1,) * 3), args.calls)
+            paired = timeCalls(lambda: session.cursor.execute(scan_head_to_head_query,
+                                                              (player1, player2) * 3), args.calls)
+            career = timeCalls(lambda: tournament.playerCareer(player1, session=session), args.calls)
+            head_to_head = timeCalls(lambda: tournament.headToHead(player1, player2, session=session), args.calls)
+        print("{0} events, reporting {1:.3f} s:".format(section_number + 1, reported))
+        printTimings("  scan career", scanned)
+        printTimings("  playerCareer", career)
+        printTimings("  scan head to head", paired)
+        printTimings("  headToHead", head_to_head)
+    tournament.deleteTournaments()
+    tournament.deletePlayers()
+
+
+def benchAio(args):
+    """Measures report/standings throughput of tournament_aio from one process."""
+    # tournament_aio needs Python 3, so only this benchmark imports it
+    import asyncio
+    import tournament_aio_bench
+    asyncio.run(tournament_aio_bench.loadTest(args))
+
+
+BENCHMARKS = {
+    'pool': benchPool,
+    'pairing': benchPairing,
+    'bulk': benchBulk,
+    'cache': benchCache,
+    'instrumentation': benchInstrumentation,
+    'simulate': benchSimulate,
+    'tiebreaks': benchTiebreaks,
+    'validation': benchValidation,
+    'aio': benchAio,
+    'import': benchImport,
+    'sections': benchSections,
+    'candidates': benchCandidates,
+    'reset': benchReset,
+    'ratings': benchRatings,
+    'outcomes': benchOutcomes,
+    'careers': benchCareers,
+    'statements': benchStatements,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for tournament.py")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--dbname', default=tournament.DBNAME)
+    parser.add_argument('--calls', type=int, default=500,
+                        help="number of timed calls per measurement")
+    parser.add_argument('--players', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=9)
+    parser.add_argument('--boards', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=32,
+                        help="concurrent tasks for the aio benchmark")
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--matches', type=int, default=10000000,
+                        help="results replayed in memory by the ratings benchmark")
+    parser.add_argument('--trials', type=int, default=10000, help="trials run by the outcomes benchmark")
+    parser.add_argument('--played', type=int, default=5,
+                        help="rounds played before the outcomes benchmark simulates the rest")
+    parser.add_argument('--sections', type=int, default=24,
+                        help="tournaments paired at once by the sections benchmark")
+    parser.add_argument('--workers', type=int, help="pairing processes for pairAll; one per CPU by default")
+    parser.add_argument('--mode', choices=("greedy", "optimal"), default="greedy")
+    parser.add_argument('--sizes', default="1000,50000", type=lambda sizes: [int(size) for size in sizes.split(",")],
+                        help="comma-separated numbers of players for the candidates and statements benchmarks")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
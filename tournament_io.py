@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+#
+# tournament_io.py -- bulk import and export of tournaments
+#
+# importTournament streams players and matches into the database with COPY,
+# so migrating an event from other pairing software is a handful of
+# statements rather than one call per row. exportStandings and exportMatches
+# stream a tournament back out as CSV or NDJSON lines. From the command line:
+#
+#   python tournament_io.py import "Spring Open" players.csv matches.csv
+#   python tournament_io.py export 12 matches --format ndjson > matches.ndjson
+
+from __future__ import print_function
+
+import argparse
+import csv
+import io
+import json
+import sys
+
+import instrumentation
+import tournament
+
+FORMATS = ("csv", "ndjson")
+
+# Fields of each exported record, and the ones read back on import
+STANDINGS_FIELDS = ("id", "name", "wins", "matches", "points")
+MATCHES_FIELDS = ("match_id", "round_no", "winner_id", "loser_id", "result")
+
+# Characters that make a CSV field need quoting
+_CSV_SPECIAL = frozenset(',"\r\n')
+
+
+def _csvField(value):
+    if value is None:
+        return ''
+    if not isinstance(value, tournament._string_types):
+        return str(value)
+    if _CSV_SPECIAL.intersection(value):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+def _csvLine(values):
+    """Returns a row as a line of CSV, with None as an empty unquoted field, which COPY reads as NULL."""
+    return ','.join(_csvField(value) for value in values) + '\n'
+
+
+class _CopyStream(object):
+    """A file-like object for COPY FROM STDIN that turns rows into CSV as it is read.
+
+    Only one read's worth of rows is held at a time, so rows can come from a
+    generator of any length.
+    """
+
+    def __init__(self, rows):
+        self._lines = (_csvLine(row) for row in rows)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        for line in self._lines:
+            chunks.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        data = ''.join(chunks)
+        if size >= 0:
+            data, self._buffer = data[:size], data[size:]
+        else:
+            self._buffer = ''
+        if not isinstance(data, str):
+            # Python 2, with unicode names
+            data = data.encode('utf-8')
+        return data
+
+
+@instrumentation.timed
+def importTournament(name, players, matches=(), session=None):
+    """Creates a tournament from another program's players and results.
+
+    Players and matches are copied into temporary staging tables with COPY,
+    each as it is read, so memory use does not grow with their number. Every
+    player is then registered and added to the new tournament in one
+    statement, and every match reported in another, with the external ids
+    replaced by the new serial ids. The standings, careers and head-to-head
+    records are counted once all the matches are in rather than by the
+    triggers each statement fires. Matches with a round number also create
+    the tournament's rounds and the standings snapshots of every round but
+    the last, so standingsAsOf works as if the rounds had been played here.
+    Imported rounds have no stored pairings; roundPairings returns nothing
+    for them, and exportMatches has their results.
+
+    Args:
+      name: the name of the new tournament
+      players: an iterable of (external_id, name) tuples; external ids are
+        any strings or numbers, unique within the import
+      matches: an iterable of (winner, loser) tuples of external ids, with
+        an optional result ("win", "draw" or "bye", where loser is None) and
+        an optional round number
+      session: an optional Session to run the import in
+
+    Returns:
+      A (tournament_id, {external_id: player_id}) tuple, with external ids
+      as strings.
+
+    Raises:
+      ValueError: if a name is invalid, or a match names a player who was not
+        imported.
+    """
+    create_staging_query = """
+    DROP TABLE IF EXISTS import_players, import_matches;
+    CREATE TEMPORARY TABLE import_players(
+        external_id text primary key,
+        player_name text not null,
+        player_id int
+    ) ON COMMIT DROP;
+    CREATE TEMPORARY TABLE import_matches(
+        line serial primary key,
+        winner text not null,
+        loser text,
+        result match_result not null default 'win',
+        round_no int
+    ) ON COMMIT DROP;
+    """
+    copy_players_query = "COPY import_players(external_id, player_name) FROM STDIN WITH (FORMAT csv)"
+    copy_matches_query = "COPY import_matches(winner, loser, result, round_no) FROM STDIN WITH (FORMAT csv)"
+    # The triggers counting standings, careers and head-to-head records one statement at a time are turned off while
+    # the players and matches go in, and the whole event is counted at once afterwards. SET LOCAL ends with the
+    # transaction, and is also turned back off before a caller's session goes on to report anything else.
+    start_import_query = "SET LOCAL tournament.importing = on"
+    end_import_query = "SET LOCAL tournament.importing = off"
+    count_import_query = "SELECT count_imported_tournament(%s)"
+    # Taking the ids from the sequence up front keeps the mapping from external ids
+    register_players_query = """
+    UPDATE import_players SET player_id = nextval(pg_get_serial_sequence('players', 'player_id'));
+    INSERT INTO players(player_id, player_name) SELECT player_id, player_name FROM import_players ORDER BY player_id;
+    INSERT INTO players_in_tournaments(player_id, tournament_id) SELECT player_id, %s FROM import_players;
+    """
+    # The new players' rows are not committed yet, so autovacuum cannot count them. Analyzed without them, the
+    # tournament looks empty to the planner, and counting a million imported matches then plans for a handful of
+    # players, as does the snapshot of every round.
+    analyze_members_query = "ANALYZE players_in_tournaments"
+    analyze_standings_query = "ANALYZE standings"
+    unknown_players_query = """
+    SELECT DISTINCT external_id FROM (SELECT winner AS external_id FROM import_matches
+                                      UNION ALL
+                                      SELECT loser FROM import_matches WHERE loser IS NOT NULL) AS named
+    WHERE NOT EXISTS (SELECT 1 FROM import_players WHERE import_players.external_id = named.external_id)
+    ORDER BY external_id LIMIT 10
+    """
+    create_rounds_query = """
+    INSERT INTO rounds(tournament_id, round_no)
+    SELECT %s, round_no FROM generate_series(1, (SELECT MAX(round_no) FROM import_matches)) AS round_no
+    """
+    report_matches_query = """
+    INSERT INTO matches(winner_id, loser_id, tournament_id, round_no, result)
+    SELECT winner.player_id, loser.player_id, %s, import_matches.round_no, import_matches.result
+    FROM import_matches
+    JOIN import_players AS winner ON winner.external_id = import_matches.winner
+    LEFT JOIN import_players AS loser ON loser.external_id = import_matches.loser
+    ORDER BY import_matches.line
+    """
+    # Running totals per player over the rounds, counting matches without a round before the first
+    snapshot_standings_query = """
+    INSERT INTO standings_snapshots(tournament_id, round_no, player_ids, wins, matches, points)
+    SELECT %s, round_no, array_agg(player_id ORDER BY points DESC, player_id),
+           array_agg(wins ORDER BY points DESC, player_id), array_agg(matches ORDER BY points DESC, player_id),
+           array_agg(points ORDER BY points DESC, player_id)
+    FROM (SELECT round_numbers.round_no, members.player_id,
+                 SUM(COALESCE(played.wins, 0)) OVER running AS wins,
+                 SUM(COALESCE(played.matches, 0)) OVER running AS matches,
+                 SUM(COALESCE(played.points, 0)) OVER running AS points
+          FROM standings AS members
+          CROSS JOIN generate_series(0, (SELECT MAX(round_no) FROM rounds WHERE tournament_id=(%s)) - 1)
+                AS round_numbers(round_no)
+          LEFT JOIN (SELECT player_id, round_no, SUM(won) AS wins, COUNT(*) AS matches, SUM(points) AS points
+                     FROM (SELECT winner_id AS player_id, COALESCE(round_no, 0) AS round_no,
+                                  CASE result WHEN 'draw' THEN 0 ELSE 1 END AS won,
+                                  CASE result WHEN 'draw' THEN 1 ELSE 2 END AS points
+                           FROM matches WHERE tournament_id=(%s)
+                           UNION ALL
+                           SELECT loser_id, COALESCE(round_no, 0), 0, CASE result WHEN 'draw' THEN 1 ELSE 0 END
+                           FROM matches WHERE tournament_id=(%s) AND result <> 'bye') AS sides
+                     GROUP BY player_id, round_no) AS played
+            ON played.player_id = members.player_id AND played.round_no = round_numbers.round_no
+          WHERE members.tournament_id=(%s)
+          WINDOW running AS (PARTITION BY members.player_id ORDER BY round_numbers.round_no)) AS totals
+    WHERE round_no > 0
+    GROUP BY round_no
+    """
+    player_ids_query = "SELECT external_id, player_id FROM import_players"
+
+    def playerRows():
+        for player in players:
+            yield (player[0], tournament._name(player[1]))
+
+    def matchRows():
+        for match in matches:
+            yield (match[0], match[1], match[2] if len(match) > 2 and match[2] else "win",
+                   tournament._optionalId(match[3]) if len(match) > 3 and match[3] != '' else None)
+
+    with tournament._borrow(session) as db:
+        tournament_id = tournament.createTournament(name, session=db)
+        db.cursor.execute(create_staging_query)
+        db.cursor.copy_expert(copy_players_query, _CopyStream(playerRows()))
+        db.cursor.copy_expert(copy_matches_query, _CopyStream(matchRows()))
+        db.cursor.execute(unknown_players_query)
+        unknown = [row[0] for row in db.cursor.fetchall()]
+        if unknown:
+            raise ValueError("Players Not In Import: {0}".format(unknown))
+        db.cursor.execute(start_import_query)
+        db.cursor.execute(register_players_query, (tournament_id,))
+        db.cursor.execute(create_rounds_query, (tournament_id,))
+        db.cursor.execute(report_matches_query, (tournament_id,))
+        reported = db.cursor.rowcount
+        db.cursor.execute(end_import_query)
+        db.cursor.execute(analyze_members_query)
+        db.cursor.execute(count_import_query, (tournament_id,))
+        db.cursor.execute(analyze_standings_query)
+        if reported:
+            db.cursor.execute(snapshot_standings_query, (tournament_id,) * 5)
+        db.cursor.execute(player_ids_query)
+        player_ids = dict(db.cursor.fetchall())
+    tournament._invalidate(tournament_id, session)
+    return tournament_id, player_ids
+
+
+def _records(query, parameters, fields, format, session):
+    """Yields the rows of a query as CSV or NDJSON lines, through a server-side cursor."""
+    if format not in FORMATS:
+        raise ValueError("Unknown Format")
+    with tournament._borrow(session, read=True) as db:
+        cursor = db.connection.cursor(name="tournament_export", cursor_factory=instrumentation.TimedCursor)
+        cursor.itersize = 5000
+        try:
+            cursor.execute(query, parameters)
+            if format == "csv":
+                yield _csvLine(fields)
+                for row in cursor:
+                    yield _csvLine(row)
+            else:
+                for row in cursor:
+                    yield json.dumps(dict(zip(fields, row)), sort_keys=True) + '\n'
+        finally:
+            cursor.close()
+
+def exportStandings(tournament_id, format="csv", session=None):
+    """
+    Yields a tournament's standings as lines of CSV, after a header, or of
+    NDJSON, one player per line, in standings order.
+    :param tournament_id:the id number of the tournament
+    :param format:"csv" or "ndjson"
+    :param session:an optional Session to read in; without one a connection is
+    held until the generator is finished or closed
+    """
+    standings_query = """
+    SELECT standings.player_id, players.player_name, standings.wins, standings.matches,
+           (standings.points / 2.0)::float8
+    FROM standings JOIN players ON players.player_id = standings.player_id
+    WHERE standings.tournament_id=(%s)
+    ORDER BY standings.points DESC, standings.player_id
+    """
+    return _records(standings_query, (tournament._id(tournament_id),), STANDINGS_FIELDS, format, session)
+
+def exportMatches(tournament_id, format="csv", session=None):
+    """
+    Yields a tournament's match history as lines of CSV, after a header, or
+    of NDJSON, one match per line, in the order reported. The output can be
+    imported again with importTournament, along with exportStandings.
+    :param tournament_id:the id number of the tournament
+    :param format:"csv" or "ndjson"
+    :param session:an optional Session to read in
+    """
+    matches_query = """
+    SELECT match_id, round_no, winner_id, loser_id, result::text FROM matches
+    WHERE tournament_id=(%s) ORDER BY match_id
+    """
+    return _records(matches_query, (tournament._id(tournament_id),), MATCHES_FIELDS, format, session)
+
+
+def readRecords(lines, format="csv"):
+    """Yields dicts from lines of CSV with a header, or of NDJSON, as they are read."""
+    if format not in FORMATS:
+        raise ValueError("Unknown Format")
+    if format == "csv":
+        for record in csv.DictReader(lines):
+            yield record
+    else:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+def _open(path):
+    return io.open(path, newline='') if sys.version_info[0] > 2 else open(path, 'rb')
+
+def main():
+    parser = argparse.ArgumentParser(description="Import and export tournaments")
+    commands = parser.add_subparsers(dest='command')
+    importing = commands.add_parser('import', help="create a tournament from players and matches files")
+    importing.add_argument('name')
+    importing.add_argument('players', help="a file with id and name fields, like exportStandings writes")
+    importing.add_argument('matches', nargs='?',
+                           help="a file with winner_id, loser_id and optional result and round_no fields")
+    exporting = commands.add_parser('export', help="write a tournament's standings or matches to stdout")
+    exporting.add_argument('tournament', type=int)
+    exporting.add_argument('what', choices=("standings", "matches"))
+    for command in (importing, exporting):
+        command.add_argument('--format', choices=FORMATS, default="csv")
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        with _open(args.players) as player_file:
+            players = ((record["id"], record["name"]) for record in readRecords(player_file, args.format))
+            if args.matches:
+                with _open(args.matches) as match_file:
+                    matches = ((record["winner_id"], record["loser_id"] or None, record.get("result"),
+                                record.get("round_no")) for record in readRecords(match_file, args.format))
+                    tournament_id, player_ids = importTournament(args.name, players, matches)
+            else:
+                tournament_id, player_ids = importTournament(args.name, players)
+        print("Imported {0} players as tournament {1}".format(len(player_ids), tournament_id))
+    else:
+        export = exportStandings if args.what == "standings" else exportMatches
+        for line in export(args.tournament, args.format):
+            sys.stdout.write(line)
+
+
+if __name__ == '__main__':
+    main()
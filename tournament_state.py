@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+#
+# tournament_state.py -- a Swiss-system tournament held in memory
+#
+
+from array import array
+
+import pairing
+import queries
+import tournament
+
+
+class TournamentState(object):
+    """A tournament held entirely in memory.
+
+    It offers the same operations as tournament.py without a database round
+    trip per call, for simulations and what-if pairings. A tournament can be
+    loaded from the database once, played for any number of rounds, and its
+    new players and results written back in one batch with flush().
+
+    Players are stored by index in flat arrays, and the standings are kept
+    in order as matches are reported instead of being sorted on every read:
+    order lists player indexes by points, most first, and above[p] counts the
+    players with more than p half-points, so a player going up from p
+    half-points just swaps places with the first player on p. A win moves a
+    player up two half-points, and a draw one.
+    """
+
+    def __init__(self, name=None, tournament_id=None):
+        self.name = name
+        self.tournament_id = tournament_id
+        self._ids = array('i')
+        self._names = []
+        self._wins = array('i')
+        self._matches = array('i')
+        # Half-points: 2 for a win or a bye, 1 for a draw
+        self._points = array('i')
+        self._byes = array('i')
+        # 1 if the player's latest match was against a player with more points, -1 if fewer
+        self._last_float = array('b')
+        # Ratings only change in the database, as rounds are rated
+        self._ratings = array('d')
+        self._index = {}
+        self._order = array('i')
+        self._position = array('i')
+        self._above = array('i', [0])
+        self._played = pairing.PlayedPairs()
+        # Players and results not yet written to the database, the results one
+        # list per round: a result naming a player who already has one in the
+        # latest round starts the next
+        self._new_players = []
+        self._new_rounds = [[]]
+        self._round_players = set()
+
+    @classmethod
+    def createTournament(cls, name):
+        """Create a new tournament that only exists in memory"""
+        return cls(name)
+
+    @classmethod
+    def load(cls, tournament_id, session=None):
+        """
+        Load a tournament's players, standings and played pairs from the pairing
+        state kept in the database, without reading its matches.
+        :param tournament_id:the id number of the tournament
+        :param session:an optional Session to run the query in
+        :return:a TournamentState for the tournament
+        """
+        records = tournament.getPairingState(tournament_id, session=session)
+        state = cls(tournament_id=tournament_id)
+        for (player_id, name, wins, matches, points, byes, opponents, last_float, rating) in records:
+            state._add(player_id, name, wins, matches, int(points * 2), byes, last_float, rating)
+            for opponent in opponents:
+                state._played.add(player_id, opponent)
+        return state
+
+    def _add(self, player_id, name, wins=0, matches=0, points=0, byes=0, last_float=0,
+             rating=tournament.INITIAL_RATING):
+        # Standings are loaded in order, so a new player always goes last.
+        index = len(self._ids)
+        self._index[player_id] = index
+        self._ids.append(player_id)
+        self._names.append(name)
+        self._wins.append(wins)
+        self._matches.append(matches)
+        self._points.append(points)
+        self._byes.append(byes)
+        self._last_float.append(last_float)
+        self._ratings.append(rating)
+        self._order.append(index)
+        self._position.append(index)
+        while len(self._above) <= points:
+            self._above.append(0)
+        for score in range(points):
+            self._above[score] += 1
+
+    def _score(self, index, points):
+        # Move a player up one half-point at a time: swap them with the first
+        # player on the same points, which becomes the last place among
+        # players on one more.
+        for _ in range(points):
+            score = self._points[index]
+            target = self._above[score]
+            other = self._order[target]
+            position = self._position[index]
+            self._order[target], self._order[position] = index, other
+            self._position[index], self._position[other] = target, position
+            self._above[score] += 1
+            if len(self._above) == score + 1:
+                self._above.append(0)
+            self._points[index] = score + 1
+
+    def addPlayerToTournament(self, player_id, name, rating=tournament.INITIAL_RATING):
+        """Add a player, with no matches played yet, and their rating to pair by"""
+        if player_id in self._index:
+            raise ValueError("Player Already In Tournament")
+        self._add(player_id, name, rating=rating)
+        self._new_players.append(player_id)
+
+    def countPlayers(self):
+        """Returns the number of players in the tournament."""
+        return len(self._ids)
+
+    def reportMatch(self, winner, loser, draw=False):
+        """Records the outcome of a single match between two players.
+
+        Args:
+          winner:  the id number of the player who won
+          loser:  the id number of the player who lost
+          draw: if true, the match was drawn
+        """
+        if winner == loser:
+            raise ValueError("Player Cannot Play Themselves")
+        if winner not in self._index or loser not in self._index:
+            raise ValueError("Player Not In Tournament")
+        index = self._index[winner]
+        points = self._points[index]
+        loser_index = self._index[loser]
+        loser_points = self._points[loser_index]
+        self._last_float[index] = (loser_points > points) - (loser_points < points)
+        self._last_float[loser_index] = (points > loser_points) - (points < loser_points)
+        if draw:
+            self._score(index, 1)
+            self._score(loser_index, 1)
+            self._record((winner, loser, True))
+        else:
+            self._score(index, 2)
+            self._wins[index] += 1
+            self._record((winner, loser))
+        self._matches[index] += 1
+        self._matches[loser_index] += 1
+        self._played.add(winner, loser)
+
+    def reportBye(self, player):
+        """Records a bye, which scores as a win, for a player left unpaired."""
+        if player not in self._index:
+            raise ValueError("Player Not In Tournament")
+        index = self._index[player]
+        if self._byes[index]:
+            raise ValueError("Player Already Had A Bye")
+        self._last_float[index] = 0
+        self._score(index, 2)
+        self._wins[index] += 1
+        self._matches[index] += 1
+        self._byes[index] += 1
+        self._record((player, None))
+
+    def _record(self, result):
+        players = set(result[:2]) - set([None])
+        if players & self._round_players:
+            self._new_rounds.append([])
+            self._round_players = set()
+        self._new_rounds[-1].append(result)
+        self._round_players |= players
+
+    def getPlayedMatches(self):
+        """Returns the set of pairs of players who have already met."""
+        return self._played
+
+    def playerStandings(self, points=False):
+        """Returns a list of the players and their win records, sorted by points.
+
+        Returns:
+          A list of tuples, each of which contains (id, name, wins, matches),
+          and the player's points with points=True
+        """
+        if points:
+            return [(self._ids[i], self._names[i], self._wins[i], self._matches[i], self._points[i] / 2.0)
+                    for i in self._order]
+        return [(self._ids[i], self._names[i], self._wins[i], self._matches[i])
+                for i in self._order]
+
+    def swissPairings(self, mode="greedy", stats=None):
+        """Returns a list of pairs of players for the next round.
+
+        Takes the same mode and stats arguments as tournament.swissPairings.
+
+        Returns:
+          A list of tuples, each of which contains (id1, name1, id2, name2),
+          with a bye last as (id, name, None, None)
+        """
+        if mode not in ("greedy", "optimal"):
+            raise ValueError("Unknown Pairing Mode")
+        if len(self._ids) < 2:
+            raise ValueError("Not Enough Players")
+        order = [self._order[i] for i in pairing.ratingOrder([self._points[i] for i in self._order],
+                                                             [self._last_float[i] for i in self._order],
+                                                             [self._ratings[i] for i in self._order])]
+        return pairing.pairRound([(self._ids[i], self._names[i]) for i in order], [self._points[i] for i in order],
+                                 self._played, [self._byes[i] for i in order], mode=mode, stats=stats)
+
+    def flush(self, session=None):
+        """
+        Write the players added and the matches reported since the tournament
+        was loaded, or last flushed, to the database in one transaction.
+        Players must already be registered in the database. The first round
+        played in memory is counted in the tournament's current round, as
+        reportMatches counts it; each later one starts a new round first, with
+        a standings snapshot as startRound takes, but no stored pairings.
+        :param session:an optional Session to run the inserts in
+        :return:the new match id numbers, in the order they were reported
+        """
+        if self.tournament_id is None:
+            raise ValueError("Tournament Not In Database")
+        match_ids = []
+        with tournament._borrow(session) as db:
+            tournament.addPlayersToTournament(self._new_players, self.tournament_id, session=db)
+            for number, results in enumerate(self._new_rounds):
+                if number:
+                    db.cursor.execute(queries.CURRENT_ROUND, (self.tournament_id,))
+                    round_no = db.cursor.fetchone()[0] + 1
+                    db.cursor.execute(queries.SNAPSHOT_STANDINGS, ([self.tournament_id],))
+                    db.cursor.execute(queries.START_ROUNDS, ([self.tournament_id], [round_no]))
+                match_ids += tournament.reportMatches(results, self.tournament_id, session=db)
+        self._new_players = []
+        self._new_rounds = [[]]
+        self._round_players = set()
+        return match_ids
+
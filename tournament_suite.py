@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+#
+# tournament_suite.py -- benchmark and load-generation suite for tournament.py
+#
+# Seeds synthetic tournaments of several sizes in a throwaway PostgreSQL
+# instance, plays them round by round, and reports p50/p95/p99 latencies of
+# the tournament.py functions. Results can be saved as JSON and compared with
+# a run from another commit:
+#
+#   python tournament_suite.py --sizes 1000,10000 --output before.json
+#   python tournament_suite.py --sizes 1000,10000 --compare before.json
+#
+# The instance is created with initdb in a temporary directory, listens only
+# on a unix socket there, and is removed afterwards. initdb has to be on the
+# PATH or in --pg-bin, and refuses to run as root.
+
+from __future__ import print_function
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+import tournament
+
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
+OPERATIONS = ("registerPlayer", "reportMatch", "reportMatches", "playerStandings",
+              "countPlayers", "swissPairings", "round")
+
+
+class ThrowawayDatabase(object):
+    """A private PostgreSQL instance holding a fresh tournament database.
+
+    Used as a context manager, it runs initdb in a temporary directory,
+    starts the server on a unix socket in that directory with TCP turned off,
+    loads tournament.sql, and points libpq (and so tournament.py) at it
+    through PGHOST, PGPORT and PGUSER. On exit the server is stopped, the
+    directory deleted and the environment restored. Durability settings are
+    off, since the data is thrown away.
+    """
+
+    def __init__(self, pg_bin=None, schema="tournament.sql"):
+        self.pg_bin = pg_bin
+        self.schema = os.path.abspath(schema)
+        self.directory = None
+        self._environment = {}
+
+    def _program(self, name):
+        path = os.path.join(self.pg_bin, name) if self.pg_bin else which(name)
+        if not path or not os.path.exists(path):
+            raise RuntimeError("Cannot find {0}; pass --pg-bin".format(name))
+        return path
+
+    def _run(self, *command, **environment):
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(command, stdout=devnull, env=dict(os.environ, **environment))
+
+    def __enter__(self):
+        if hasattr(os, 'geteuid') and os.geteuid() == 0:
+            raise RuntimeError("initdb refuses to run as root; run the suite as an ordinary user")
+        self.directory = tempfile.mkdtemp(prefix="tournament-suite-")
+        data = os.path.join(self.directory, "data")
+        try:
+            self._run(self._program("initdb"), "-D", data, "-U", "postgres", "-A", "trust", "--no-sync")
+            options = "-k {0} -c listen_addresses='' -c fsync=off -c synchronous_commit=off " \
+                      "-c full_page_writes=off".format(self.directory)
+            self._run(self._program("pg_ctl"), "-D", data, "-o", options, "-l",
+                      os.path.join(self.directory, "server.log"), "-w", "start")
+            for name, value in (("PGHOST", self.directory), ("PGPORT", "5432"), ("PGUSER", "postgres")):
+                self._environment[name] = os.environ.get(name)
+                os.environ[name] = value
+            self._run(self._program("psql"), "-q", "-v", "ON_ERROR_STOP=1", "-d", "postgres", "-f", self.schema,
+                      PGOPTIONS="-c client_min_messages=warning")
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for name, value in self._environment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        self._environment = {}
+        data = os.path.join(self.directory, "data")
+        if os.path.exists(os.path.join(data, "postmaster.pid")):
+            self._run(self._program("pg_ctl"), "-D", data, "-m", "immediate", "-w", "stop")
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def percentile(timings, fraction):
+    """Returns the nearest-rank percentile of a sorted list of timings."""
+    index = max(0, int(math.ceil(fraction * len(timings))) - 1)
+    return timings[index]
+
+def summarize(timings):
+    """Returns the count, mean, p50, p95, p99 and max of a list of timings in ms."""
+    timings = sorted(timings)
+    if not timings:
+        return None
+    return {'count': len(timings), 'mean': sum(timings) / len(timings),
+            'p50': percentile(timings, 0.50), 'p95': percentile(timings, 0.95),
+            'p99': percentile(timings, 0.99), 'max': timings[-1]}
+
+
+class Recorder(object):
+    """Collects per-call timings, in ms, by operation name."""
+
+    def __init__(self):
+        self.timings = dict((operation, []) for operation in OPERATIONS)
+
+    def time(self, operation, function, *args, **kwargs):
+        start = time.time()
+        result = function(*args, **kwargs)
+        self.timings[operation].append((time.time() - start) * 1000.0)
+        return result
+
+
+def playResult(id1, id2, ratings, results):
+    """Returns (winner, loser) for a pairing, at random or by Elo expectation."""
+    if results == "elo":
+        expected = 1.0 / (1.0 + 10 ** ((ratings[id2] - ratings[id1]) / 400.0))
+    else:
+        expected = 0.5
+    return (id1, id2) if random.random() < expected else (id2, id1)
+
+def runSize(players, args):
+    """Seeds one tournament of the given size, plays it, and returns its summaries."""
+    recorder = Recorder()
+    tournament_id = tournament.createTournament("Suite {0}".format(players))
+    # A sample of players is registered one by one to time registerPlayer;
+    # the rest are registered in bulk, which is not what is being measured.
+    single = min(args.calls, players)
+    player_ids = [recorder.time("registerPlayer", tournament.registerPlayer, "Player %d" % i)
+                  for i in range(single)]
+    player_ids += tournament.registerPlayers("Player %d" % i for i in range(single, players))
+    tournament.addPlayersToTournament(player_ids, tournament_id)
+    # Hidden strengths for Elo-driven results
+    ratings = dict((player_id, random.gauss(1500, 200)) for player_id in player_ids)
+
+    rounds = []
+    for round_number in range(1, args.rounds + 1):
+        start = time.time()
+        pairings = recorder.time("swissPairings", tournament.swissPairings, tournament_id, mode=args.mode)
+        results = [playResult(id1, id2, ratings, args.results) for (id1, name1, id2, name2) in pairings]
+        # Report a sample match by match, and the rest of the round at once
+        for (winner, loser) in results[:args.calls]:
+            recorder.time("reportMatch", tournament.reportMatch, winner, loser, tournament_id)
+        if results[args.calls:]:
+            recorder.time("reportMatches", tournament.reportMatches, results[args.calls:], tournament_id)
+        round_time = (time.time() - start) * 1000.0
+        recorder.timings["round"].append(round_time)
+        for _ in range(args.calls):
+            recorder.time("playerStandings", tournament.playerStandings, tournament_id)
+            recorder.time("countPlayers", tournament.countPlayers, tournament_id)
+        rounds.append(round_time)
+        print("  {0} players, round {1:>2}: {2:9.1f} ms".format(players, round_number, round_time))
+
+    summaries = dict((operation, summarize(timings)) for (operation, timings) in recorder.timings.items())
+    summaries["rounds"] = rounds
+    return summaries
+
+
+def printSummaries(results, baseline=None):
+    """Prints a table of percentiles per size and operation, with ratios to a baseline's p50."""
+    for size in sorted(results, key=int):
+        print("\n{0} players".format(size))
+        print("{0:<16} {1:>6} {2:>10} {3:>10} {4:>10} {5:>10}".format(
+            "operation", "calls", "p50 ms", "p95 ms", "p99 ms", "vs base"))
+        for operation in OPERATIONS:
+            summary = results[size].get(operation)
+            if not summary:
+                continue
+            ratio = ""
+            try:
+                before = baseline["results"][size][operation]["p50"]
+                ratio = "{0:9.2f}x".format(summary["p50"] / before)
+            except (KeyError, TypeError, ZeroDivisionError):
+                pass
+            print("{0:<16} {1:>6} {2:10.3f} {3:10.3f} {4:10.3f} {5:>10}".format(
+                operation, summary["count"], summary["p50"], summary["p95"], summary["p99"], ratio))
+
+def describeRun(args):
+    """Returns what a saved run needs to be compared with another: commit, versions and settings."""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            commit = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=devnull).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    db, cursor = tournament.connect()
+    cursor.execute("SHOW server_version")
+    server_version = cursor.fetchone()[0]
+    db.close()
+    return {'commit': commit, 'started': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'python': platform.python_version(), 'postgres': server_version,
+            'settings': {'sizes': args.sizes, 'rounds': args.rounds, 'calls': args.calls,
+                         'results': args.results, 'mode': args.mode, 'seed': args.seed}}
+
+
+def runSuite(args):
+    """Plays every size and returns the run, as saved to JSON."""
+    random.seed(args.seed)
+    tournament.configurePool()
+    run = describeRun(args)
+    run['results'] = {}
+    for players in args.sizes:
+        run['results'][str(players)] = runSize(players, args)
+    tournament.getPool().closeall()
+    return run
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite for tournament.py")
+    parser.add_argument('--sizes', default="1000,10000",
+                        type=lambda sizes: [int(size) + int(size) % 2 for size in sizes.split(",")],
+                        help="comma-separated numbers of players, rounded up to even")
+    parser.add_argument('--rounds', type=int, default=11)
+    parser.add_argument('--calls', type=int, default=20,
+                        help="timed single calls per round for each operation")
+    parser.add_argument('--results', choices=("random", "elo"), default="random")
+    parser.add_argument('--mode', choices=("greedy", "optimal"), default="greedy")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="save the results to this JSON file")
+    parser.add_argument('--compare', help="a JSON file from an earlier run to compare with")
+    parser.add_argument('--pg-bin', help="directory holding initdb, pg_ctl and psql")
+    parser.add_argument('--external', action='store_true',
+                        help="use the database tournament.py connects to instead of a throwaway one")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    if args.external:
+        run = runSuite(args)
+    else:
+        with ThrowawayDatabase(args.pg_bin):
+            run = runSuite(args)
+    printSummaries(run['results'], baseline)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(run, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,21 @@
 # Citation: I looked at this project : https://github.com/samfrances/udacity-swiss-system-tournament
 # to get guidance regarding write unit tests for the extra credit cases only.
 
+import io
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+
 from tournament import *
+import tournament
+import psycopg2
+import instrumentation
+import pairing
+import tournament_io
+from tournament_state import TournamentState
 
 def testDeleteMatches():
     deleteMatches()
@@ -562,6 +576,1075 @@ def testPairingByTournament():
 
     print "25. After one match in each of two tournaments, players with one win are paired."
 
+def testSessions():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    with Session() as session:
+        tournament1 = createTournament("t1", session=session)
+        p1 = registerPlayer("Twilight Sparkle", session=session)
+        addPlayerToTournament(p1, tournament1, session=session)
+        if countPlayers(tournament1, session=session) != 1:
+            raise ValueError("A session should see its own uncommitted writes.")
+        if countPlayers() != 0:
+            raise ValueError("Other sessions should not see uncommitted writes.")
+    if countPlayers(tournament1) != 1:
+        raise ValueError("Leaving a session block should commit its writes.")
+
+    session = Session()
+    registerPlayer("Fluttershy", session=session)
+    session.close()
+    if countPlayers() != 1:
+        raise ValueError("Closing a session should discard uncommitted writes.")
+    print("26. Calls sharing a Session run in one transaction.")
+
+    pool = ConnectionPool(min_size=1, max_size=2, idle_timeout=0)
+    first, second = pool.getconn(), pool.getconn()
+    pool.putconn(first)
+    pool.putconn(second)
+    if pool.getconn() is not second:
+        raise ValueError("The pool should hand out the most recently returned connection.")
+    if not first.closed:
+        raise ValueError("Connections idle past idle_timeout should be closed down to min_size.")
+    pool.closeall()
+    print("27. The connection pool reuses connections and expires idle ones.")
+
+def testStandingsAfterDeletes():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    p1 = registerPlayer("Bob")
+    p2 = registerPlayer("Tim")
+    p3 = registerPlayer("Dave")
+    addPlayerToTournament(p1, tournament1)
+    addPlayerToTournament(p2, tournament1)
+    addPlayerToTournament(p3, tournament1)
+    reportMatch(p1, p2, tournament1)
+    reportMatch(p3, p1, tournament1)
+
+    deleteMatches(tournament1)
+    for (i, n, w, m) in playerStandings(tournament1):
+        if w != 0 or m != 0:
+            raise ValueError("Deleted matches should be taken off the standings.")
+
+    reportMatch(p1, p2, tournament1)
+    db, cursor = connect()
+    cursor.execute("DELETE FROM players WHERE player_id=(%s)", (p2,))
+    db.commit()
+    db.close()
+    # The match against the deleted player is deleted with them
+    if playerStandings(tournament1) != [(p1, "Bob", 0, 0), (p3, "Dave", 0, 0)]:
+        raise ValueError("Deleting a player should remove them and their matches from the standings.")
+    if countPlayers(tournament1) != 2:
+        raise ValueError("Deleting a player should remove them from the tournament's count.")
+    print("28. Deleting matches and players keeps the standings up to date.")
+
+def testRematchAvoidance():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    [p1, p2, p3, p4] = [registerPlayer(name) for name in
+                        ("Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie")]
+    for player in (p1, p2, p3, p4):
+        addPlayerToTournament(player, tournament1)
+    reportMatch(p1, p2, tournament1)
+    reportMatch(p3, p4, tournament1)
+    reportMatch(p1, p3, tournament1)
+    reportMatch(p2, p4, tournament1)
+
+    # p2 and p3 are both on one win, but p1 has already played both of them
+    pairings = swissPairings(tournament1)
+    actual_pairs = set([frozenset([pid1, pid2]) for (pid1, pname1, pid2, pname2) in pairings])
+    if actual_pairs != set([frozenset([p1, p4]), frozenset([p2, p3])]):
+        raise ValueError("swissPairings should not pair players who have already met.")
+    print("29. swissPairings avoids rematches by floating players between score groups.")
+
+    players = [(1, "a"), (2, "b"), (3, "c"), (4, "d")]
+    played = pairing.playedPairs([(1, 2), (1, 3), (1, 4)])
+    try:
+        pairing.pairPlayers(players, played)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("pairPlayers should raise when every pairing has a rematch.")
+    try:
+        pairing.pairPlayers(players[:3], set())
+    except ValueError:
+        pass
+    else:
+        raise ValueError("pairPlayers should raise for an odd number of players.")
+    print("30. pairPlayers raises instead of dropping players it cannot pair.")
+
+def testOptimalPairings():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    players = [registerPlayer(name) for name in
+               ("Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie", "Rarity", "Spike")]
+    for player in players:
+        addPlayerToTournament(player, tournament1)
+    [p1, p2, p3, p4, p5, p6] = players
+    reportMatch(p1, p2, tournament1)
+    reportMatch(p3, p4, tournament1)
+    reportMatch(p5, p6, tournament1)
+    reportMatch(p1, p3, tournament1)
+    reportMatch(p5, p2, tournament1)
+    reportMatch(p4, p6, tournament1)
+
+    # p1 and p5 have two wins; p3 and p4 have one win but have already met,
+    # so both of them float down to the players without a win.
+    stats = {}
+    pairings = swissPairings(tournament1, mode="optimal", stats=stats)
+    actual_pairs = set([frozenset([pid1, pid2]) for (pid1, pname1, pid2, pname2) in pairings])
+    played = pairing.playedPairs(getPlayedMatches(tournament1))
+    if len(pairings) != 3 or actual_pairs & played:
+        raise ValueError("Optimal pairings should pair everybody without rematches.")
+    if frozenset([p1, p5]) not in actual_pairs:
+        raise ValueError("Optimal pairings should pair the two leaders together.")
+    if 'solve_time' not in stats or 'edges' not in stats:
+        raise ValueError("Optimal pairings should report the solve time.")
+    print("31. Optimal pairings avoid rematches and keep score groups together.")
+
+    edges = [(0, 1, 1), (1, 2, 10), (2, 3, 1)]
+    if pairing.maxWeightMatching(edges, maxcardinality=True) != [1, 0, 3, 2]:
+        raise ValueError("maxWeightMatching should find the maximum-weight perfect matching.")
+    if pairing.maxWeightMatching(edges) != [-1, 2, 1, -1]:
+        raise ValueError("maxWeightMatching should find the maximum-weight matching.")
+    print("32. maxWeightMatching finds maximum-weight matchings.")
+
+def testBulkOperations():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    names = ["Bruno Walton", "Boots O'Neal", "Cathy Burton", "Diane Grant", "Joe Malik"]
+    players = registerPlayers(names)
+    if len(players) != 5 or [name for (i, name) in sorted(zip(players, names))] != names:
+        raise ValueError("registerPlayers() should return the new ids in input order.")
+    [p1, p2, p3, p4, p5] = players
+    addPlayersToTournament([p1, p2, p3, p4], tournament1)
+    if countPlayers(tournament1) != 4:
+        raise ValueError("addPlayersToTournament() should add every player.")
+    print("33. Players can be registered and added to a tournament in bulk.")
+
+    for (results, reason) in (([(p1, p2), (p3, p5)], "players who are not in the tournament"),
+                              ([(p1, p2), (p2, p1)], "the same pair twice"),
+                              ([(p1, p2), (p1, p3)], "a player in two matches"),
+                              ([(p1, p2), (p3, None), (p3, p4)], "a player given a bye and a match"),
+                              ([(p1, p1)], "a player against themselves")):
+        try:
+            reportMatches(results, tournament1)
+        except ValueError:
+            pass
+        else:
+            raise ValueError("reportMatches() should reject " + reason + ".")
+    if getPlayedMatches(tournament1) != []:
+        raise ValueError("reportMatches() should not write anything from a rejected batch.")
+
+    match_ids = reportMatches([(p1, p2), (p4, p3)], tournament1)
+    if len(match_ids) != 2 or match_ids[0] >= match_ids[1]:
+        raise ValueError("reportMatches() should return the new ids in input order.")
+    if set(getPlayedMatches(tournament1)) != set([(p1, p2), (p4, p3)]):
+        raise ValueError("reportMatches() should record every match.")
+    print("34. A round of matches is validated and reported in bulk.")
+
+def testTournamentState():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    [p1, p2, p3, p4, p5, p6] = registerPlayers(["Twilight Sparkle", "Fluttershy", "Applejack",
+                                                "Pinkie Pie", "Rarity", "Spike"])
+    addPlayersToTournament([p1, p2, p3, p4], tournament1)
+    reportMatches([(p1, p2), (p3, p4)], tournament1)
+
+    state = TournamentState.load(tournament1)
+    if state.playerStandings() != playerStandings(tournament1):
+        raise ValueError("A loaded TournamentState should have the database's standings.")
+    state.addPlayerToTournament(p5, "Rarity")
+    state.addPlayerToTournament(p6, "Spike")
+    for (id1, name1, id2, name2) in state.swissPairings():
+        if frozenset([id1, id2]) in state.getPlayedMatches():
+            raise ValueError("A TournamentState should not pair players who have already met.")
+        state.reportMatch(id1, id2)
+    standings = state.playerStandings()
+    if [wins for (i, n, wins, m) in standings] != sorted([wins for (i, n, wins, m) in standings], reverse=True):
+        raise ValueError("A TournamentState should keep its standings sorted by wins.")
+    if len(getPlayedMatches(tournament1)) != 2:
+        raise ValueError("A TournamentState should not write anything before it is flushed.")
+    print("35. A TournamentState plays rounds in memory.")
+
+    state.flush()
+    if set(playerStandings(tournament1)) != set(standings):
+        raise ValueError("Flushing a TournamentState should write its players and results.")
+    print("36. Flushing a TournamentState writes its results in one batch.")
+
+    # Two rounds in memory: the first finishes the round started in the database, the second starts the next
+    (round_no, pairings) = startRound(tournament1)
+    state = TournamentState.load(tournament1)
+    for (id1, name1, id2, name2) in pairings:
+        state.reportMatch(id1, id2)
+    first = set(state.playerStandings())
+    for (id1, name1, id2, name2) in state.swissPairings():
+        state.reportMatch(id1, id2)
+    state.flush()
+    if getCurrentRound(tournament1) != round_no + 1 or set(standingsAsOf(tournament1, round_no)) != first:
+        raise ValueError("Flushing a TournamentState should start a round for each round after the first.")
+    if set(playerStandings(tournament1)) != set(state.playerStandings()):
+        raise ValueError("Flushing a TournamentState should write the results of every round.")
+    print("37. Flushing a TournamentState writes each round it played under its own number.")
+
+def testTiebreaks():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    [p1, p2, p3, p4] = registerPlayers(["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie"])
+    addPlayersToTournament([p1, p2, p3, p4], tournament1)
+    # Round one: p1 beats p2, p3 beats p4. Round two: p1 beats p3, p4 beats p2.
+    reportMatches([(p1, p2), (p3, p4)], tournament1)
+    reportMatches([(p1, p3), (p4, p2)], tournament1)
+    standings = playerStandings(tournament1, tiebreaks=["buchholz", "sonneborn_berger", "cumulative"])
+    expected = [
+        (p1, "Twilight Sparkle", 2, 2, 1, 1, 3),
+        (p3, "Applejack", 1, 2, 3, 1, 2),
+        (p4, "Pinkie Pie", 1, 2, 1, 0, 1),
+        (p2, "Fluttershy", 0, 2, 3, 0, 0),
+    ]
+    if standings != expected:
+        raise ValueError("Tiebreak scores or their order are wrong: %r" % (standings,))
+    print("38. playerStandings computes Buchholz, Sonneborn-Berger and cumulative tiebreaks.")
+
+    standings = playerStandings(tournament1, tiebreaks=["cumulative"])
+    if [row[0] for row in standings] != [p1, p3, p4, p2]:
+        raise ValueError("Players tied on wins should be sorted by their tiebreaks.")
+    try:
+        playerStandings(tournament1, tiebreaks=["coin_toss"])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("An unknown tiebreak should be rejected.")
+    # NumPy is only needed for tiebreaks
+    import tiebreaks
+    for unknown in (0, p4 + 1):
+        try:
+            tiebreaks.computeTiebreaks(standings, [(p1, unknown, False)], ["buchholz"])
+        except ValueError:
+            pass
+        else:
+            raise ValueError("computeTiebreaks should reject a match of a player not in the standings.")
+    print("39. Players tied on wins are sorted by their tiebreaks.")
+
+    deleteMatches(tournament1)
+    # Round one: p1 beats p2, p3 draws with p4. Round two: p1 draws with p3, p2 beats p4.
+    reportMatch(p1, p2, tournament1)
+    reportMatch(p3, p4, tournament1, draw=True)
+    reportMatch(p1, p3, tournament1, draw=True)
+    reportMatch(p2, p4, tournament1)
+    standings = playerStandings(tournament1, tiebreaks=["buchholz", "sonneborn_berger", "cumulative"], points=True)
+    expected = [
+        (p1, "Twilight Sparkle", 1, 2, 1.5, 2.0, 1.5, 2.5),
+        (p3, "Applejack", 0, 2, 1.0, 2.0, 1.0, 1.5),
+        (p2, "Fluttershy", 1, 2, 1.0, 2.0, 0.5, 1.0),
+        (p4, "Pinkie Pie", 0, 2, 0.5, 2.0, 0.5, 1.0),
+    ]
+    if standings != expected:
+        raise ValueError("Tiebreaks should count draws, in points: %r" % (standings,))
+    print("40. Tiebreaks add up the opponents' points, counting draws by half.")
+
+def testStandingsCache():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    [p1, p2, p3, p4] = registerPlayers(["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie"])
+    addPlayersToTournament([p1, p2, p3, p4], tournament1)
+    # Turn the cache on after the setup, so that the notifications sent by
+    # the setup cannot arrive between the calls counted below.
+    configureCache(max_size=2)
+    try:
+        first = playerStandings(tournament1)
+        if playerStandings(tournament1) != first or getCacheStats()['hits'] != 1:
+            raise ValueError("A second playerStandings call should be served from the cache.")
+        swissPairings(tournament1)
+        swissPairings(tournament1)
+        if getCacheStats()['hits'] != 2:
+            raise ValueError("A second swissPairings call should be served from the cache.")
+        reportMatch(p1, p2, tournament1)
+        if playerStandings(tournament1)[0][2] != 1:
+            raise ValueError("reportMatch should invalidate the cached standings.")
+        with Session() as session:
+            reportMatch(p3, p4, tournament1, session=session)
+            if playerStandings(tournament1, session=session)[1][2] != 1:
+                raise ValueError("Calls with a session should bypass the cache.")
+        print("41. playerStandings and swissPairings are cached until the tournament changes.")
+
+        # Another process writes straight to the database; its commit is
+        # announced with a notification.
+        playerStandings(tournament1)
+        db, cursor = connect()
+        cursor.execute("INSERT INTO matches(winner_id, loser_id, tournament_id) VALUES(%s, %s, %s)",
+                       (p1, p3, tournament1))
+        db.commit()
+        db.close()
+        deadline = time.time() + 5
+        while playerStandings(tournament1)[0][2] != 2:
+            if time.time() > deadline:
+                raise ValueError("A change committed elsewhere should invalidate the cached standings.")
+            time.sleep(0.01)
+        print("42. Changes committed by other processes invalidate the cache.")
+
+        # A fresh cache, since a notification of the changes above may still be on its way and would drop
+        # tournament1 instead of the eviction
+        configureCache(max_size=2)
+        playerStandings(tournament1)
+        tournament2 = createTournament("t2")
+        tournament3 = createTournament("t3")
+        playerStandings(tournament2)
+        playerStandings(tournament3)
+        stats = getCacheStats()
+        if stats['size'] != 2 or stats['evictions'] != 1:
+            raise ValueError("The cache should evict the least recently used tournament.")
+        playerStandings(tournament1)
+        if getCacheStats()['misses'] != stats['misses'] + 1:
+            raise ValueError("An evicted tournament should be read from the database again.")
+        print("43. The cache keeps at most max_size tournaments.")
+
+        # Without notifications, only the session's commit can drop what was read before it
+        configureCache(max_size=2, listen=False)
+        with Session() as session:
+            reportMatch(p2, p4, tournament1, session=session)
+            before = playerStandings(tournament1)
+        if playerStandings(tournament1) == before:
+            raise ValueError("A session's commit should drop the standings cached before it.")
+        print("44. Writes made in a session invalidate the cache when it commits.")
+
+        # The listening connection drops, and cannot be opened again until the database is back
+        cache = configureCache(max_size=2)
+        playerStandings(tournament1)
+        cache._listener.close()
+        cache.dbname = "tournament_unreachable"
+        playerStandings(tournament1)
+        playerStandings(tournament1)
+        if getCacheStats()['hits'] != 0:
+            raise ValueError("Nothing should be served from the cache while its listener is down.")
+        cache.dbname = tournament.DBNAME
+        playerStandings(tournament1)
+        playerStandings(tournament1)
+        if getCacheStats()['hits'] != 1:
+            raise ValueError("The cache should listen again once the database is back.")
+        print("45. Reads skip the cache, rather than fail, while its listener cannot reconnect.")
+    finally:
+        configureCache(0)
+
+def testValidation():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("  t1\n")
+    p1 = registerPlayer("<b>Twilight</b>\tSparkle ")
+    p2 = registerPlayer("Fluttershy")
+    addPlayerToTournament(str(p1), str(tournament1))
+    addPlayerToTournament(p2, tournament1)
+    reportMatch(p1, p2, tournament1)
+    if playerStandings(tournament1)[0][1] != "<b>Twilight</b> Sparkle":
+        raise ValueError("Names should be stored as plain text, without control characters.")
+    for bad_id in ("1; DROP TABLE players", 1.5, True, None):
+        try:
+            reportMatch(bad_id, p2, tournament1)
+        except ValueError:
+            pass
+        else:
+            raise ValueError("reportMatch should reject the id %r." % (bad_id,))
+    for bad_name in ("", " \n ", None, 7):
+        try:
+            registerPlayer(bad_name)
+        except ValueError:
+            pass
+        else:
+            raise ValueError("registerPlayer should reject the name %r." % (bad_name,))
+    print("46. Ids must be integers and names are cleaned when they are written.")
+
+def testInstrumentation():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    [p1, p2] = registerPlayers(["Twilight Sparkle", "Fluttershy"])
+    addPlayersToTournament([p1, p2], tournament1)
+    histogram = instrumentation.Histogram()
+    instrumentation.enable(histogram)
+    try:
+        swissPairings(tournament1)
+        reportMatch(p1, p2, tournament1)
+    finally:
+        instrumentation.disable()
+    countPlayers(tournament1)
+    recorded = histogram.snapshot()
+    for key in [("function", "reportMatch"), ("function", "swissPairings"), ("function", "getPairingState"),
+                ("acquire", "acquire"), ("commit", "commit")]:
+        if key not in recorded:
+            raise ValueError("Instrumentation should record %r." % (key,))
+    if ("function", "countPlayers") in recorded:
+        raise ValueError("Nothing should be recorded once instrumentation is disabled.")
+    queries = [name for (kind, name) in recorded if kind == "query"]
+    if not any(name.startswith("INSERT INTO matches") for name in queries):
+        raise ValueError("Instrumentation should record every query.")
+    print("47. Instrumentation records functions, queries, connections and commits while enabled.")
+
+    events = []
+    sink = instrumentation.Histogram()
+    sink.handle = events.append
+    path = "/tmp/tournament_test_metrics.prom"
+    prometheus = instrumentation.PrometheusFileSink(path)
+    instrumentation.enable(sink, prometheus, slow_query_ms=0)
+    try:
+        reportMatch(p2, p1, tournament1)
+        playerStandings(tournament1)
+    finally:
+        instrumentation.disable()
+    prometheus.flush()
+    plans = [event for event in events if event.kind == "slow_query"]
+    if not any(event.name.startswith("INSERT INTO matches") and "Insert on matches" in event.plan for event in plans):
+        raise ValueError("A query over the slow query threshold should have its plan captured.")
+    if len(getPlayedMatches(tournament1)) != 2:
+        raise ValueError("Capturing a plan should not repeat the query's writes.")
+    with open(path) as metrics:
+        text = metrics.read()
+    if 'tournament_function_seconds_count{function="reportMatch"} 1' not in text:
+        raise ValueError("The Prometheus dump should hold the recorded histograms.")
+    os.remove(path)
+    print("48. Slow queries are explained without side effects, and metrics can be dumped for Prometheus.")
+
+    directory = tempfile.mkdtemp()
+    shared = instrumentation.PrometheusFileSink(os.path.join(directory, "metrics.prom"), interval=0)
+    errors = []
+
+    def handleMany():
+        for _ in range(500):
+            try:
+                shared.handle(instrumentation.Event("query", "SELECT 1", None, 0.001, 1, None))
+            except Exception as e:
+                errors.append(e)
+    threads = [threading.Thread(target=handleMany) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    left = os.listdir(directory)
+    shutil.rmtree(directory)
+    if errors or left != ["metrics.prom"]:
+        raise ValueError("Threads sharing a Prometheus sink should take turns to write it: %r %r" % (errors, left))
+
+    class FailingSink(object):
+        def handle(self, event):
+            raise IOError("No space left on device")
+    logged = []
+    handler = logging.Handler()
+    handler.emit = logged.append
+    logger = logging.getLogger("tournament.instrumentation")
+    logger.addHandler(handler)
+    instrumentation.enable(FailingSink())
+    try:
+        reportMatch(p1, p2, tournament1)
+    finally:
+        instrumentation.disable()
+        logger.removeHandler(handler)
+    if len(getPlayedMatches(tournament1)) != 3 or not logged:
+        raise ValueError("A failing sink should be logged, not raised into the call it measured.")
+    print("49. Sinks are safe to share between threads, and a failing sink does not fail the call.")
+
+def testPairingState():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    [p1, p2, p3, p4, p5, p6] = registerPlayers(["Twilight Sparkle", "Fluttershy", "Applejack",
+                                                "Pinkie Pie", "Rarity", "Spike"])
+    addPlayersToTournament([p1, p2, p3, p4, p5, p6], tournament1)
+    reportMatches([(p1, p2), (p3, p4), (p5, p6)], tournament1)
+    # p2, on no wins, beats p5, on one: p2 floats up and p5 floats down.
+    reportMatches([(p1, p3), (p2, p5), (p4, p6)], tournament1)
+    state = dict((record[0], record) for record in getPairingState(tournament1))
+    if state[p5][6] != [p6, p2] or state[p1][6] != [p2, p3]:
+        raise ValueError("The pairing state should list each player's opponents in the order they met.")
+    if state[p2][7] != 1 or state[p5][7] != -1 or state[p1][7] != 0:
+        raise ValueError("The pairing state should record the direction of each player's last float.")
+    if pairing.floatOrder([1, 1, 1, 0], [1, 0, -1, 0]) != [2, 1, 0, 3]:
+        raise ValueError("Within a score group, players who floated down should come first and up last.")
+    pairings = swissPairings(tournament1)
+    played = set(frozenset(match) for match in getPlayedMatches(tournament1))
+    if any(frozenset((id1, id2)) in played for (id1, name1, id2, name2) in pairings):
+        raise ValueError("Pairing from the pairing state should not repeat a match.")
+    print("50. Opponents and floats are kept up to date as results are reported.")
+
+    loaded = TournamentState.load(tournament1)
+    if len(loaded.getPlayedMatches()) != 6 or loaded.playerStandings() != playerStandings(tournament1):
+        raise ValueError("A TournamentState should load from the pairing state.")
+    deleteMatches(tournament1)
+    if any(record[6] or record[7] for record in getPairingState(tournament1)):
+        raise ValueError("Deleting the matches should clear the pairing state.")
+    print("51. TournamentState loads from the pairing state, and deleting matches clears it.")
+
+def testRounds():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    [p1, p2, p3, p4] = registerPlayers(["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie"])
+    addPlayersToTournament([p1, p2, p3, p4], tournament1)
+    if getCurrentRound(tournament1) != 0 or roundPairings(tournament1) != []:
+        raise ValueError("A tournament should have no rounds before the first is started.")
+    (round_no, pairings) = startRound(tournament1)
+    if round_no != 1 or getCurrentRound(tournament1) != 1 or len(pairings) != 2:
+        raise ValueError("startRound should start round 1 and pair every player.")
+    (id1, name1, id2, name2) = pairings[0]
+    reportMatch(id1, id2, tournament1)
+    if [pair[4] for pair in roundPairings(tournament1)] != [id1, None]:
+        raise ValueError("roundPairings should show which matches of the round are still to be reported.")
+    try:
+        startRound(tournament1)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A round should not start while a match of the current one is still to be reported.")
+    (id1, name1, id2, name2) = pairings[1]
+    reportMatch(id2, id1, tournament1)
+    print("52. startRound pairs a round, and roundPairings shows which of its matches are pending.")
+
+    after_round1 = playerStandings(tournament1)
+    (round_no, pairings) = startRound(tournament1)
+    reportMatches([(id1, id2) for (id1, name1, id2, name2) in pairings], tournament1)
+    if round_no != 2 or [pair[4] for pair in roundPairings(tournament1)] != [pairings[0][0], pairings[1][0]]:
+        raise ValueError("Matches reported after startRound should count in the new round.")
+    if standingsAsOf(tournament1, 1) != after_round1 or standingsAsOf(tournament1, 2) != playerStandings(tournament1):
+        raise ValueError("standingsAsOf should return the standings at the end of each round.")
+    try:
+        standingsAsOf(tournament1, 3)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("standingsAsOf should reject a round that has not been started.")
+    deleteMatches(tournament1)
+    if getCurrentRound(tournament1) != 0 or any(row[3] for row in playerStandings(tournament1)):
+        raise ValueError("Deleting a tournament's matches should delete its rounds.")
+    print("53. standingsAsOf returns the standings at the end of any round started.")
+
+def testByesAndDraws():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    [p1, p2, p3, p4, p5] = registerPlayers(["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie", "Rarity"])
+    addPlayersToTournament([p1, p2, p3, p4, p5], tournament1)
+    (round_no, pairings) = startRound(tournament1)
+    if len(pairings) != 3 or pairings[-1] != (p5, "Rarity", None, None):
+        raise ValueError("With an odd number of players, the lowest player should be given a bye.")
+    if roundPairings(tournament1)[-1][4:] != (p5, "bye"):
+        raise ValueError("startRound should report the bye straight away.")
+    [(a1, n1, a2, n2), (b1, n3, b2, n4)] = pairings[:2]
+    reportMatches([(a1, a2, True), (b1, b2)], tournament1)
+    points = dict((row[0], row[4]) for row in playerStandings(tournament1, points=True))
+    if (points[a1], points[a2], points[b1], points[b2], points[p5]) != (0.5, 0.5, 1.0, 0.0, 1.0):
+        raise ValueError("A draw should score half a point, and a win or a bye a whole one.")
+    if playerStandings(tournament1)[-1][0] != b2 or len(playerStandings(tournament1)[0]) != 4:
+        raise ValueError("Standings should be sorted by points, and only hold them when asked.")
+    print("54. Byes and draws are scored in half-points and kept in the standings.")
+
+    pairings = swissPairings(tournament1)
+    if pairings[-1][0] != b2:
+        raise ValueError("The bye should go to the lowest player who has not had one.")
+    try:
+        reportBye(p5, tournament1)
+    except psycopg2.IntegrityError:
+        pass
+    else:
+        raise ValueError("A player should not be given a second bye.")
+    state = TournamentState.load(tournament1)
+    if state.playerStandings(points=True) != playerStandings(tournament1, points=True):
+        raise ValueError("A TournamentState should load points and byes.")
+    if state.swissPairings()[-1][0] != b2:
+        raise ValueError("A TournamentState should give the bye as the database does.")
+    deleteMatches(tournament1)
+    if any(record[2] or record[3] or record[4] or record[5] for record in getPairingState(tournament1)):
+        raise ValueError("Deleting the matches should clear points and byes.")
+    print("55. The bye goes to the lowest player without one, also in a TournamentState.")
+
+def testImportExport():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    [p1, p2, p3, p4] = registerPlayers(["Twilight Sparkle", "Fluttershy", "Applejack, \"AJ\"", "Pinkie Pie"])
+    addPlayersToTournament([p1, p2, p3, p4], tournament1)
+    for draw in (True, False):
+        (round_no, pairings) = startRound(tournament1)
+        reportMatches([(id1, id2, draw) for (id1, name1, id2, name2) in pairings], tournament1)
+    standings = list(tournament_io.exportStandings(tournament1))
+    matches = list(tournament_io.exportMatches(tournament1))
+    if standings[0] != "id,name,wins,matches,points\n" or len(standings) != 5:
+        raise ValueError("exportStandings should write a header and a line per player.")
+    # In id order, so that the new ids break ties in the standings as the old ones did
+    players = sorted(((record["id"], record["name"]) for record in tournament_io.readRecords(standings)),
+                     key=lambda player: int(player[0]))
+    (tournament2, player_ids) = tournament_io.importTournament(
+        "t2", players, [(record["winner_id"], record["loser_id"], record["result"], record["round_no"])
+                        for record in tournament_io.readRecords(matches)])
+    renumbered = dict((player_ids[str(player_id)], player_id) for player_id in (p1, p2, p3, p4))
+    for (old, new) in ((playerStandings(tournament1, points=True), playerStandings(tournament2, points=True)),
+                       (standingsAsOf(tournament1, 1), standingsAsOf(tournament2, 1))):
+        if [(renumbered[row[0]],) + tuple(row[1:]) for row in new] != old:
+            raise ValueError("An exported tournament should import with the same standings in every round.")
+    if getCurrentRound(tournament2) != 2:
+        raise ValueError("Importing matches with round numbers should create the rounds.")
+    print("56. Tournaments can be exported as CSV and imported again with COPY.")
+
+    records = list(tournament_io.readRecords(tournament_io.exportMatches(tournament1, format="ndjson"), "ndjson"))
+    if sorted((record["winner_id"], record["loser_id"]) for record in records) != \
+            sorted(getPlayedMatches(tournament1)) or records[0]["result"] != "draw":
+        raise ValueError("exportMatches should write a JSON object per match, with its result.")
+    try:
+        tournament_io.importTournament("t3", [(1, "Rarity")], [(1, 2)])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("importTournament should reject matches naming players not imported.")
+    if countPlayers() != 8:
+        raise ValueError("A failed import should leave nothing behind.")
+    print("57. Matches can be exported as NDJSON, and imports of unknown players are rejected.")
+
+    # The import counts the standings, careers and head-to-head records itself, with their triggers off
+    for player_id in (p1, p2, p3, p4):
+        if playerCareer(player_ids[str(player_id)])[1:] != playerCareer(player_id)[1:]:
+            raise ValueError("An import should count the careers of its players.")
+    if headToHead(player_ids[str(p1)], player_ids[str(p2)]) != headToHead(p1, p2):
+        raise ValueError("An import should count the head-to-head records of its players.")
+    with Session() as session:
+        (tournament3, imported) = tournament_io.importTournament("t3", [(1, "Rarity")], session=session)
+        addPlayersToTournament([p1], tournament3, session=session)
+        if countPlayers(tournament3, session=session) != 2 or playerCareer(p1, session=session)[2] != 2:
+            raise ValueError("The triggers should count what a session does after an import again.")
+    print("58. An import counts its standings and careers once, after copying its matches in.")
+
+def testPairAll():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    sections = [createTournament("Section %d" % i) for i in range(3)]
+    for (section, size) in zip(sections, (8, 7, 4)):
+        addPlayersToTournament(registerPlayers("Player %d" % i for i in range(size)), section)
+    timings = {}
+    rounds = pairAll(sections, workers=2, timings=timings)
+    if sorted(rounds) != sorted(sections) or sorted(timings) != sorted(sections):
+        raise ValueError("pairAll should start a round in every section and time each one.")
+    for section in sections:
+        (round_no, pairings) = rounds[section]
+        if round_no != 1 or [pair[:4] for pair in roundPairings(section)] != pairings:
+            raise ValueError("pairAll should store the pairings of every section.")
+    if rounds[sections[1]][1][-1][2] is not None or roundPairings(sections[1])[-1][5] != "bye":
+        raise ValueError("pairAll should report the bye of a section with an odd number of players.")
+    print("59. pairAll pairs many sections at once in a process pool.")
+
+    for section in sections[:2]:
+        reportMatches([(id1, id2) for (id1, name1, id2, name2) in rounds[section][1] if id2 is not None], section)
+    try:
+        pairAll(sections)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("pairAll should refuse to start a round while a section has matches to report.")
+    if [getCurrentRound(section) for section in sections] != [1, 1, 1]:
+        raise ValueError("pairAll should start no round at all if any section cannot.")
+    reportMatches([pair[::2] for pair in rounds[sections[2]][1]], sections[2])
+    after_round1 = [playerStandings(section) for section in sections]
+    rounds = pairAll(sections, workers=1)
+    if [rounds[section][0] for section in sections] != [2, 2, 2] or \
+            [standingsAsOf(section, 1) for section in sections] != after_round1:
+        raise ValueError("pairAll should snapshot every section's finished round before starting the next.")
+    print("60. pairAll starts every section's round in one transaction, or none of them.")
+
+def testServerSidePairings():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    players = registerPlayers("Player %d" % i for i in range(41))
+    addPlayersToTournament(players, tournament1)
+    for mode in ("greedy", "optimal", "greedy"):
+        pairings = swissPairings(tournament1, mode=mode)
+        if swissPairings(tournament1, mode=mode, server_side=True) != pairings:
+            raise ValueError("Pairing from pairing_candidates() should match pairing from the pairing state.")
+        startRound(tournament1, mode=mode)
+        reportMatches([(id1, id2) for (id1, name1, id2, name2) in pairings if id2 is not None], tournament1)
+    print("61. swissPairings pairs from the pairing_candidates() function as from the pairing state.")
+
+    with Session() as session:
+        session.cursor.execute("SELECT player_id, candidates FROM pairing_candidates(%s, 4)", (tournament1,))
+        candidates = session.cursor.fetchall()
+    met = dict((record[0], record[6]) for record in getPairingState(tournament1))
+    if any(len(others) > 4 or set(others) & set(met[player]) for (player, others) in candidates):
+        raise ValueError("pairing_candidates() should only offer players in the window who have not been met.")
+    window = tournament.CANDIDATE_WINDOW
+    tournament.CANDIDATE_WINDOW = 1
+    try:
+        if swissPairings(tournament1, server_side=True) != swissPairings(tournament1):
+            raise ValueError("swissPairings should widen the window until the round can be paired.")
+    finally:
+        tournament.CANDIDATE_WINDOW = window
+    print("62. The candidate window is widened until the round can be paired.")
+
+def testResetAndArchive():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    tournament2 = createTournament("t2")
+    players = registerPlayers("Player %d" % i for i in range(4))
+    for tid in (tournament1, tournament2):
+        addPlayersToTournament(players, tid)
+        reportMatches([(players[0], players[1]), (players[2], players[3])], tid)
+    deleteTournaments()
+    deletePlayers()
+    if createTournament("t1") != 1 or registerPlayer("Player 1") != 1:
+        raise ValueError("deleteTournaments and deletePlayers should start the numbering again.")
+    with Session() as session:
+        session.cursor.execute("SELECT count(*) FROM pg_inherits WHERE inhparent = 'matches'::regclass")
+        if session.cursor.fetchone()[0] != 1:
+            raise ValueError("deleteTournaments should drop the matches partitions of every tournament.")
+    print("63. deleteTournaments and deletePlayers truncate and start the numbering again.")
+
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    tournament2 = createTournament("t2")
+    players = registerPlayers("Player %d" % i for i in range(4))
+    for tid in (tournament1, tournament2):
+        addPlayersToTournament(players, tid)
+        reportMatches([(players[0], players[1]), (players[2], players[3])], tid)
+    standings2 = playerStandings(tournament2)
+    archive = archiveTournament(tournament1)
+    with Session() as session:
+        session.cursor.execute("SELECT winner_id, loser_id FROM {0} ORDER BY match_id".format(archive))
+        archived = session.cursor.fetchall()
+        session.cursor.execute("SELECT count(*) FROM matches")
+        live = session.cursor.fetchone()[0]
+        session.cursor.execute("DROP TABLE {0}".format(archive))
+    if archive != "archived_matches_%d" % tournament1 or archived != [(players[0], players[1]),
+                                                                       (players[2], players[3])]:
+        raise ValueError("archiveTournament should keep the tournament's matches in an archive table.")
+    if live != 2 or playerStandings(tournament2) != standings2 or countPlayers(tournament1) != 0:
+        raise ValueError("archiveTournament should remove only the archived tournament.")
+    try:
+        archiveTournament(tournament1)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("archiveTournament should refuse an unknown tournament.")
+    print("64. archiveTournament detaches a tournament's matches partition into an archive table.")
+
+def testRatings():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    [p1, p2, p3, p4] = registerPlayers(["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie"])
+    addPlayersToTournament([p1, p2, p3, p4], tournament1)
+    (round_no, [(id1, name1, id2, name2), (id3, name3, id4, name4)]) = startRound(tournament1)
+    reportMatches([(id1, id2), (id3, id4, True)], tournament1)
+    ratings = rateRound(tournament1)
+    if ratings != {id1: INITIAL_RATING + 16, id2: INITIAL_RATING - 16, id3: INITIAL_RATING, id4: INITIAL_RATING}:
+        raise ValueError("rateRound should move equally rated players by half the K-factor, and not on a draw.")
+    for call in (lambda: rateRound(tournament1), lambda: rateRound(tournament1, 2)):
+        try:
+            call()
+        except ValueError:
+            pass
+        else:
+            raise ValueError("rateRound should refuse a round that was rated or never started.")
+    (round_no, pairings) = startRound(tournament1)
+    try:
+        rateRound(tournament1)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("rateRound should refuse a round with matches still to be reported.")
+    reportMatches([(id1, id2) for (id1, name1, id2, name2) in pairings], tournament1)
+    rateRound(tournament1)
+    with Session() as session:
+        session.cursor.execute("SELECT player_id, rating FROM players ORDER BY player_id")
+        rated = session.cursor.fetchall()
+        session.cursor.execute("UPDATE players SET rating = 0")
+    if recomputeRatings() != 4:
+        raise ValueError("recomputeRatings should replay every match.")
+    with Session() as session:
+        session.cursor.execute("SELECT player_id, rating FROM players ORDER BY player_id")
+        recomputed = session.cursor.fetchall()
+    if any(old[0] != new[0] or abs(old[1] - new[1]) > 1e-9 for (old, new) in zip(rated, recomputed)):
+        raise ValueError("recomputeRatings should give the ratings of rating every round in order.")
+    print("65. rateRound rates a round in one batch, and recomputeRatings replays every round again.")
+
+    # NumPy is only needed for ratings
+    from ratings import CopyBinaryRows, readCopyBinary
+    copy_query = "COPY (SELECT winner_id, loser_id FROM matches ORDER BY match_id) TO STDOUT WITH (FORMAT binary)"
+    data = io.BytesIO()
+    # Chunks smaller than a row, so that the header and most rows arrive in pieces
+    sink = CopyBinaryRows(("winner_id", "loser_id"), chunk_size=5)
+    with Session() as session:
+        session.cursor.copy_expert(copy_query, data)
+        session.cursor.copy_expert(copy_query, sink)
+    rows = sink.rows()
+    if sorted(rows.tolist()) != sorted(getPlayedMatches(tournament1)) or \
+            rows.tolist() != readCopyBinary(data.getvalue(), ("winner_id", "loser_id")).tolist():
+        raise ValueError("A binary COPY should parse the same however it is split into chunks.")
+    print("66. recomputeRatings parses its COPY a chunk at a time as it arrives.")
+
+    deleteMatches()
+    with Session() as session:
+        session.cursor.execute("UPDATE players SET rating = 1400 + 100 * (player_id - %s)", (p1,))
+    # Sorted by rating the group is p4, p3, p2, p1, and its top half plays its bottom half
+    expected = [(p4, "Pinkie Pie", p2, "Fluttershy"), (p3, "Applejack", p1, "Twilight Sparkle")]
+    if swissPairings(tournament1) != expected or swissPairings(tournament1, server_side=True) != expected:
+        raise ValueError("swissPairings should pair the top half of a score group by rating against the bottom half.")
+    state = TournamentState.load(tournament1)
+    if state.swissPairings() != expected:
+        raise ValueError("A TournamentState should pair by rating as swissPairings does.")
+    if pairing.ratingOrder([2, 2, 2, 2, 2, 0], [0, 0, -1, 0, 0, 0], [1500, 1600, 1400, 1700, 1550, 2000]) != \
+            [2, 1, 3, 4, 0, 5]:
+        raise ValueError("ratingOrder should keep down floaters first and fold each score group by rating.")
+    print("67. swissPairings sorts score groups by rating so the top half plays the bottom half.")
+
+def testSimulateOutcomes():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    [p1, p2, p3, p4] = registerPlayers(["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie"])
+    addPlayersToTournament([p1, p2, p3, p4], tournament1)
+    reportMatches([(p1, p2), (p3, p4)], tournament1)
+    outcomes = simulateOutcomes(tournament1, 1, trials=2000, top=(1, 2), batch_size=300, seed=5)
+    chances = dict((row[0], row[4]) for row in outcomes)
+    if [row[0] for row in outcomes] != [row[0] for row in playerStandings(tournament1)]:
+        raise ValueError("simulateOutcomes should list the players in standings order.")
+    if abs(sum(chance[0] for chance in chances.values()) - 1) > 1e-9 or \
+            abs(sum(chance[1] for chance in chances.values()) - 2) > 1e-9:
+        raise ValueError("Every trial should have one winner and two players in the top two.")
+    # The winners meet in the last round, so a player who lost the first cannot catch up with both of them
+    if chances[p2][0] or chances[p4][0] or not 0.4 < chances[p1][0] < 0.6:
+        raise ValueError("simulateOutcomes should pair the remaining rounds as swissPairings does.")
+    if abs(sum(row[3] for row in outcomes) - 4) > 1e-9:
+        raise ValueError("Two rounds without draws should hand out four points in every trial.")
+    if simulateOutcomes(tournament1, 1, trials=2000, top=(1, 2), batch_size=300, seed=5) != outcomes:
+        raise ValueError("simulateOutcomes should give the same chances for the same seed.")
+    try:
+        simulateOutcomes(tournament1, 1, trials=0)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("simulateOutcomes should refuse to run no trials.")
+    print("68. simulateOutcomes plays the remaining rounds in batches of trials and gives each player's chances.")
+
+def testReadPool():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    # The same database stands in for a replica: it is not replaying, so its own WAL position is compared
+    configureReadPool(tournament.DBNAME, min_size=0, max_wait=0.05)
+    try:
+        before = getReadStats()
+        tournament1 = createTournament("t1")
+        [p1, p2] = registerPlayers(["Twilight Sparkle", "Fluttershy"])
+        addPlayersToTournament([p1, p2], tournament1)
+        reportMatch(p1, p2, tournament1)
+        if getLastWriteLsn() is None:
+            raise ValueError("Commits should record their WAL position while reads are routed.")
+        if countPlayers(tournament1) != 2 or [row[2] for row in playerStandings(tournament1)] != [1, 0] or \
+                getPlayedMatches(tournament1) != [(p1, p2)]:
+            raise ValueError("Reads from the read pool should see the thread's own writes.")
+        after = getReadStats()
+        if after['replica'] - before['replica'] != 3 or after['fallbacks'] != before['fallbacks']:
+            raise ValueError("Reads should go to the read pool, and writes to the primary.")
+        print("69. Reads go to the read pool once it has the thread's writes.")
+
+        results = []
+
+        def readAhead():
+            # A position the stand-in has not reached yet, in a thread of its own
+            setLastWriteLsn("FFFFFFFF/0")
+            results.append(countPlayers(tournament1))
+        reader = threading.Thread(target=readAhead)
+        reader.start()
+        reader.join()
+        if results != [2] or getReadStats()['fallbacks'] != after['fallbacks'] + 1:
+            raise ValueError("A read should go to the primary when the read pool is too far behind.")
+        if countPlayers(tournament1) != 2 or getReadStats()['fallbacks'] != after['fallbacks'] + 1:
+            raise ValueError("Each thread should only wait for its own writes.")
+        print("70. Reads fall back to the primary when the read pool falls behind, per thread.")
+
+        idle = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        with Session() as session:
+            countPlayers(tournament1, session=session)
+            session.commit()
+            if session.lsn or session.connection.get_transaction_status() != idle:
+                raise ValueError("A session that only read should not record a WAL position.")
+            [p3] = registerPlayers(["Rarity"], session=session)
+            session.commit()
+            if not session.lsn or session.connection.get_transaction_status() != idle:
+                raise ValueError("A commit should record its WAL position without opening a transaction.")
+        if getLastWriteLsn(session) != tournament._lsnText(session.lsn):
+            raise ValueError("getLastWriteLsn should give a session's WAL position.")
+
+        def readAfter(after):
+            with readSession(after) as reader:
+                results.append(countPlayers(session=reader))
+        before = getReadStats()
+        for after in (session, "FFFFFFFF/0"):
+            reader = threading.Thread(target=readAfter, args=(after,))
+            reader.start()
+            reader.join()
+        after = getReadStats()
+        if results[-2:] != [3, 3] or after['replica'] - before['replica'] != 1 or \
+                after['fallbacks'] - before['fallbacks'] != 1:
+            raise ValueError("readSession should wait for the writes of the session it is given, in any thread.")
+    finally:
+        configureReadPool(None)
+    print("71. A session records the WAL position of its writes only, for reads in any thread.")
+
+def testCareers():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    tournament2 = createTournament("t2")
+    [p1, p2, p3] = registerPlayers(["Twilight Sparkle", "Fluttershy", "Applejack"])
+    addPlayersToTournament([p1, p2, p3], tournament1)
+    addPlayersToTournament([p1, p2], tournament2)
+    reportMatch(p1, p2, tournament1)
+    reportMatch(p3, p1, tournament1, draw=True)
+    reportBye(p2, tournament1)
+    reportMatches([(p2, p1)], tournament2)
+    if playerCareer(p1) != (p1, "Twilight Sparkle", 2, 1, 1, 1, 3, 1.5, 0.75) or \
+            playerCareer(p2) != (p2, "Fluttershy", 2, 2, 0, 1, 3, 2.0, 1.0):
+        raise ValueError("playerCareer should add up every tournament the player entered.")
+    if headToHead(p1, p2) != (1, 0, 1) or headToHead(p3, p1) != (0, 1, 0) or headToHead(p2, p3) != (0, 0, 0):
+        raise ValueError("headToHead should count the wins of each player and the draws between them.")
+    print("72. playerCareer and headToHead add up the matches of every tournament.")
+
+    deleteMatches(tournament2)
+    if playerCareer(p1)[2:] != (2, 1, 1, 0, 2, 1.5, 0.75) or headToHead(p2, p1) != (0, 0, 1):
+        raise ValueError("Deleting matches should take them off careers and head-to-head records.")
+    archive = archiveTournament(tournament1)
+    with Session() as session:
+        session.cursor.execute("DROP TABLE {0}".format(archive))
+    if playerCareer(p1)[2:] != (2, 1, 1, 0, 2, 1.5, 0.75):
+        raise ValueError("An archived tournament should stay in its players' careers.")
+    deleteTournaments()
+    if playerCareer(p1)[2:] != (0, 0, 0, 0, 0, 0.0, 0.0) or headToHead(p1, p2) != (0, 0, 0):
+        raise ValueError("Deleting the tournaments should clear the careers.")
+    deletePlayers()
+    try:
+        playerCareer(p1)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("playerCareer should reject unknown players.")
+    print("73. Careers follow deleted matches, keep archived tournaments and are cleared by resets.")
+
+def testPreparedStatements():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament1 = createTournament("t1")
+    [p1, p2, p3] = registerPlayers(["Twilight Sparkle", "Fluttershy", "Applejack"])
+    addPlayersToTournament([p1, p2, p3], tournament1)
+    reportMatch(p1, p2, tournament1)
+    configureStatements()
+    pool = tournament.ConnectionPool(tournament.DBNAME, min_size=0, max_size=1)
+    try:
+        with Session(pool) as session:
+            for _ in range(3):
+                countPlayers(tournament1, session=session)
+            reportMatch(p3, p1, tournament1, session=session)
+            session.rollback()
+            standings = playerStandings(tournament1, session=session)
+            stats = getStatementStats(session)
+    finally:
+        pool.closeall()
+    counts = stats['count_tournament_players']
+    if (counts['prepares'], counts['executes'], counts['hits']) != (1, 3, 2) or \
+            counts['generic_plans'] + counts['custom_plans'] != 3:
+        raise ValueError("A statement should be prepared once per connection and executed by name after that.")
+    if stats['player_standings']['prepares'] != 1 or [row[2] for row in standings] != [1, 0, 0]:
+        raise ValueError("Prepared statements should outlive a rolled back transaction.")
+    print("74. Hot queries are prepared once per connection and executed by name.")
+
+    configureStatements(prepare=False)
+    try:
+        if playerStandings(tournament1) != standings or getStatementStats():
+            raise ValueError("With preparing turned off, queries should be sent as text, with the same results.")
+    finally:
+        configureStatements()
+    print("75. Preparing statements can be turned off.")
+
+# Number of matches seeded to check that queries use indexes at scale
+SEEDED_MATCHES = 1000000
+
+def explainLastQuery(session):
+    """Returns the plan of the last statement run on a session's cursor."""
+    session.cursor.execute("EXPLAIN " + session.cursor.query.decode())
+    return "\n".join(row[0] for row in session.cursor.fetchall())
+
+def testQueriesUseIndexes():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournaments = [createTournament("t%d" % i) for i in range(100)]
+    players = registerPlayers("Player %d" % i for i in range(1000))
+    with Session() as session:
+        for tournament in tournaments:
+            addPlayersToTournament(players, tournament, session=session)
+        # Statistics taken by autovacuum while these standings were uncommitted say that the table is empty, and
+        # the trigger counting the matches below would then plan for a handful of standings, not 100,000
+        session.cursor.execute("ANALYZE standings")
+        session.cursor.execute("""
+        INSERT INTO rounds(tournament_id, round_no)
+        SELECT tournament_id, round_no FROM unnest(%s) AS tournament_id, generate_series(1, 10) AS round_no
+        """, (tournaments,))
+        # Spread the matches over the tournaments and their rounds, never pairing a player with themselves
+        session.cursor.execute("""
+        INSERT INTO matches(winner_id, loser_id, tournament_id, round_no)
+        SELECT (%s)[1 + n %% 1000], (%s)[1 + (n + 1 + n / 1000 %% 999) %% 1000], (%s)[1 + n %% 100],
+               1 + n / 100000
+        FROM generate_series(0, %s - 1) AS n
+        """, (players, players, tournaments, SEEDED_MATCHES))
+    db, cursor = connect()
+    db.autocommit = True
+    cursor.execute("ANALYZE")
+    db.close()
+
+    with Session() as session:
+        for (name, call) in (("getPlayedMatches", lambda: getPlayedMatches(tournaments[0], session=session)),
+                             ("playerStandings", lambda: playerStandings(tournaments[0], session=session)),
+                             ("countPlayers", lambda: countPlayers(tournaments[0], session=session)),
+                             ("getPairingState", lambda: getPairingState(tournaments[0], session=session)),
+                             ("getCurrentRound", lambda: getCurrentRound(tournaments[0], session=session)),
+                             ("roundPairings", lambda: roundPairings(tournaments[0], session=session)),
+                             ("playerCareer", lambda: playerCareer(players[0], session=session)),
+                             ("headToHead", lambda: headToHead(players[0], players[1], session=session))):
+            call()
+            plan = explainLastQuery(session)
+            # Reading the whole of the tournament's own matches partition is as good as an index scan
+            own_partition = "matches_%d" % tournaments[0]
+            partitions = set(re.findall(r"\bmatches_\d+\b", plan))
+            if (partitions - set([own_partition]) or "Seq Scan on standings" in plan or
+                    ("Index" not in plan and "Seq Scan on " + own_partition not in plan)):
+                raise ValueError("{0}() should use index scans, not:\n{1}".format(name, plan))
+    print("76. Standings, counts, played matches, pairing state, rounds and careers are index scans or read one "
+          "partition on 1M matches.")
+    deleteTournaments()
+
 if __name__ == '__main__':
     testDeleteMatches()
     testDelete()
@@ -581,6 +1664,29 @@ if __name__ == '__main__':
     testDeleteMatchesByTournament()
     testPlayerStandings()
     testPairingByTournament()
+    testSessions()
+    testStandingsAfterDeletes()
+    testRematchAvoidance()
+    testOptimalPairings()
+    testBulkOperations()
+    testTournamentState()
+    testTiebreaks()
+    testStandingsCache()
+    testValidation()
+    testInstrumentation()
+    testPairingState()
+    testRounds()
+    testByesAndDraws()
+    testImportExport()
+    testPairAll()
+    testServerSidePairings()
+    testResetAndArchive()
+    testRatings()
+    testSimulateOutcomes()
+    testReadPool()
+    testCareers()
+    testPreparedStatements()
+    testQueriesUseIndexes()
     print("Success!  All tests pass!")
 
 